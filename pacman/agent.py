@@ -1,20 +1,60 @@
+# move directions as (dx, dy): up, down, left, right
+DIRECTIONS = ((0, -1), (0, 1), (-1, 0), (1, 0))
+
+# move tables shared by the agents of the same map, key: (width, height, map_string), value: see get_move_tables
+_move_tables = {}
+
+
 class Agent:
     """
     The agent may be a pacman or ghost.
     This class specifies basic information and methods for an agent.
+
+    Agents are created for every game state, including the batches of the parallel trainers, so their attributes
+    are declared in __slots__: no per-instance __dict__, and faster attribute access in the update loop.
     """
 
-    def __init__(self, game_map, location_index, player_number):
+    __slots__ = ('label', 'game_map', 'legal_actions', 'random_moves', 'random_stream', 'x', 'y', 'initial_x',
+                 'initial_y', 'player_number', 'move_direction', 'available_direction', 'chosen_action', 'dead',
+                 'agent_bit')
+
+    def __init__(self, game_map, location_index, player_number, move_tables, random_stream):
         self.label = 'A'
         self.game_map = game_map
+        self.legal_actions, self.random_moves = move_tables
+        # the RandomStream of the game state, shared by its agents
+        self.random_stream = random_stream
         self.x, self.y = location_index
+        self.initial_x, self.initial_y = location_index
         self.player_number = player_number
         self.move_direction = (0, 0)
         self.dead = False
+        # bit of the agent in the occupants of the grids, set by the game state, see GameGrid
+        self.agent_bit = 0
 
     def __repr__(self):
         return self.label
 
+    def reset(self):
+        """
+        Restore the agent to its initial location and status, the grids are restored by the game state
+        """
+        self.x, self.y = self.initial_x, self.initial_y
+        self.move_direction = (0, 0)
+        self.dead = False
+
+    def snapshot(self):
+        """
+        return: the mutable status of the agent, see restore
+        """
+        return self.x, self.y, self.move_direction, self.dead
+
+    def restore(self, snapshot):
+        """
+        Restore the status of the agent from a snapshot, the grids are restored by the game state
+        """
+        self.x, self.y, self.move_direction, self.dead = snapshot[:4]
+
     def update(self):
         """
         Update the location of the agent according to its strategy
@@ -28,20 +68,22 @@ class Agent:
     def update_location(self):
         """
         Attempt to move the agent to its move_direction,
-        will success if the next location is not a wall
+        will success if the next location is not a wall. Staying, direction (0, 0), leaves the grids unchanged.
         """
-        if not self.is_direction_blocked(self.move_direction):
+        if self.move_direction != (0, 0) and not self.is_direction_blocked(self.move_direction):
             next_x, next_y = self.x + self.move_direction[0], self.y + self.move_direction[1]
-            self.game_map[next_y][next_x].add_object(self)
-            self.game_map[self.y][self.x].remove_object(self)
+            self.game_map[next_y][next_x].add_agent(self)
+            self.game_map[self.y][self.x].remove_agent(self)
             self.x, self.y = next_x, next_y
 
     def update_grid(self):
         """
         Call update on the grid which the agent is belonged to, will handle interaction between agents and
-        static objects on the map
+        static objects on the map. A grid no agent entered since its last update has nothing to resolve.
         """
-        self.game_map[self.y][self.x].update()
+        grid = self.game_map[self.y][self.x]
+        if grid.needs_update:
+            grid.update()
 
     def get_location(self):
         return self.x, self.y
@@ -55,11 +97,10 @@ class Agent:
 
     def destory(self):
         self.dead = True
-        self.game_map[self.y][self.x].remove_object(self)
+        self.game_map[self.y][self.x].remove_agent(self)
 
     def update_available_action(self):
-        self.available_direction = [direction for direction in [(0, -1), (0, 1), (-1, 0), (1, 0)] if
-                                    not self.is_direction_blocked(direction)]
+        self.available_direction = self.legal_actions[self.y][self.x]
 
     def set_action(self, action):
         self.chosen_action = action
@@ -75,7 +116,8 @@ class Agent:
             self.get_random_strategy_move()
         elif self.player_number in [1, 2]:
             self.get_human_move()
-        elif self.player_number == 3:
+        elif self.player_number in [3, 4]:
+            # actions chosen by a learning agent (3) or a planning agent (4)
             self.get_learning_agent_move()
 
     def get_human_move(self):
@@ -91,12 +133,43 @@ class Agent:
                 clear_key_commands(self.player_number)
 
     def get_random_strategy_move(self):
-        import random
-
-        last_direction = - self.move_direction[0], - self.move_direction[1]
-        chosen_direction = [direction for direction in self.available_direction if direction != last_direction]
-        chosen_direction = chosen_direction if len(chosen_direction) > 0 else self.available_direction
-        self.move_direction = random.choice(chosen_direction)
+        self.move_direction = self.random_stream.choice(self.random_moves[self.y][self.x][self.move_direction])
 
     def get_learning_agent_move(self):
         self.move_direction = self.chosen_action
+
+
+# -------------------- helper methods --------------------
+
+def get_move_tables(width, height, map_string):
+    """
+    Precompute the moves of every grid of a map, once per map
+    return: (legal_actions, random_moves)
+        legal_actions[y][x]: tuple of the directions not blocked by a wall, in DIRECTIONS order
+        random_moves[y][x]: dict, key: last move direction, value: tuple of the directions the random strategy
+        chooses from, which are the legal directions except turning back, unless turning back is the only move
+    """
+    key = width, height, map_string
+    if key in _move_tables:
+        return _move_tables[key]
+
+    def is_open(x, y):
+        return 0 <= x < width and 0 <= y < height and map_string[y * width + x] != '#'
+
+    legal_actions = tuple(tuple(tuple(direction for direction in DIRECTIONS
+                                      if is_open(x + direction[0], y + direction[1])) for x in range(width))
+                          for y in range(height))
+
+    random_moves = []
+    for row in legal_actions:
+        random_moves.append([])
+        for legal in row:
+            moves = {}
+            for last_direction in DIRECTIONS + ((0, 0),):
+                reverse_direction = - last_direction[0], - last_direction[1]
+                moves[last_direction] = tuple(direction for direction in legal
+                                              if direction != reverse_direction) or legal
+            random_moves[-1].append(moves)
+
+    _move_tables[key] = legal_actions, random_moves
+    return legal_actions, random_moves
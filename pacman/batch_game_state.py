@@ -0,0 +1,566 @@
+import random
+import numpy as np
+from pacman.agent import DIRECTIONS
+from pacman.experience import Transitions
+from pacman.game_state import GameState, ZOBRIST_INVULNERABLE_KEY, calculate_zobrist_hash
+from pacman.game_state_repr import SimpleGameStateRepr
+from pacman.q_learning import ArrayQLearning
+from pacman.random_stream import RNG_BLOCK_SIZE
+from pacman.util import get_grid_index, to_bitboard
+
+REVERSE_DIRECTION = np.array([1, 0, 3, 2])
+STATUS = ('ongoing', 'win', 'lose')
+ONGOING, WIN, LOSE = range(3)
+
+# same timers as Pacman.powerup_time and Ghost.respawn_time
+POWERUP_TIME = 40
+RESPAWN_TIME = 30
+
+
+class BatchGameState:
+    """
+    A batch game state simulates many games of the same level at once, following the rules of GameState.
+
+    Each game is a row of stacked NumPy arrays (food, powerups, agent locations and timers, counters), and step()
+    advances every ongoing game by one time step. Agents are processed in the same order as GameState.update, each
+    agent move being vectorized over all games, so a game of the batch ends with the same game status and score as
+    a GameState given the same pacman actions and ghost moves.
+
+    Pacman actions are given by the caller as direction indices into DIRECTIONS (-1 to stay), ghosts follow the
+    random strategy. Each game has a random stream of its own consumed as a RandomStream: numbers are drawn from a
+    generator seeded by the seed of the game, RNG_BLOCK_SIZE at a time as float32, and a moving ghost takes one
+    number only if it has more than one move to choose from. So a game and a GameState of the same seed given the
+    same pacman actions play the same ghost moves.
+    """
+
+    def __init__(self, width, height, map_string, num_games, seeds=None):
+        self.width = width
+        self.height = height
+        self.map_string = map_string
+        self.num_games = num_games
+        self.load_map(width, height, map_string)
+
+        n, p, g, size = num_games, self.num_pacmans, self.num_ghosts, width * height
+        self.base = np.arange(n) * size
+        self.food = np.empty((n, size), dtype=bool)
+        self.powerup = np.empty((n, size), dtype=bool)
+
+        # agent arrays are agent-major, so that the columns of one agent are contiguous over games. Grids are not
+        # indexed by the agents on them, a level has few agents and comparing locations is cheaper than a lookup.
+        self.pacman_pos = np.empty((p, n), dtype=np.intp)
+        self.pacman_dir = np.empty((p, n), dtype=np.intp)
+        self.pacman_dead = np.empty((p, n), dtype=bool)
+        self.pacman_timer = np.empty((p, n), dtype=np.int16)
+
+        self.ghost_pos = np.empty((g, n), dtype=np.intp)
+        self.ghost_dir = np.empty((g, n), dtype=np.intp)
+        self.ghost_dead = np.empty((g, n), dtype=bool)
+        self.ghost_timer = np.empty((g, n), dtype=np.int16)
+
+        self.cur_dots_counter = np.empty(n, dtype=np.int32)
+        self.ghost_killed_counter = np.empty(n, dtype=np.int32)
+        self.time_count = np.empty(n, dtype=np.int32)
+        self.score_count = np.empty(n, dtype=np.int32)
+        self.last_score = np.empty(n, dtype=np.int32)
+        self.game_status = np.empty(n, dtype=np.int8)
+
+        self.rngs = [None] * n
+        self.rng_block = np.empty((n, RNG_BLOCK_SIZE), dtype=np.float32)
+        self.rng_cursor = np.empty(n, dtype=np.intp)
+
+        if seeds is None:
+            seeds = np.random.SeedSequence().generate_state(n, dtype=np.uint64)
+        self.reset(seeds=seeds)
+
+    def load_map(self, width, height, map_string):
+        """
+        Compile the static parts of the level: wall mask, initial food/powerup, spawn locations, and for every grid
+        the neighbour grid in each direction and the random strategy moves of a ghost arriving from each direction.
+
+        Direction tables have a fifth column for direction -1, meaning staying in place or no last direction.
+        """
+        cells = np.array(list(map_string))
+        if cells.size != width * height:
+            raise ValueError('map string of size %d does not match a %dx%d map' % (cells.size, width, height))
+        undefined = set(map_string) - set('#*@PM ')
+        if undefined:
+            raise ValueError('Undefined map object: %s' % undefined.pop())
+
+        self.wall = cells == '#'
+        self.initial_food = cells == '*'
+        self.initial_powerup = cells == '@'
+        self.pacman_spawn = np.flatnonzero(cells == 'P')
+        self.ghost_spawn = np.flatnonzero(cells == 'M')
+        self.num_pacmans, self.num_ghosts = self.pacman_spawn.size, self.ghost_spawn.size
+        self.original_dots_counter = int(self.initial_food.sum())
+        self.open_grids = np.flatnonzero(~self.wall)
+        self.grid_index = get_grid_index(width, height, map_string).reshape(-1)
+        self.wall_bitboard = to_bitboard(self.wall)
+
+        size = width * height
+        index = np.arange(size)
+        x, y = index % width, index // width
+        self.neighbour = np.tile(index[:, None], (1, 5))
+        self.legal = np.ones((size, 5), dtype=bool)
+        for d, (dx, dy) in enumerate(DIRECTIONS):
+            next_x, next_y = x + dx, y + dy
+            inside = (next_x >= 0) & (next_x < width) & (next_y >= 0) & (next_y < height)
+            self.neighbour[inside, d] = next_y[inside] * width + next_x[inside]
+            self.legal[:, d] = inside & ~self.wall[self.neighbour[:, d]]
+
+        # random strategy: avoid turning back unless it is the only way out
+        legal = self.legal[:, :4]
+        self.ghost_choice = np.full((size, 5, 4), -1, dtype=np.intp)
+        self.ghost_choice_count = np.empty((size, 5), dtype=np.intp)
+        for last_direction in range(5):
+            candidates = legal.copy()
+            if last_direction < 4:
+                candidates[:, REVERSE_DIRECTION[last_direction]] = False
+            blocked = ~candidates.any(axis=1)
+            candidates[blocked] = legal[blocked]
+            count = candidates.sum(axis=1)
+            order = np.argsort(~candidates, axis=1, kind='stable')
+            self.ghost_choice[:, last_direction] = np.where(np.arange(4) < count[:, None], order, -1)
+            self.ghost_choice_count[:, last_direction] = count
+
+    def reset(self, games=None, seeds=None):
+        """
+        Restore the given games (all by default) to the start of the level. If seeds are given, the ghost random
+        generators of those games are re-seeded, otherwise they continue their current streams.
+        """
+        games = np.arange(self.num_games) if games is None else np.asarray(games, dtype=np.intp).reshape(-1)
+
+        self.food[games] = self.initial_food
+        self.powerup[games] = self.initial_powerup
+
+        self.pacman_pos[:, games] = self.pacman_spawn[:, None]
+        self.pacman_dir[:, games] = -1
+        self.pacman_dead[:, games] = False
+        self.pacman_timer[:, games] = 0
+
+        self.ghost_pos[:, games] = self.ghost_spawn[:, None]
+        self.ghost_dir[:, games] = -1
+        self.ghost_dead[:, games] = False
+        self.ghost_timer[:, games] = 0
+
+        self.cur_dots_counter[games] = self.original_dots_counter
+        self.ghost_killed_counter[games] = 0
+        self.time_count[games] = 0
+        self.score_count[games] = 0
+        self.last_score[games] = 0
+        self.game_status[games] = ONGOING
+
+        if seeds is not None:
+            seeds = np.broadcast_to(np.asarray(seeds, dtype=np.uint64), games.shape)
+            for game, seed in zip(games, seeds):
+                self.rngs[game] = np.random.default_rng(int(seed))
+            self.rng_cursor[games] = RNG_BLOCK_SIZE
+
+    def step(self, actions):
+        """
+        Advance every ongoing game by one time step.
+        actions: pacman direction indices of shape (num_games,) or (num_games, num_pacmans), -1 to stay
+        """
+        actions = np.asarray(actions, dtype=np.intp).reshape(self.num_games, self.num_pacmans)
+        active = self.game_status == ONGOING
+        if not active.any():
+            return
+
+        np.copyto(self.last_score, self.score_count, where=active)
+
+        for p in range(self.num_pacmans):
+            self.update_pacman(active, p, actions[:, p])
+
+        self.update_game_status(active)
+
+        ongoing = self.game_status == ONGOING
+        for g in range(self.num_ghosts):
+            self.update_ghost(ongoing, g)
+
+        self.update_game_status(active)
+        self.time_count += active
+        score = (- self.time_count + (self.original_dots_counter - self.cur_dots_counter) * 10 +
+                 self.ghost_killed_counter * 200) * (self.game_status != LOSE)
+        np.copyto(self.score_count, score, where=active)
+
+    def update_pacman(self, active, p, directions):
+        moving = active & ~self.pacman_dead[p]
+        location = self.pacman_pos[p]
+        moved = moving & self.legal[location, directions]
+        next_location = np.where(moved, self.neighbour[location, directions], location)
+
+        self.pacman_pos[p] = next_location
+        np.copyto(self.pacman_dir[p], directions, where=moving)
+        self.update_grid(moving, next_location)
+
+        timer = self.pacman_timer[p]
+        timer -= moving & (timer > 0)
+
+    def update_ghost(self, active, g):
+        moving = active & ~self.ghost_dead[g]
+        location, last_direction = self.ghost_pos[g], self.ghost_dir[g]
+        count = self.ghost_choice_count[location, last_direction]
+        directions = self.ghost_choice[location, last_direction, self.draw_choices(moving & (count > 1), count)]
+        next_location = np.where(moving, self.neighbour[location, directions], location)
+
+        self.ghost_pos[g] = next_location
+        np.copyto(self.ghost_dir[g], directions, where=moving)
+        self.update_grid(moving, next_location)
+
+        dead = active & self.ghost_dead[g]
+        if dead.any():
+            timer = self.ghost_timer[g]
+            np.copyto(timer, np.where(timer == 0, RESPAWN_TIME, timer - 1), where=dead)
+            respawned = dead & (timer == 0)
+            self.ghost_dead[g, respawned] = False
+            self.ghost_pos[g, respawned] = self.ghost_spawn[g]
+
+    def update_grid(self, active, location):
+        """
+        Handle interaction between agents and static objects at the given grid of each active game, as
+        GameGrid.update
+        """
+        has_pacman = active & self.is_occupied(self.pacman_pos, self.pacman_dead, location)
+        collided = has_pacman & self.is_occupied(self.ghost_pos, self.ghost_dead, location)
+        if collided.any():
+            self.resolve_collision(np.flatnonzero(collided), location[collided])
+            has_pacman = active & self.is_occupied(self.pacman_pos, self.pacman_dead, location)
+
+        games = np.flatnonzero(has_pacman)
+        grid = self.base[games] + location[games]
+        eaten = self.food.reshape(-1)[grid]
+        self.food.reshape(-1)[grid[eaten]] = False
+        self.cur_dots_counter[games[eaten]] -= 1
+
+        eaten = self.powerup.reshape(-1)[grid]
+        if eaten.any():
+            self.powerup.reshape(-1)[grid[eaten]] = False
+            games, location = games[eaten], location[games[eaten]]
+            for p in range(self.num_pacmans):
+                powered = self.pacman_here(games, location, p)
+                self.pacman_timer[p, games[powered]] = POWERUP_TIME
+
+    @staticmethod
+    def is_occupied(agent_pos, agent_dead, location):
+        """
+        Whether any alive agent of the given agent arrays is at the given grid of each game
+        """
+        occupied = np.zeros(location.shape, dtype=bool)
+        for pos, dead in zip(agent_pos, agent_dead):
+            occupied |= (pos == location) & ~dead
+        return occupied
+
+    def resolve_collision(self, games, location):
+        """
+        Ghosts and pacmans meet at the given grids: invulnerable pacmans kill all ghosts on the grid, otherwise all
+        pacmans on the grid die
+        """
+        invulnerable = np.zeros(games.size, dtype=bool)
+        for p in range(self.num_pacmans):
+            invulnerable |= self.pacman_here(games, location, p) & (self.pacman_timer[p, games] > 0)
+
+        for g in range(self.num_ghosts):
+            killed = invulnerable & ~self.ghost_dead[g, games] & (self.ghost_pos[g, games] == location)
+            self.ghost_dead[g, games[killed]] = True
+            self.ghost_killed_counter[games[killed]] += 1
+
+        for p in range(self.num_pacmans):
+            killed = ~invulnerable & self.pacman_here(games, location, p)
+            self.pacman_dead[p, games[killed]] = True
+
+    def pacman_here(self, games, location, p):
+        return ~self.pacman_dead[p, games] & (self.pacman_pos[p, games] == location)
+
+    def update_game_status(self, active):
+        ongoing = active & (self.game_status == ONGOING)
+        lost = ongoing & self.pacman_dead.all(axis=0)
+        self.game_status[lost] = LOSE
+        self.game_status[ongoing & ~lost & (self.cur_dots_counter == 0)] = WIN
+
+    def draw_choices(self, drawing, count):
+        """
+        Choose one of count moves in the drawing games as RandomStream.choice, taking the next number of the stream
+        of each drawing game and refilling exhausted blocks from its generator
+        return: index of the chosen move in each game, 0 in the games not drawing
+        """
+        for game in np.flatnonzero(drawing & (self.rng_cursor == RNG_BLOCK_SIZE)):
+            self.rng_block[game] = self.rngs[game].random(RNG_BLOCK_SIZE, dtype=np.float32)
+            self.rng_cursor[game] = 0
+
+        games = np.flatnonzero(drawing)
+        uniforms = self.rng_block[games, self.rng_cursor[games]].astype(np.float64)
+        self.rng_cursor[games] += 1
+        choices = np.zeros(self.num_games, dtype=np.intp)
+        choices[games] = (uniforms * count[games]).astype(np.intp)
+        return choices
+
+    # -------------------- batch accessors --------------------
+
+    def get_game_status(self):
+        return np.array(STATUS)[self.game_status]
+
+    def is_game_over(self):
+        return self.game_status != ONGOING
+
+    def get_score(self):
+        return self.score_count
+
+    def get_time(self):
+        return self.time_count
+
+    def get_action_reward(self):
+        return self.score_count - self.last_score
+
+    def get_cur_dots_counter(self):
+        return self.cur_dots_counter
+
+    def get_pacman_invulnerable_time(self):
+        return self.pacman_timer.max(axis=0, initial=0)
+
+    def get_pacman_available_action_mask(self, pacman_num=0):
+        """
+        return: bool array of shape (num_games, 4), whether the pacman can move in each of DIRECTIONS
+        """
+        return self.legal[self.pacman_pos[pacman_num], :4]
+
+    def get_state_keys(self, games):
+        """
+        Compute the state keys of the given games at once from the batch arrays, the bitboards of the layers of
+        each game being packed together
+        return: list of the key of each game, the same as SimpleGameStateRepr.get_key of the game
+        """
+        games = np.asarray(games, dtype=np.intp).reshape(-1)
+        rows = np.arange(games.size)
+        layers = np.zeros((4, games.size, self.open_grids.size), dtype=bool)
+        layers[0] = self.food[games[:, None], self.open_grids]
+        layers[1] = self.powerup[games[:, None], self.open_grids]
+        for layer, agent_pos, agent_dead in ((2, self.pacman_pos, self.pacman_dead),
+                                             (3, self.ghost_pos, self.ghost_dead)):
+            for pos, dead in zip(agent_pos[:, games], agent_dead[:, games]):
+                alive = ~dead
+                layers[layer, rows[alive], self.grid_index[pos[alive]]] = True
+
+        packed = np.packbits(layers, axis=2, bitorder='little')
+        row_size = packed.shape[2]
+        bitboards = []
+        for layer in packed:
+            data = layer.tobytes()
+            bitboards.append([int.from_bytes(data[k:k + row_size], 'little') for k in range(0, len(data), row_size)])
+        invulnerable = (self.pacman_timer[:, games] > 0).any(axis=0).tolist()
+        return [(self.wall_bitboard,) + state for state in zip(*bitboards, invulnerable)]
+
+    def get_map_repr(self, games=None):
+        """
+        return: uint8 array of shape (len(games), height, width), with the same grid codes as GameGrid.get_grid_repr
+        """
+        games = np.arange(self.num_games) if games is None else np.asarray(games, dtype=np.intp).reshape(-1)
+        grid_repr = (self.wall * 1 + self.food[games] * 2 + self.powerup[games] * 4).astype(np.uint8)
+        for agent_pos, agent_dead, code in ((self.pacman_pos, self.pacman_dead, 8),
+                                            (self.ghost_pos, self.ghost_dead, 16)):
+            for pos, dead in zip(agent_pos[:, games], agent_dead[:, games]):
+                alive = np.flatnonzero(~dead)
+                grid_repr[alive, pos[alive]] |= code
+        return grid_repr.reshape(games.size, self.height, self.width)
+
+    def get_game(self, game):
+        return BatchGameView(self, game)
+
+
+class BatchGameView:
+    """
+    A read-only view of a single game of a BatchGameState, exposing the GameState methods used by game state
+    representations, so a QLearning agent can share its q table between GameEnv and batch training.
+    """
+
+    def __init__(self, batch_game_state, game):
+        self.batch = batch_game_state
+        self.game = game
+        self.debug_hash = False
+
+    @property
+    def map_repr_list(self):
+        return self.batch.get_map_repr(self.game)[0].tolist()
+
+    def is_pacman_invulnerable(self):
+        return bool((self.batch.pacman_timer[:, self.game] > 0).any())
+
+    def get_bitboards(self):
+        batch, game = self.batch, self.game
+        bitboards = [batch.wall_bitboard, to_bitboard(batch.food[game, batch.open_grids]),
+                     to_bitboard(batch.powerup[game, batch.open_grids])]
+        for agent_pos, agent_dead in ((batch.pacman_pos, batch.pacman_dead), (batch.ghost_pos, batch.ghost_dead)):
+            alive = ~agent_dead[:, game]
+            bitboards.append(sum(1 << int(k) for k in set(batch.grid_index[agent_pos[alive, game]])))
+        return tuple(bitboards)
+
+    def get_state_key(self):
+        board_hash = calculate_zobrist_hash(self.batch.get_map_repr(self.game), self.batch.width * self.batch.height)
+        return board_hash ^ (ZOBRIST_INVULNERABLE_KEY if self.is_pacman_invulnerable() else 0)
+
+    def get_pacman_invulnerable_time(self):
+        return int(self.batch.pacman_timer[:, self.game].max(initial=0))
+
+    def get_pacman_available_action(self, pacman_num=0):
+        return self.get_available_action(self.batch.pacman_pos[pacman_num, self.game])
+
+    def get_ghost_available_action(self, ghost_num=0):
+        return self.get_available_action(self.batch.ghost_pos[ghost_num, self.game])
+
+    def get_available_action(self, location):
+        return [direction for direction, legal in zip(DIRECTIONS, self.batch.legal[location, :4]) if legal]
+
+    def get_state(self):
+        return SimpleGameStateRepr(self)
+
+
+# -------------------- helper methods --------------------
+
+def check_parity(width, height, map_string, num_games, num_ticks, seed=0):
+    """
+    Play num_games games of a map for num_ticks ticks at most, in a BatchGameState and in GameStates of the same
+    seeds given the same random pacman actions, comparing the agents, the score and the game status of every game
+    after every tick. Raises ValueError at the first difference.
+    return: number of ticks compared over all games
+    """
+    seeds = np.random.SeedSequence(seed).generate_state(num_games, dtype=np.uint64)
+    batch = BatchGameState(width, height, map_string, num_games, seeds)
+    game_states = [GameState(width, height, map_string, 3, 0, seed=int(game_seed)) for game_seed in seeds]
+    actions = np.random.default_rng(seed).integers(-1, len(DIRECTIONS), size=(num_ticks, num_games,
+                                                                                batch.num_pacmans))
+    ticks = 0
+    for tick in range(num_ticks):
+        games = np.flatnonzero(~batch.is_game_over())
+        if games.size == 0:
+            break
+        batch.step(actions[tick])
+        for game in games.tolist():
+            game_state = game_states[game]
+            for pacman, action in zip(game_state.pacmans, actions[tick, game].tolist()):
+                pacman.set_action(DIRECTIONS[action] if action >= 0 else (0, 0))
+            game_state.update()
+            ticks += 1
+
+            expected = (game_state.get_game_status(), game_state.get_score(),
+                        [(agent.y * width + agent.x, agent.is_dead()) for agent in game_state.pacmans],
+                        [(agent.y * width + agent.x, agent.is_dead()) for agent in game_state.ghosts])
+            actual = (STATUS[batch.game_status[game]], int(batch.score_count[game]),
+                      list(zip(batch.pacman_pos[:, game].tolist(), batch.pacman_dead[:, game].tolist())),
+                      list(zip(batch.ghost_pos[:, game].tolist(), batch.ghost_dead[:, game].tolist())))
+            if actual != expected:
+                raise ValueError('game %d of seed %d differs from its GameState at tick %d: %s, expected %s' %
+                                 (game, seeds[game], tick, actual, expected))
+    return ticks
+
+
+def run_q_learning(batch_game_state, learning_agent, num_episodes):
+    """
+    Train a QLearning agent on all games of the batch, resetting games as they finish, until num_episodes games
+    are played. An ArrayQLearning agent learning transitions one by one is trained by run_array_q_learning, other
+    agents are given a BatchGameView state of each game.
+    return: list of (game status, score) of the finished episodes
+    """
+    if isinstance(learning_agent, ArrayQLearning) and learning_agent.experience is None:
+        return run_array_q_learning(batch_game_state, learning_agent, num_episodes)
+
+    batch = batch_game_state
+    batch.reset()
+    results = []
+    actions = np.full(batch.num_games, -1, dtype=np.intp)
+    direction_index = {direction: d for d, direction in enumerate(DIRECTIONS)}
+
+    while len(results) < num_episodes:
+        games = np.flatnonzero(~batch.is_game_over())
+        states = {}
+        for game in games:
+            state = batch.get_game(game).get_state()
+            chosen_action = learning_agent.get_state_chosen_action(state, state.get_pacman_action())
+            states[game] = state, chosen_action
+            actions[game] = direction_index[chosen_action]
+
+        batch.step(actions)
+
+        rewards = batch.get_action_reward()
+        for game, (state, chosen_action) in states.items():
+            next_state = batch.get_game(game).get_state()
+            learning_agent.update_q_value(state, chosen_action, next_state, int(rewards[game]),
+                                          bool(batch.game_status[game] != ONGOING))
+
+        finished = np.flatnonzero(batch.is_game_over())
+        for game in finished:
+            if len(results) < num_episodes:
+                results.append((STATUS[batch.game_status[game]], int(batch.score_count[game])))
+        batch.reset(finished)
+
+    return results
+
+
+def run_array_q_learning(batch_game_state, learning_agent, num_episodes):
+    """
+    Train an ArrayQLearning agent on the batch arrays directly: the state keys of all games are computed at once
+    by get_state_keys, the actions are chosen from the q value rows of the games, and the transitions of a time
+    step are learned together by update_q_values, from the q values before the step.
+    return: list of (game status, score) of the finished episodes
+    """
+    batch = batch_game_state
+    q_table = learning_agent.q_table
+    batch.reset()
+    results = []
+    actions = np.full(batch.num_games, -1, dtype=np.intp)
+    action_bits = 1 << np.arange(len(DIRECTIONS))
+    state_keys = batch.get_state_keys(np.arange(batch.num_games))
+
+    while len(results) < num_episodes:
+        games = np.flatnonzero(~batch.is_game_over())
+        state_ids, state_generations = add_states(q_table, [state_keys[game] for game in games])
+        available = batch.get_pacman_available_action_mask()[games]
+        q_values = q_table.q_values[state_ids]
+        if q_table.generations is not None:
+            # rows evicted by the adds of later games hold another state, whose q values are not used
+            q_values[q_table.generations[state_ids] != state_generations] = 0
+        chosen = np.where(available, q_values, -np.inf).argmax(axis=1)
+        for k in range(games.size):
+            if random.random() < learning_agent.epsilon:
+                chosen[k] = random.choice(np.flatnonzero(available[k]))
+        actions[games] = chosen
+
+        batch.step(actions)
+
+        next_keys = batch.get_state_keys(games)
+        for game, next_key in zip(games.tolist(), next_keys):
+            state_keys[game] = next_key
+        dones = batch.is_game_over()[games]
+        # a final state has no q values to learn from, its own row is not added to the table
+        next_state_ids, next_state_generations = state_ids.copy(), state_generations.copy()
+        ongoing = np.flatnonzero(~dones)
+        next_state_ids[ongoing], next_state_generations[ongoing] = add_states(q_table,
+                                                                              [next_keys[k] for k in ongoing])
+        next_actions = batch.get_pacman_available_action_mask()[games] @ action_bits
+        learning_agent.update_q_values(Transitions(state_ids, state_generations, chosen,
+                                                   batch.get_action_reward()[games].astype(np.float32),
+                                                   next_state_ids, next_state_generations, next_actions, dones))
+
+        finished = np.flatnonzero(batch.is_game_over())
+        for game in finished:
+            if len(results) < num_episodes:
+                results.append((STATUS[batch.game_status[game]], int(batch.score_count[game])))
+        batch.reset(finished)
+        for game, state_key in zip(finished.tolist(), batch.get_state_keys(finished)):
+            state_keys[game] = state_key
+
+    return results
+
+
+def add_states(q_table, state_keys):
+    """
+    Add the states to an array q table, reading the generation of each row right after its add, as adding the
+    next state may evict rows of a bounded q table
+    return: int array of the rows of the states, uint32 array of their generations
+    """
+    state_ids = np.empty(len(state_keys), dtype=np.intp)
+    state_generations = np.zeros(len(state_keys), dtype=np.uint32)
+    generations = q_table.generations
+    for k, state_key in enumerate(state_keys):
+        state_ids[k] = q_table.add_state(state_key)
+        if generations is not None:
+            state_generations[k] = generations[state_ids[k]]
+    return state_ids, state_generations
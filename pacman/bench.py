@@ -0,0 +1,330 @@
+import argparse
+import functools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from pacman.util import read_level
+from pacman.batch_game_state import BatchGameState, check_parity, run_q_learning
+from pacman.game_state import GameState
+from pacman.game_state_repr import SimpleGameStateRepr
+from pacman.game_env import GameEnv
+from pacman.q_learning import QLearning, ArrayQLearning, LinearQLearning
+from pacman.parallel_training import HogwildTrainer
+
+# games stepped at once by the batch game state benchmark, and trained at once by run_q_learning
+BATCH_GAMES = 1024
+BATCH_TRAIN_GAMES = 64
+
+# games and most ticks of each game of the parity check of the batch game state with GameState
+PARITY_GAMES = 100
+PARITY_TICKS = 1000
+
+# states of the bounded q table benchmarked
+BOUNDED_MAX_STATES = 1024
+
+# states of the shared q tables of the hogwild benchmark
+HOGWILD_SHARED_STATES = 1 << 18
+
+# learning agents benchmarked, key: name used in the results
+LEARNING_AGENTS = {
+    'q_learning': QLearning,
+    'array_q_learning': ArrayQLearning,
+    'bounded_q_learning': functools.partial(ArrayQLearning, max_states=BOUNDED_MAX_STATES),
+    'linear_q_learning': LinearQLearning,
+}
+
+# results are worse when larger for these units, better when larger for the others
+LOWER_IS_BETTER = {'us', 'ms', 'bytes'}
+
+
+class Benchmark:
+    """
+    A benchmark runs the throughput and memory measurements of the simulator and the learning agents on some
+    levels, and collects them as a list of results, each a dict of name, level, value and unit.
+
+    Every measurement is repeated until it has run for at least min_time seconds, and the game states and the random
+    module are seeded before each one, so runs are comparable between commits.
+    """
+
+    def __init__(self, levels=(1, 2), min_time=1.0, train_episodes=200, seed=0, hogwild_workers=(1, 2, 4)):
+        self.levels = levels
+        self.min_time = min_time
+        self.train_episodes = train_episodes
+        self.hogwild_workers = hogwild_workers
+        self.seed = seed
+        self.results = []
+
+    def run(self):
+        for level in self.levels:
+            self.bench_update(level)
+            self.bench_episodes(level)
+            self.bench_state_repr(level)
+            self.bench_batch(level)
+            for name, agent_class in LEARNING_AGENTS.items():
+                self.bench_learning_agent(level, name, agent_class)
+            self.bench_hogwild(level)
+        return self.results
+
+    def add_result(self, name, level, value, unit):
+        self.results.append({'name': name, 'level': level, 'value': value, 'unit': unit})
+        print('level %d %-40s %14.2f %s' % (level, name, value, unit))
+
+    # -------------------- simulator --------------------
+
+    def bench_update(self, level):
+        """
+        Raw GameState.update steps per second with random pacman and ghosts
+        """
+        random.seed(self.seed)
+        game_state = GameState(*read_level(level), 0, 0, level=level, seed=self.seed)
+
+        def run():
+            steps = 0
+            game_state.reset()
+            while not game_state.is_game_over():
+                game_state.update()
+                steps += 1
+            return steps
+
+        self.add_result('game_state.update', level, self.measure(run), 'steps/s')
+
+    def bench_episodes(self, level):
+        """
+        Full GameEnv.start_game episodes per second with a random pacman and a q learning pacman
+        """
+        for name, pacman_player in [('random', 0), ('q_learning', 3)]:
+            random.seed(self.seed)
+            game_env = GameEnv(get_cfg(level, pacman_player, self.seed))
+            if pacman_player == 3:
+                game_env.set_learning_agent(QLearning(1, 0.9, 0.1))
+
+            def run():
+                game_env.reset()
+                game_env.start_game()
+                return 1
+
+            self.add_result('game_env.start_game.%s' % name, level, self.measure(run), 'episodes/s')
+
+    def bench_state_repr(self, level):
+        """
+        Cost of constructing a SimpleGameStateRepr, over the states of random games. Only the construction is timed,
+        not the game updates between them.
+        """
+        random.seed(self.seed)
+        game_state = GameState(*read_level(level), 0, 0, level=level, seed=self.seed)
+        constructions, elapsed = 0, 0
+        while elapsed < self.min_time:
+            game_state.reset()
+            while not game_state.is_game_over():
+                game_state.update()
+                start = time.perf_counter()
+                SimpleGameStateRepr(game_state)
+                elapsed += time.perf_counter() - start
+                constructions += 1
+
+        self.add_result('simple_game_state_repr', level, 1e6 * elapsed / constructions, 'us')
+
+    def bench_batch(self, level):
+        """
+        Check that a BatchGameState plays the games of GameStates of the same seeds, then measure its game steps per
+        second with random pacman actions, and the episodes per second of run_q_learning
+        """
+        width, height, map_string = read_level(level)
+        check_parity(width, height, map_string, PARITY_GAMES, PARITY_TICKS, self.seed)
+
+        seeds = np.random.SeedSequence(self.seed).generate_state(BATCH_GAMES, dtype=np.uint64)
+        batch = BatchGameState(width, height, map_string, BATCH_GAMES, seeds)
+        rng = np.random.default_rng(self.seed)
+
+        def run():
+            steps = int((~batch.is_game_over()).sum())
+            batch.step(rng.integers(-1, 4, BATCH_GAMES))
+            batch.reset(np.flatnonzero(batch.is_game_over()))
+            return steps
+
+        self.add_result('batch.step', level, self.measure(run), 'steps/s')
+
+        for name in ('q_learning', 'array_q_learning'):
+            random.seed(self.seed)
+            batch = BatchGameState(width, height, map_string, BATCH_TRAIN_GAMES, seeds[:BATCH_TRAIN_GAMES])
+            learning_agent = LEARNING_AGENTS[name](1, 0.9, 0.1)
+
+            def run():
+                return len(run_q_learning(batch, learning_agent, self.train_episodes))
+
+            self.add_result('batch.run_q_learning.%s' % name, level, self.measure(run), 'episodes/s')
+
+    # -------------------- learning agents --------------------
+
+    def bench_learning_agent(self, level, name, agent_class):
+        """
+        Cost of a q value update, memory and size of the trained q table, and time to save and load the model
+        """
+        random.seed(self.seed)
+        game_env = GameEnv(get_cfg(level, 3, self.seed))
+        learning_agent = agent_class(1, 0.9, 0.1)
+        game_env.set_learning_agent(learning_agent)
+
+        tracemalloc.start()
+        for _ in range(self.train_episodes):
+            game_env.reset()
+            game_env.start_game()
+        q_table_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        transitions = record_transitions(game_env, 20)
+
+        def run():
+            for state, action, next_state, reward in transitions:
+                learning_agent.update_q_value(state, action, next_state, reward)
+            return len(transitions)
+
+        self.add_result('%s.update_q_value' % name, level, 1e6 / self.measure(run), 'us')
+        self.add_result('%s.q_table_entries' % name, level, len(learning_agent.q_table), 'entries')
+        self.add_result('%s.q_table_memory' % name, level, q_table_memory, 'bytes')
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as model_dir:
+            os.chdir(model_dir)
+            try:
+                start = time.perf_counter()
+                learning_agent.save_model(level)
+                self.add_result('%s.save_model' % name, level, 1e3 * (time.perf_counter() - start), 'ms')
+                self.add_result('%s.model_size' % name, level, get_dir_size('model'), 'bytes')
+
+                start = time.perf_counter()
+                agent_class(1, 0.9, 0.1).load_model(level)
+                self.add_result('%s.load_model' % name, level, 1e3 * (time.perf_counter() - start), 'ms')
+            finally:
+                os.chdir(cwd)
+
+    def bench_hogwild(self, level):
+        """
+        Q value updates per second of hogwild training on a shared q table by number of worker processes, and the
+        speedup over the first number of workers. Each round trains train_episodes episodes split over the workers,
+        including starting them.
+        """
+        cfg = dict(get_cfg(level, 3, self.seed), state_repr='zobrist')
+        base_rate = None
+        for num_workers in self.hogwild_workers:
+            learning_agent = ArrayQLearning(1, 0.9, 0.1, shared_states=HOGWILD_SHARED_STATES)
+            trainer = HogwildTrainer(cfg, learning_agent, num_workers, self.seed)
+
+            def run():
+                update_count = trainer.update_count
+                trainer.train(self.train_episodes)
+                return trainer.update_count - update_count
+
+            rate = self.measure(run)
+            learning_agent.q_table.close()
+            base_rate = base_rate or rate
+            self.add_result('hogwild.workers_%d.updates' % num_workers, level, rate, 'updates/s')
+            self.add_result('hogwild.workers_%d.speedup' % num_workers, level, rate / base_rate, 'x')
+
+    # -------------------- helper methods --------------------
+
+    def measure(self, run):
+        """
+        Call run until min_time seconds have passed, run returns the number of operations it did
+        return: operations per second
+        """
+        operations = 0
+        start = time.perf_counter()
+        while True:
+            operations += run()
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.min_time:
+                return operations / elapsed
+
+
+# -------------------- helper methods --------------------
+
+def get_cfg(level, pacman_player, seed):
+    return {
+        'level': level,
+        'pacman_player': pacman_player,
+        'ghost_player': 0,
+        'display': False,
+        'display_speed': 1,
+        'seed': seed,
+    }
+
+
+def record_transitions(game_env, num_episodes):
+    """
+    return: list of (state, action, next_state, reward) of some episodes played by the learning agent of game_env
+    """
+    transitions = []
+    game_state, learning_agent = game_env.game_state, game_env.learning_agent
+    for _ in range(num_episodes):
+        game_env.reset()
+        while not game_state.is_game_over():
+            state = game_state.get_state()
+            action = learning_agent.get_state_chosen_action(state, state.get_pacman_action())
+            game_state.set_pacman_action(action)
+            game_state.update()
+            transitions.append((state, action, game_state.get_state(), game_state.get_action_reward()))
+    return transitions
+
+
+def get_dir_size(dir_path):
+    return sum(os.path.getsize(os.path.join(root, file_name))
+               for root, _, file_names in os.walk(dir_path) for file_name in file_names)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with the results of a baseline run
+    return: list of (result, baseline value) of the results worse than the baseline by more than tolerance
+    """
+    baseline_values = {(result['name'], result['level']): result['value'] for result in baseline}
+    regressions = []
+    for result in results:
+        baseline_value = baseline_values.get((result['name'], result['level']))
+        if not baseline_value or result['unit'] == 'entries':
+            continue
+        ratio = result['value'] / baseline_value
+        if (ratio > 1 + tolerance) if result['unit'] in LOWER_IS_BETTER else (ratio < 1 - tolerance):
+            regressions.append((result, baseline_value))
+    return regressions
+
+
+if __name__ == '__main__':
+    # run from the pacman directory, as the levels are read from maps/
+    parser = argparse.ArgumentParser(description='Benchmark the Pac-Man simulator and learning agents')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--min-time', type=float, default=1.0, help='seconds each measurement runs at least')
+    parser.add_argument('--train-episodes', type=int, default=200, help='episodes trained before q table stats')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--hogwild-workers', type=int, nargs='+', default=[1, 2, 4],
+                        help='numbers of worker processes of the hogwild benchmark')
+    parser.add_argument('--output', default='bench.json', help='path of the json results')
+    parser.add_argument('--baseline', help='json results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative change reported as a regression')
+    args = parser.parse_args()
+
+    benchmark = Benchmark(args.levels, args.min_time, args.train_episodes, args.seed, args.hogwild_workers)
+    results = benchmark.run()
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        for result, baseline_value in regressions:
+            print('regression: level %d %s %.2f -> %.2f %s' % (result['level'], result['name'], baseline_value,
+                                                              result['value'], result['unit']))
+        sys.exit(1 if regressions else 0)
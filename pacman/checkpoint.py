@@ -0,0 +1,148 @@
+import os
+import pickle
+import queue
+import re
+import threading
+
+# file names of the delta segments of a checkpoint, numbered in the order they are written
+SEGMENT_PATTERN = re.compile(r'segment_(\d{8})\.pkl$')
+SEGMENT_NAME = 'segment_%08d.pkl'
+
+
+class Checkpointer:
+    """
+    A checkpointer saves the training progress of a learning agent while it trains, so a crash loses at most
+    interval episodes.
+
+    Every interval episodes the entries changed since the last checkpoint are taken from the agent, which records
+    them (see QLearning.pop_changed_entries), and appended to the checkpoint directory of the agent as a new delta
+    segment. Segments are written by a background thread to a temporary file renamed into place, so a segment is
+    either complete or missing. Every compact_interval segments the thread merges all segments into one, keeping
+    the last value of each entry. load_model applies the segments on top of the saved model.
+
+    Close the checkpointer before saving the model, the saved model then supersedes the segments.
+    """
+
+    def __init__(self, learning_agent, map_num, interval=100, compact_interval=10):
+        self.learning_agent = learning_agent
+        self.dir_path = learning_agent.get_checkpoint_path(map_num)
+        self.interval = interval
+        self.compact_interval = compact_interval
+        self.episode_count = 0
+
+        os.makedirs(self.dir_path, exist_ok=True)
+        numbers = get_segment_numbers(self.dir_path)
+        self.segment_number = numbers[-1] if numbers else 0
+        self.segments_since_compaction = len(numbers)
+
+        self.error = None
+        self.tasks = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        learning_agent.start_recording()
+
+    def end_episode(self):
+        self.episode_count += 1
+        if self.episode_count % self.interval == 0:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Queue the entries changed since the last checkpoint to be written as a segment
+        """
+        if self.error is not None:
+            raise self.error
+        entries = self.learning_agent.pop_changed_entries()
+        if not entries:
+            return
+
+        self.segment_number += 1
+        self.tasks.put(('write', self.segment_number, entries))
+        self.segments_since_compaction += 1
+        if self.segments_since_compaction >= self.compact_interval:
+            self.tasks.put(('compact', self.segment_number, None))
+            self.segments_since_compaction = 1
+
+    def close(self):
+        """
+        Write the last changes and wait for the background thread
+        """
+        self.checkpoint()
+        self.tasks.put(None)
+        self.thread.join()
+        self.learning_agent.stop_recording()
+        if self.error is not None:
+            raise self.error
+
+    # -------------------- background thread --------------------
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            if self.error is not None:
+                continue
+
+            action, number, entries = task
+            try:
+                if action == 'write':
+                    write_segment(self.dir_path, number, entries)
+                else:
+                    compact_segments(self.dir_path, number)
+            except Exception as error:
+                self.error = error
+
+
+# -------------------- helper methods --------------------
+
+def get_segment_numbers(dir_path):
+    """
+    return: sorted numbers of the complete segments in a checkpoint directory, [] if there is none
+    """
+    if not os.path.isdir(dir_path):
+        return []
+    return sorted(int(match.group(1)) for match in map(SEGMENT_PATTERN.match, os.listdir(dir_path)) if match)
+
+
+def write_segment(dir_path, number, entries):
+    """
+    Write a segment atomically: to a temporary file, flushed to disk, then renamed to its segment name
+    """
+    path = os.path.join(dir_path, SEGMENT_NAME % number)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def read_segments(dir_path):
+    """
+    return: iterator of (key, value) of the entries of all segments of a checkpoint directory, in writing order
+    """
+    for number in get_segment_numbers(dir_path):
+        with open(os.path.join(dir_path, SEGMENT_NAME % number), 'rb') as f:
+            yield from pickle.load(f)
+
+
+def compact_segments(dir_path, number):
+    """
+    Merge the segments up to number into a single segment of that number, then delete the merged ones. Until they
+    are deleted, the merged segment holds the same last values as they do, so a crash in between loses nothing.
+    """
+    numbers = [k for k in get_segment_numbers(dir_path) if k <= number]
+    entries = {}
+    for k in numbers:
+        with open(os.path.join(dir_path, SEGMENT_NAME % k), 'rb') as f:
+            entries.update(pickle.load(f))
+    write_segment(dir_path, number, list(entries.items()))
+    for k in numbers:
+        if k != number:
+            os.remove(os.path.join(dir_path, SEGMENT_NAME % k))
+
+
+def clear_segments(dir_path):
+    for number in get_segment_numbers(dir_path):
+        os.remove(os.path.join(dir_path, SEGMENT_NAME % number))
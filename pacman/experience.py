@@ -0,0 +1,64 @@
+from collections import namedtuple
+import numpy as np
+
+# a batch of transitions as arrays: q table rows and their generations, action columns, rewards, the action bits
+# of the next states (see encode_actions), and whether the game was over after the transition
+Transitions = namedtuple('Transitions', ['state_ids', 'state_generations', 'actions', 'rewards', 'next_state_ids',
+                                         'next_state_generations', 'next_actions', 'dones'])
+
+
+class ExperienceBuffer:
+    """
+    An experience buffer keeps the last capacity transitions of a learning agent in preallocated NumPy arrays,
+    overwriting the oldest transition once full, and samples minibatches of them uniformly for batched q value
+    updates.
+
+    States are stored as their rows in an array q table. A row of a BoundedQTable may be evicted and reused by
+    another state, so the generation of each row is stored with it, to tell stale transitions apart.
+    """
+
+    def __init__(self, capacity, seed=None):
+        if capacity < 1:
+            raise ValueError('an experience buffer needs room for at least one transition, got %d' % capacity)
+        self.capacity = capacity
+        self.state_ids = np.zeros(capacity, dtype=np.intp)
+        self.state_generations = np.zeros(capacity, dtype=np.uint32)
+        self.actions = np.zeros(capacity, dtype=np.intp)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_state_ids = np.zeros(capacity, dtype=np.intp)
+        self.next_state_generations = np.zeros(capacity, dtype=np.uint32)
+        self.next_actions = np.zeros(capacity, dtype=np.uint8)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.size = 0
+        self.cursor = 0
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state_id, state_generation, action, reward, next_state_id, next_state_generation, next_actions,
+            done):
+        k = self.cursor
+        self.state_ids[k] = state_id
+        self.state_generations[k] = state_generation
+        self.actions[k] = action
+        self.rewards[k] = reward
+        self.next_state_ids[k] = next_state_id
+        self.next_state_generations[k] = next_state_generation
+        self.next_actions[k] = next_actions
+        self.dones[k] = done
+        self.cursor = k + 1 if k + 1 < self.capacity else 0
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        """
+        return: Transitions of batch_size transitions drawn uniformly with replacement
+        """
+        index = self.rng.integers(self.size, size=batch_size)
+        return Transitions(self.state_ids[index], self.state_generations[index], self.actions[index],
+                           self.rewards[index], self.next_state_ids[index], self.next_state_generations[index],
+                           self.next_actions[index], self.dones[index])
+
+    def clear(self):
+        self.size = 0
+        self.cursor = 0
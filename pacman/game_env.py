@@ -1,8 +1,17 @@
+import random
 import time
-from pacman.util import get_path
+from pacman.util import compile_level
 from pacman.game_state import GameState
+from pacman.game_state_repr import STATE_REPRS
 from pacman.render import Render
 from pacman.q_learning import QLearning
+from pacman.planning import MCTSPlanner
+from pacman.replay import ReplayWriter, ACTION_CODES
+from pacman.profiling import Profiler, MetricsLog
+from pacman.checkpoint import Checkpointer
+
+# seconds per tick of a displayed game at display_speed 1
+TICK_INTERVAL = 0.1
 
 
 class GameEnv:
@@ -18,18 +27,71 @@ class GameEnv:
         self.ghost_player = cfg['ghost_player']
         self.display = cfg['display']
         self.display_speed = cfg['display_speed']
+        self.tick_interval = TICK_INTERVAL / self.display_speed if self.display_speed > 0 else 0
+        self.state_repr = cfg.get('state_repr', 'simple')
+        self.debug_hash = cfg.get('debug_hash', False)
+        # seed of the random moves of the agents, None for fresh entropy
+        self.seed = cfg.get('seed')
+        self.replay_writer = ReplayWriter(cfg['replay_log']) if cfg.get('replay_log') else None
+        self.episode_actions = None
+        self.planner = MCTSPlanner(cfg.get('planning_time', 0.05), cfg.get('planning_nodes')) \
+            if self.pacman_player == 4 else None
         self.has_learning_agent = False
+        # episodes between checkpoints of the learning agent, None for no checkpoints, see Checkpointer
+        self.checkpoint_interval = cfg.get('checkpoint_interval')
+        self.checkpointer = None
+
+        # opt-in profiling of the phases of the game loop, see Profiler
+        self.profiler = Profiler(cfg.get('profile_log'), cfg.get('profile_sample_interval', 1)) \
+            if cfg.get('profile') or cfg.get('profile_log') else None
 
     def initialize_game(self):
-        width, height, map_string = read_level(self.level)
-        self.game_state = GameState(width, height, map_string, self.pacman_player, self.ghost_player)
+        width, height, map_string = compile_level(self.level)
+        self.game_state = GameState(width, height, map_string, self.pacman_player, self.ghost_player, level=self.level,
+                                    state_repr_class=STATE_REPRS[self.state_repr], debug_hash=self.debug_hash,
+                                    seed=self.seed)
         if self.display:
-            self.render = Render(window_size=(width, height), frame_interval=0.1)
+            self.render = Render(window_size=(width, height), tick_interval=self.tick_interval)
             self.render.set_game_state(self.game_state)
 
+    def reset(self):
+        """
+        Start a new game on the same level. The game state of the previous game is restored in place instead of
+        being rebuilt from the level file.
+        """
+        if not hasattr(self, 'game_state'):
+            self.initialize_game()
+            return
+
+        self.game_state.reset()
+        if self.display:
+            self.render.reset()
+
     def start_game(self):
+        """
+        Play the game until it is over. A displayed game is played in another thread while the window draws it,
+        one tick every tick_interval seconds, or as fast as possible when display_speed is 0.
+        """
+        if self.display:
+            self.render.run(self.play_game)
+        else:
+            self.play_game()
+
+    def play_game(self):
+        self.next_tick_time = time.perf_counter()
+        if self.replay_writer is not None:
+            self.start_recording()
+        if self.profiler is not None:
+            self.profiler.start_episode(self)
+
         while not self.game_state.is_game_over():
-            if self.has_learning_agent:
+            if self.display and self.render.is_closed():
+                break
+
+            if self.planner is not None:
+                self.game_state.set_pacman_action(self.planner.choose_action(self.game_state))
+                self.update()
+            elif self.has_learning_agent:
                 state = self.game_state.get_state()
                 actions = state.get_pacman_action()
                 chosen_action = self.learning_agent.get_state_chosen_action(state, actions)
@@ -40,10 +102,20 @@ class GameEnv:
                 next_state = self.game_state.get_state()
                 reward = self.game_state.get_action_reward()
 
-                self.learning_agent.update_q_value(state, chosen_action, next_state, reward)
+                self.learning_agent.update_q_value(state, chosen_action, next_state, reward,
+                                                 self.game_state.is_game_over())
             else:
                 self.update()
 
+        if self.replay_writer is not None and self.game_state.is_game_over():
+            self.replay_writer.write_episode(self.level, self.episode_seed, self.episode_actions,
+                                             self.game_state.get_score(), self.game_state.get_game_status())
+        self.episode_actions = None
+        if self.profiler is not None:
+            self.profiler.end_episode()
+        if self.checkpointer is not None and self.game_state.is_game_over():
+            self.checkpointer.end_episode()
+
         # print('game over, you %s' % self.game_state.get_game_status())
         # print('time used: %d, score: %d' % (self.game_state.get_time(), self.game_state.get_score()))
         # time.sleep(10)
@@ -51,35 +123,72 @@ class GameEnv:
     def set_learning_agent(self, learning_agent):
         self.has_learning_agent = True
         self.learning_agent = learning_agent
+        if learning_agent.state_repr is not None:
+            self.state_repr = learning_agent.state_repr
+            if hasattr(self, 'game_state'):
+                self.game_state.state_repr_class = STATE_REPRS[self.state_repr]
+        if self.checkpoint_interval is not None:
+            self.checkpointer = Checkpointer(learning_agent, self.level, self.checkpoint_interval)
 
     def update(self):
         self.game_state.update()
+        if self.episode_actions is not None:
+            self.episode_actions.append([ACTION_CODES[agent.move_direction]
+                                         for agent in self.game_state.pacmans + self.game_state.ghosts])
         if self.display:
-            self.render.update()
+            self.render.push_state()
+            self.wait_tick()
+
+    def wait_tick(self):
+        """
+        Keep a displayed game at display_speed, by waiting until the time of the next tick
+        """
+        self.next_tick_time += self.tick_interval
+        delay = self.next_tick_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.next_tick_time -= delay
+
+    def seed_episodes(self, seed):
+        """
+        Seed the random numbers of the following episodes: the random moves of the agents, the random module used
+        by the learning agents, and the learning agent's own random numbers
+        """
+        if not hasattr(self, 'game_state'):
+            self.initialize_game()
+        self.game_state.seed(seed)
+        random.seed(seed)
+        if self.has_learning_agent:
+            self.learning_agent.seed(seed)
+
+    def start_recording(self):
+        """
+        Seed the random numbers of the episode with a recorded seed, derived from the seed of the game, and start
+        recording the agent actions
+        """
+        self.episode_seed = self.game_state.random_stream.spawn_seed()
+        self.seed_episodes(self.episode_seed)
+        self.episode_actions = []
+
+    def close(self):
+        if self.replay_writer is not None:
+            self.replay_writer.close()
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+            self.checkpointer = None
 
     def get_state(self):
         pass
 
 
-# -------------------- helper methods --------------------
-
-def read_level(level):
-    path = get_path('level%d.txt' % level, 'maps')
-    with open(path) as f:
-        map_rows = f.readlines()
-
-    map_rows = [x.strip()[::2] for x in map_rows]
-    width, height = len(max(map_rows, key=len)), len(map_rows)
-    map_string = ''.join(map_rows)
-    return width, height, map_string
-
-
 if __name__ == '__main__':
     # player num:
     # 0 = random agent,
     # 1 = player 1,
     # 2 = player 2,
-    # 3 = Q learning agent
+    # 3 = Q learning agent,
+    # 4 = planning agent (pacman only)
 
     cfg = {
         'level': 1,
@@ -87,27 +196,40 @@ if __name__ == '__main__':
         'ghost_player': 0,
         'display': False,
         'display_speed': 1,
+        'checkpoint_interval': 1000,
     }
 
     alpha, gamma, epsilon = 1, 0.9, 0.00
 
+    # number of training processes, 1 trains in this process
+    num_workers = 1
+
     # training model
     t = time.time()
     q_learning = QLearning(alpha, gamma, epsilon)
     q_learning.load_model(cfg['level'])
-    total_wins, total_score = 0, 0
+    metrics_log = MetricsLog(interval=100)
 
-    for i in range(10000):
-        gameEnv = GameEnv(cfg)
-        gameEnv.initialize_game()
-        gameEnv.set_learning_agent(q_learning)
-        gameEnv.start_game()
+    if num_workers > 1:
+        from pacman.parallel_training import ParallelTrainer
 
-        total_wins += gameEnv.game_state.get_game_status() == 'win'
-        total_score += gameEnv.game_state.get_score()
+        trainer = ParallelTrainer(cfg, q_learning, num_workers, deterministic=True, seed=0)
+        results = trainer.train(10000)
+        trainer.close()
+
+        for game_status, score in results:
+            metrics_log.add_episode(game_status, score, len(q_learning.q_table))
+
+    gameEnv = GameEnv(cfg)
+    gameEnv.set_learning_agent(q_learning)
+    for i in range(10000 if num_workers == 1 else 0):
+        gameEnv.reset()
+        gameEnv.start_game()
 
-        print('train num:', i + 1, 'win rate:', total_wins / (i + 1), 'avg score:', total_score / (i + 1),
-              len(q_learning.q_table))
+        metrics_log.add_episode(gameEnv.game_state.get_game_status(), gameEnv.game_state.get_score(),
+                                len(q_learning.q_table))
+    metrics_log.flush()
+    gameEnv.close()
 
     q_learning.save_model(map_num=cfg['level'])
     print(time.time() - t)
@@ -1,7 +1,27 @@
+from pacman.agent import DIRECTIONS, get_move_tables
 from pacman.pac_man import Pacman
 from pacman.ghost import Ghost
-from pacman.game_state_repr import SimpleGameStateRepr
-import math
+from pacman.game_state_repr import SimpleGameStateRepr, HashCollisionError
+from pacman.random_stream import RandomStream
+from pacman.util import UNREACHABLE, get_grid_index, to_bitboard, calculate_pair_distances, load_pair_distances
+import time
+from collections import namedtuple
+import numpy as np
+
+# wall bitboards shared by the states of the same map, key and value: the bitboard
+_wall_bitboards = {}
+
+# zobrist keys are drawn from a fixed seed, so that state keys are stable across processes and saved models
+ZOBRIST_SEED = 2018
+ZOBRIST_INVULNERABLE_KEY = int(np.random.default_rng(ZOBRIST_SEED).integers(2 ** 63))
+
+# the mutable part of a game state, see GameState.snapshot
+GameSnapshot = namedtuple('GameSnapshot', ['agents', 'food_bitboard', 'powerup_bitboard', 'zobrist_hash',
+                                           'cur_dots_counter', 'ghost_killed_counter', 'time_count', 'score_count',
+                                           'last_score', 'game_status', 'random_state'])
+
+# zobrist keys per map size, key: width * height, value: (uint64 array of shape (size, 32), the same as lists)
+_zobrist_keys = {}
 
 
 class GameState:
@@ -9,41 +29,72 @@ class GameState:
     A gameState specifies game state information, such as locations of the pacman, ghosts, and foods.
 
     The GameState is used by the GameEnv object to access state related info.
+
+    The random moves of its agents are drawn from a RandomStream of its own, seeded by seed (fresh entropy when
+    None), which goes on across reset() unless it is seeded again.
     """
 
-    def __init__(self, width, height, map_string, pacman_player, ghost_player):
+    def __init__(self, width, height, map_string, pacman_player, ghost_player, level=None,
+                 state_repr_class=SimpleGameStateRepr, debug_hash=False, seed=None):
         self.width = width
         self.height = height
         self.map_string = map_string
+        self.level = level
+        self.state_repr_class = state_repr_class
+        self.debug_hash = debug_hash
+        self.pair_distances = None
+        self.move_grids = None
         self.pacman_player = pacman_player
         self.ghost_player = ghost_player
+        self.random_stream = RandomStream(seed)
+        self.profiler = None
         self.pacmans = []
         self.ghosts = []
+        # pacmans and ghosts in map order, the agent with bit k in the occupants of the grids is agents[k]
+        self.agents = []
         self.load_map(width, height, map_string)
         self.game_status = 'ongoing'
         self.ghost_killed_counter = 0
 
         self.time_count = 0
         self.score_count = 0
+        self.last_score = 0
 
     def load_map(self, width, height, map_string):
         self.map_list = [[None for _ in range(width)] for _ in range(height)]
         self.map_repr_list = [[None for _ in range(width)] for _ in range(height)]
         self.static_object_list = [[None for _ in range(width)] for _ in range(height)]
+        self.grid_index = get_grid_index(width, height, map_string)
+        wall_bitboard = to_bitboard(np.array(list(map_string)) == '#')
+        self.wall_bitboard = _wall_bitboards.setdefault(wall_bitboard, wall_bitboard)
+        self.food_bitboard = self.powerup_bitboard = self.pacman_bitboard = self.ghost_bitboard = 0
+        self.zobrist_hash = 0
+        self.pacman_mask = self.ghost_mask = 0
+        self.food_mask = np.zeros((self.grid_index >= 0).sum(), dtype=bool)
+        self.powerup_mask = np.zeros_like(self.food_mask)
+        self.move_tables = get_move_tables(width, height, map_string)
+        self.legal_actions = self.move_tables[0]
         dots_counter = 0
 
         for k, str in enumerate(map_string):
             x, y = k % width, k // width
             if str == 'P':
-                element = Pacman(self.map_list, (x, y), player_number=self.pacman_player)
+                element = Pacman(self.map_list, (x, y), self.move_tables, self.random_stream,
+                                 player_number=self.pacman_player)
                 self.pacmans.append(element)
+                self.pacman_mask |= self.number_agent(element)
             elif str == 'M':
-                element = Ghost(self.map_list, (x, y), player_number=self.ghost_player)
+                element = Ghost(self.map_list, (x, y), self.move_tables, self.random_stream,
+                                player_number=self.ghost_player)
                 self.ghosts.append(element)
+                self.ghost_mask |= self.number_agent(element)
                 self.ghost_player = 0
             else:
                 if str == '*':
                     dots_counter += 1
+                    self.food_mask[self.grid_index[y, x]] = True
+                elif str == '@':
+                    self.powerup_mask[self.grid_index[y, x]] = True
                 element = str
                 self.static_object_list[y][x] = str
 
@@ -52,32 +103,155 @@ class GameState:
             self.map_repr_list[y][x] = grid.get_grid_repr()
 
         self.original_dots_counter = self.cur_dots_counter = dots_counter
+        self.alive_pacman_counter = len(self.pacmans)
+        self.open_grids = [grid for row in self.map_list for grid in row if not grid.has_wall]
         self.state_repr = (col.elements for row in self.map_list for col in row)
 
+        # what reset() restores: grids changed during the game, and the layer bitboards, hash and masks at the start
+        self.changed_grids = set()
+        self.initial_bitboards = (self.food_bitboard, self.powerup_bitboard, self.pacman_bitboard,
+                                  self.ghost_bitboard, self.zobrist_hash)
+        self.initial_food_mask, self.initial_powerup_mask = self.food_mask.copy(), self.powerup_mask.copy()
+
+    def reset(self):
+        """
+        Restore the game to its start in place. The grids and agents are kept, only the grids changed during the
+        game (eaten food and powerups, grids of the agents) and the agents are restored.
+        """
+        changed_grids = self.changed_grids
+        for agent in self.pacmans + self.ghosts:
+            changed_grids.add(self.map_list[agent.y][agent.x])
+            agent.reset()
+            changed_grids.add(self.map_list[agent.y][agent.x])
+
+        for grid in changed_grids:
+            grid.reset()
+            self.map_repr_list[grid.y][grid.x] = grid.grid_repr
+        changed_grids.clear()
+
+        (self.food_bitboard, self.powerup_bitboard, self.pacman_bitboard, self.ghost_bitboard,
+         self.zobrist_hash) = self.initial_bitboards
+        self.food_mask[:] = self.initial_food_mask
+        self.powerup_mask[:] = self.initial_powerup_mask
+
+        self.cur_dots_counter = self.original_dots_counter
+        self.alive_pacman_counter = len(self.pacmans)
+        self.game_status = 'ongoing'
+        self.ghost_killed_counter = 0
+        self.time_count = 0
+        self.score_count = 0
+
+    def seed(self, seed=None):
+        """
+        Restart the random moves of the agents from a seed
+        """
+        self.random_stream.seed(seed)
+
+    def snapshot(self):
+        """
+        Capture the mutable part of the game: the agents, the food and powerup bitboards, the counters and the
+        position in the random stream. Walls, grids and agents themselves are not copied, a snapshot is restored into
+        the game state it was taken from.
+        return: GameSnapshot
+        """
+        return GameSnapshot(tuple(agent.snapshot() for agent in self.pacmans + self.ghosts), self.food_bitboard,
+                            self.powerup_bitboard, self.zobrist_hash, self.cur_dots_counter, self.ghost_killed_counter,
+                            self.time_count, self.score_count, self.last_score, self.game_status,
+                            self.random_stream.getstate())
+
+    def restore(self, snapshot):
+        """
+        Restore the game to a snapshot. Only the agents which moved and the food and powerups which changed since
+        the snapshot are put back, through their grids, so the grid flags, bitboards and hash follow.
+        """
+        for agent, agent_snapshot in zip(self.pacmans + self.ghosts, snapshot.agents):
+            x, y, _, dead = agent_snapshot[:4]
+            if (agent.x, agent.y, agent.dead) == (x, y, dead):
+                agent.restore(agent_snapshot)
+                continue
+
+            if not agent.dead:
+                self.map_list[agent.y][agent.x].remove_agent(agent)
+                self.changed_grids.add(self.map_list[agent.y][agent.x])
+            agent.restore(agent_snapshot)
+            if not dead:
+                self.map_list[y][x].add_agent(agent)
+                self.changed_grids.add(self.map_list[y][x])
+        self.alive_pacman_counter = sum(not pacman.dead for pacman in self.pacmans)
+
+        for obj, mask, changed, restored in (('*', self.food_mask, self.food_bitboard ^ snapshot.food_bitboard,
+                                              snapshot.food_bitboard),
+                                             ('@', self.powerup_mask, self.powerup_bitboard ^ snapshot.powerup_bitboard,
+                                              snapshot.powerup_bitboard)):
+            while changed:
+                grid_bit = changed & -changed
+                changed ^= grid_bit
+                grid_number = grid_bit.bit_length() - 1
+                grid = self.open_grids[grid_number]
+                mask[grid_number] = bool(restored & grid_bit)
+                if mask[grid_number]:
+                    grid.add_object(obj)
+                else:
+                    grid.remove_object(obj)
+                self.changed_grids.add(grid)
+
+        (self.cur_dots_counter, self.ghost_killed_counter, self.time_count, self.score_count, self.last_score,
+         self.game_status) = snapshot[4:10]
+        self.random_stream.setstate(snapshot.random_state)
+
+        if self.debug_hash and self.zobrist_hash != snapshot.zobrist_hash:
+            raise HashCollisionError('restored zobrist hash %x differs from the snapshot hash %x' %
+                                     (self.zobrist_hash, snapshot.zobrist_hash))
+
     def update(self):
         self.last_score = self.get_score()
 
-        for pacman in self.pacmans:
-            pacman.update()
-
+        self.update_pacmans()
         self.update_game_status()
 
         if not self.is_game_over():
-            for ghost in self.ghosts:
-                ghost.update()
+            self.update_ghosts()
 
         self.update_game_status()
         self.time_count += 1
         self.score_count = (- self.time_count + (self.original_dots_counter - self.cur_dots_counter) * 10 + \
                             self.ghost_killed_counter * 200) * (self.game_status != 'lose')
 
+    def update_pacmans(self):
+        for pacman in self.pacmans:
+            pacman.update()
+
+    def update_ghosts(self):
+        for ghost in self.ghosts:
+            ghost.update()
+
+    def set_profiler(self, profiler):
+        """
+        Time the grid updates, the collisions of the agents with each other and with food, in the given Profiler,
+        or stop timing them for None. The grids are switched to ProfiledGameGrid and back, so grids cost nothing
+        extra while no profiler is set.
+        """
+        self.profiler = profiler
+        grid_class = GameGrid if profiler is None else ProfiledGameGrid
+        for grid in self.open_grids:
+            grid.__class__ = grid_class
+
     def update_game_status(self):
-        if all([pacman.is_dead() for pacman in self.pacmans]):
+        if self.alive_pacman_counter == 0:
             self.game_status = 'lose'
 
         elif self.cur_dots_counter == 0:
             self.game_status = 'win'
 
+    def number_agent(self, agent):
+        """
+        Number a new agent for the occupants of the grids
+        return: the bit of the agent
+        """
+        agent.agent_bit = 1 << len(self.agents)
+        self.agents.append(agent)
+        return agent.agent_bit
+
     def display(self):
         for row in self.map_list:
             row_line = ''
@@ -110,14 +284,53 @@ class GameState:
         return invulnerable_time
 
     def get_state(self):
-        game_state_repr = SimpleGameStateRepr(self)
+        game_state_repr = self.state_repr_class(self)
         return game_state_repr
 
+    def get_state_key(self):
+        """
+        return: a 64 bit zobrist hash of the board and the pacman invulnerable flag, maintained as grids change. In
+        debug mode it is checked against a hash of the full board.
+        """
+        state_key = self.zobrist_hash ^ (ZOBRIST_INVULNERABLE_KEY if self.is_pacman_invulnerable() else 0)
+        if self.debug_hash:
+            board_hash = calculate_zobrist_hash(self.map_repr_list, self.width * self.height)
+            if board_hash != self.zobrist_hash:
+                raise HashCollisionError('incremental zobrist hash %x differs from board hash %x' %
+                                         (self.zobrist_hash, board_hash))
+        return state_key
+
+    def get_bitboards(self):
+        """
+        return: the wall bitboard of the map, plus the food, powerup, pacman and ghost bitboards of the non-wall grids
+        (bit k for the grid numbered k by get_grid_index)
+        """
+        return self.wall_bitboard, self.food_bitboard, self.powerup_bitboard, self.pacman_bitboard, self.ghost_bitboard
+
+    def update_bitboards(self, grid_number, changed_repr):
+        """
+        Flip the bit of a grid, numbered by get_grid_index, in the bitboards of the layers whose flag changed, given
+        as grid repr bits. The bit is built only here, a Python int per grid would grow with the square of the map.
+        """
+        if not changed_repr & 30:
+            return
+        grid_bit = 1 << grid_number
+        if changed_repr & 2:
+            self.food_bitboard ^= grid_bit
+        if changed_repr & 4:
+            self.powerup_bitboard ^= grid_bit
+        if changed_repr & 8:
+            self.pacman_bitboard ^= grid_bit
+        if changed_repr & 16:
+            self.ghost_bitboard ^= grid_bit
+
     def get_pacman_available_action(self, pacman_num=0):
-        return self.pacmans[pacman_num].get_available_action()
+        pacman = self.pacmans[pacman_num]
+        return self.legal_actions[pacman.y][pacman.x]
 
     def get_ghost_available_action(self, ghost_num=0):
-        return self.ghosts[ghost_num].get_available_action()
+        ghost = self.ghosts[ghost_num]
+        return self.legal_actions[ghost.y][ghost.x]
 
     def set_pacman_action(self, action, pacman_num=0):
         self.pacmans[pacman_num].set_action(action)
@@ -131,6 +344,73 @@ class GameState:
                 return True
         return False
 
+    def get_pair_distances(self):
+        """
+        return: the maze distance table of the map, loaded from the level cache when the level is known
+        """
+        if self.pair_distances is None:
+            if self.level is not None:
+                self.pair_distances = load_pair_distances(self.level)[1]
+            else:
+                self.pair_distances = calculate_pair_distances(self.width, self.height, self.map_string)
+        return self.pair_distances
+
+    def get_move_grids(self):
+        """
+        return: int array of shape (number of non-wall grids, 4), the grid number reached from each non-wall grid by
+        each of DIRECTIONS, the grid itself when the direction is blocked
+        """
+        if self.move_grids is None:
+            self.move_grids = np.empty(((self.grid_index >= 0).sum(), len(DIRECTIONS)), dtype=np.intp)
+            for grid in self.open_grids:
+                grid_number = self.grid_index[grid.y, grid.x]
+                legal_actions = self.legal_actions[grid.y][grid.x]
+                for k, (dx, dy) in enumerate(DIRECTIONS):
+                    self.move_grids[grid_number, k] = self.grid_index[grid.y + dy, grid.x + dx] \
+                        if (dx, dy) in legal_actions else grid_number
+        return self.move_grids
+
+    def get_closest_distance(self, location_index, locations):
+        """
+        return: the maze distance from location_index to the closest of the given (x, y) locations,
+        None if none of them is reachable
+        """
+        x, y = location_index
+        distances = self.get_pair_distances()[self.grid_index[y, x]]
+        closest = min((distances[self.grid_index[other_y, other_x]] for other_x, other_y in locations),
+                      default=UNREACHABLE)
+        return None if closest == UNREACHABLE else int(closest)
+
+    def get_closest_masked_distance(self, location_index, mask):
+        """
+        return: the maze distance from location_index to the closest non-wall grid selected by mask,
+        None if none of them is reachable
+        """
+        x, y = location_index
+        distances = self.get_pair_distances()[self.grid_index[y, x]][mask]
+        closest = distances.min(initial=UNREACHABLE)
+        return None if closest == UNREACHABLE else int(closest)
+
+    def get_closest_direction(self, location_index, targets):
+        """
+        targets: bool mask of the non-wall grids, numbered by get_grid_index, or a list of grid numbers
+        return: (the first move direction of a shortest path from location_index to the closest target, the maze
+        distance to it), direction (0, 0) when location_index is a target, (None, None) if no target is reachable
+        """
+        x, y = location_index
+        directions = self.legal_actions[y][x]
+        grids = [self.grid_index[y, x]] + [self.grid_index[y + dy, x + dx] for dx, dy in directions]
+        distances = self.get_pair_distances()[grids]
+        if isinstance(targets, np.ndarray):
+            closest = distances.min(axis=1, where=targets, initial=UNREACHABLE)
+        else:
+            closest = distances[:, targets].min(axis=1, initial=UNREACHABLE)
+        if closest[0] == UNREACHABLE:
+            return None, None
+        if closest[0] == 0:
+            return (0, 0), 0
+        return directions[closest[1:].argmin()], int(closest[0])
+
 
 class GameGrid:
     """
@@ -139,90 +419,212 @@ class GameGrid:
     It also handles the update of the game logic inside the grid at each time step.
 
     The GameState class contains multiple GameGrid objects, as each corresponds to a single grid in the game map.
+    Their attributes are declared in __slots__, as there is one for every grid of every game state.
+
+    The agents in the grid are kept as occupants, a bitmask of the agent bits (see GameState.number_agent), so an
+    agent enters or leaves a grid by flipping its bit, and the pacmans and ghosts of the grid are found by masking.
+    A grid is updated, resolving collisions and pickups, only if an agent entered it since its last update, as the
+    update of a grid nobody entered has nothing left to resolve.
     """
 
+    __slots__ = ('game_state', 'x', 'y', 'has_wall', 'has_food', 'has_powerup', 'has_pacman', 'has_ghost',
+                 'grid_number', 'grid_repr', 'zobrist_keys', 'occupants', 'needs_update', 'initial_flags',
+                 'initial_occupants', 'initial_grid_repr')
+
     def __init__(self, game_state, location_index, obj):
         self.game_state = game_state
         self.x, self.y = location_index
         self.has_wall = self.has_food = self.has_powerup = self.has_pacman = self.has_ghost = False
-        self.pacmans, self.ghosts = [], []
+        self.grid_number = int(game_state.grid_index[self.y, self.x])
+        self.grid_repr = 0
+        zobrist_keys = get_zobrist_keys(game_state.width * game_state.height)[1]
+        self.zobrist_keys = zobrist_keys[self.y * game_state.width + self.x]
+        self.occupants = 0
+        self.needs_update = True
         self.add_object(obj)
 
+        self.initial_flags = self.has_wall, self.has_food, self.has_powerup
+        self.initial_occupants = self.occupants
+        self.initial_grid_repr = self.grid_repr
+
+    def reset(self):
+        """
+        Restore the objects of the grid at the start of the game. The game state restores its bitboards and hash.
+        """
+        self.has_wall, self.has_food, self.has_powerup = self.initial_flags
+        self.occupants = self.initial_occupants
+        self.has_pacman = self.occupants & self.game_state.pacman_mask != 0
+        self.has_ghost = self.occupants & self.game_state.ghost_mask != 0
+        self.needs_update = True
+        self.grid_repr = self.initial_grid_repr
+
     def add_object(self, obj):
         """
         Add an object from the current grid
         """
+        if isinstance(obj, (Pacman, Ghost)):
+            self.add_agent(obj)
+            return
+
         if obj == '#':
             self.has_wall = True
         elif obj == '*':
             self.has_food = True
         elif obj == '@':
             self.has_powerup = True
-        elif isinstance(obj, Pacman):
-            self.has_pacman = True
-            self.pacmans.append(obj)
-        elif isinstance(obj, Ghost):
-            self.has_ghost = True
-            self.ghosts.append(obj)
         elif obj != ' ':
             raise ValueError('Undefined map object: %s' % obj)
 
+        self.needs_update = True
         self.update_repr()
 
     def remove_object(self, obj):
         """
         Remove an object from the current grid
         """
+        if isinstance(obj, (Pacman, Ghost)):
+            self.remove_agent(obj)
+            return
+
         if obj == '#':
             self.has_wall = False
         elif obj == '*':
             self.has_food = False
         elif obj == '@':
             self.has_powerup = False
-        elif isinstance(obj, Pacman):
-            self.has_pacman = False
-            self.pacmans.remove(obj)
-        elif isinstance(obj, Ghost):
-            self.has_ghost = False
-            self.ghosts.remove(obj)
         elif obj != ' ':
             raise ValueError('Undefined map object: %s' % obj)
 
         self.update_repr()
 
+    def add_agent(self, agent):
+        self.occupants |= agent.agent_bit
+        self.needs_update = True
+        self.update_occupants()
+
+    def remove_agent(self, agent):
+        if not self.occupants & agent.agent_bit:
+            raise ValueError('agent not in grid: %s' % agent)
+        self.occupants ^= agent.agent_bit
+        self.update_occupants()
+
+    def update_occupants(self):
+        """
+        Update the pacman and ghost flags after the occupants changed, and the repr only if a flag changed
+        """
+        has_pacman = self.occupants & self.game_state.pacman_mask != 0
+        has_ghost = self.occupants & self.game_state.ghost_mask != 0
+        if has_pacman != self.has_pacman or has_ghost != self.has_ghost:
+            self.has_pacman, self.has_ghost = has_pacman, has_ghost
+            self.update_repr()
+
+    def get_occupants(self, mask):
+        """
+        return: list of the agents in the grid whose bits are in mask
+        """
+        agents, occupants = self.game_state.agents, self.occupants & mask
+        found = []
+        while occupants:
+            agent_bit = occupants & -occupants
+            occupants ^= agent_bit
+            found.append(agents[agent_bit.bit_length() - 1])
+        return found
+
     def update(self):
-        if self.has_ghost and self.has_pacman:
-            if any([pacman.is_invulnerable() for pacman in self.pacmans]):
-                for ghost in self.ghosts:
+        self.needs_update = False
+        if not (self.has_pacman and (self.has_ghost or self.has_food or self.has_powerup)):
+            return
+
+        game_state = self.game_state
+        if self.has_ghost:
+            pacmans = self.get_occupants(game_state.pacman_mask)
+            if any([pacman.is_invulnerable() for pacman in pacmans]):
+                for ghost in self.get_occupants(game_state.ghost_mask):
                     ghost.destory()
-                    self.game_state.ghost_killed_counter += 1
+                    game_state.ghost_killed_counter += 1
             else:
-                for pacman in self.pacmans:
+                for pacman in pacmans:
                     pacman.destory()
-                    self.game_state.score = 0
+                    game_state.alive_pacman_counter -= 1
+                    game_state.score = 0
 
         if self.has_pacman and self.has_food:
             self.has_food = False
-            self.game_state.cur_dots_counter -= 1
+            game_state.cur_dots_counter -= 1
+            game_state.food_mask[self.grid_number] = False
+            game_state.changed_grids.add(self)
 
         if self.has_pacman and self.has_powerup:
             self.has_powerup = False
-            for pacman in self.pacmans:
+            game_state.powerup_mask[self.grid_number] = False
+            game_state.changed_grids.add(self)
+            for pacman in self.get_occupants(game_state.pacman_mask):
                 pacman.powerup()
 
         self.update_repr()
 
     def update_repr(self):
-        self.game_state.map_repr_list[self.y][self.x] = self.get_grid_repr()
+        grid_repr = self.get_grid_repr()
+        self.game_state.map_repr_list[self.y][self.x] = grid_repr
+        if grid_repr != self.grid_repr:
+            changed_repr = grid_repr ^ self.grid_repr
+            self.game_state.update_bitboards(self.grid_number, changed_repr)
+            self.game_state.zobrist_hash ^= self.zobrist_keys[changed_repr]
+            self.grid_repr = grid_repr
 
     def get_grid_repr(self):
         return self.has_wall * 1 + self.has_food * 2 + self.has_powerup * 4 + self.has_pacman * 8 + self.has_ghost * 16
 
     def get_closest_ghost_distance(self):
-        pass
+        ghost_locations = [ghost.get_location() for ghost in self.game_state.ghosts if not ghost.is_dead()]
+        return self.game_state.get_closest_distance((self.x, self.y), ghost_locations)
 
     def get_closest_food_distance(self):
-        pass
+        return self.game_state.get_closest_masked_distance((self.x, self.y), self.game_state.food_mask)
 
     def get_closest_powerup_distance(self):
-        pass
+        return self.game_state.get_closest_masked_distance((self.x, self.y), self.game_state.powerup_mask)
+
+
+class ProfiledGameGrid(GameGrid):
+    """
+    A GameGrid timing its updates in the profiler of its game state, see GameState.set_profiler
+    """
+
+    __slots__ = ()
+
+    def update(self):
+        start = time.perf_counter()
+        super().update()
+        self.game_state.profiler.add('grid_update', time.perf_counter() - start)
+
+
+# -------------------- helper methods --------------------
+
+def get_zobrist_keys(size):
+    """
+    Draw a random 64 bit key for each of the five layers (wall, food, powerup, pacman, ghost) of every grid, and
+    combine them for every grid repr, so that changing a grid from repr a to repr b XORs keys[grid][a ^ b] into
+    the board hash
+    return: (uint64 array of shape (size, 32), the same keys as nested lists of Python ints)
+    """
+    if size not in _zobrist_keys:
+        layer_keys = np.random.default_rng([ZOBRIST_SEED, size]).integers(2 ** 63, size=(size, 5), dtype=np.uint64)
+        keys = np.zeros((size, 32), dtype=np.uint64)
+        for grid_repr in range(32):
+            for layer in range(5):
+                if grid_repr >> layer & 1:
+                    keys[:, grid_repr] ^= layer_keys[:, layer]
+        _zobrist_keys[size] = keys, keys.tolist()
+    return _zobrist_keys[size]
+
+
+def calculate_zobrist_hash(map_repr, size):
+    """
+    Hash a whole board from scratch
+    map_repr: grid reprs of the board as nested lists or an array, in row-major order
+    """
+    grid_repr = np.asarray(map_repr, dtype=np.intp).reshape(-1)
+    keys = get_zobrist_keys(size)[0]
+    return int(np.bitwise_xor.reduce(keys[np.arange(size), grid_repr]))
+
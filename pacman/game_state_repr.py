@@ -1,3 +1,32 @@
+import numpy as np
+from pacman.agent import DIRECTIONS
+from pacman.util import UNREACHABLE
+
+
+# feature encoding of FeatureGameStateRepr: the largest distance told apart from the closest food, ghost and
+# powerup, the steps the invulnerable time is counted in, and the direction code for no reachable target
+FEATURE_DISTANCE_CAPS = (3, 7, 3)
+FEATURE_INVULNERABLE_STEP = 8
+FEATURE_NO_DIRECTION = 5
+
+# bit widths of the features: food, ghost and powerup direction and distance, invulnerable time, pacman actions
+FEATURE_BITS = (3, 2, 3, 3, 3, 2, 3, 4)
+
+# columns of the action features of LinearFeatureGameStateRepr, the features of the grid each action moves to
+LINEAR_FEATURES = ('bias', 'food_distance', 'eats_food', 'ghosts_1_step', 'ghosts_3_steps', 'edible_ghost_distance',
+                   'eats_ghost', 'eats_powerup', 'powerup_distance', 'food_left', 'invulnerable_time')
+
+# invulnerable time of a powerup, as Pacman.powerup_time
+POWERUP_TIME = 40
+
+
+class HashCollisionError(RuntimeError):
+    """
+    Raised in debug mode when two different states share a zobrist hash, or the incremental hash is wrong
+    """
+    pass
+
+
 class GameStateRepr:
     """
     A game state representation specifies information of a game state, providing methods to access
@@ -21,36 +50,237 @@ class GameStateRepr:
         elif agent == 'ghost':
             return self.get_ghost_action()
 
+    def get_key(self):
+        """
+        return: a compact hashable value identifying the state, as used to intern states in a q table
+        """
+        raise NotImplementedError
+
 
 class SimpleGameStateRepr(GameStateRepr):
     """
     A simple game state representation includes symbolized virtual representation of the game map,
     plus hidden status such as whether the Pacman is invulnerable.
 
+    The map is represented by the bitboards of its layers (wall, food, powerup, pacman, ghost) as Python ints, so
+    states compare exactly while staying small, and the hash is computed once.
+
     Learning agents may use this as the state during the learning process.
     """
 
     def __init__(self, game_state):
         super().__init__(game_state)
-        self.state_repr = str(game_state.map_repr_list)
+        self.state_repr = game_state.get_bitboards() + (self.pacman_vulnerable,)
+        self.state_hash = hash(self.state_repr)
 
     def __eq__(self, other):
         if not isinstance(other, SimpleGameStateRepr):
             return False
-        return self.state_repr == other.state_repr and self.pacman_vulnerable == other.pacman_vulnerable
+        return self.state_hash == other.state_hash and self.state_repr == other.state_repr
 
     def __hash__(self):
-        return hash(self.state_repr)
+        return self.state_hash
+
+    def get_key(self):
+        return self.state_repr
+
+    def __getstate__(self):
+        return self.state_repr, encode_actions(self.pacman_action), encode_actions(self.ghost_action)
+
+    def __setstate__(self, state):
+        self.state_repr, pacman_action, ghost_action = state
+        self.pacman_vulnerable = self.state_repr[-1]
+        self.pacman_action = decode_actions(pacman_action)
+        self.ghost_action = decode_actions(ghost_action)
+        self.state_hash = hash(self.state_repr)
+
+
+class ZobristGameStateRepr(GameStateRepr):
+    """
+    A zobrist game state representation identifies the state by the 64 bit board hash maintained by the game
+    state, so building, hashing and comparing states does not depend on the map size.
+
+    In debug mode the full board is kept as well, and equal hashes of different boards raise HashCollisionError.
+    """
+
+    def __init__(self, game_state):
+        super().__init__(game_state)
+        self.state_key = game_state.get_state_key()
+        self.state_repr = game_state.get_bitboards() + (self.pacman_vulnerable,) if game_state.debug_hash else None
+
+    def __eq__(self, other):
+        if not isinstance(other, ZobristGameStateRepr):
+            return False
+        if self.state_key != other.state_key:
+            return False
+        if self.state_repr is not None and other.state_repr is not None and self.state_repr != other.state_repr:
+            raise HashCollisionError('states with different boards share the zobrist hash %x' % self.state_key)
+        return True
+
+    def __hash__(self):
+        return self.state_key
+
+    def get_key(self):
+        return self.state_key
 
 
 class FeatureGameStateRepr(GameStateRepr):
+    """
+    A feature game state representation describes the state from the view of the Pacman instead of the whole map:
+    the first move direction towards and the maze distance from the closest food, ghost and powerup, the remaining
+    invulnerable time, and the available Pacman actions.
+
+    The features are small integers, distances capped at FEATURE_DISTANCE_CAPS and the invulnerable time counted
+    in steps of FEATURE_INVULNERABLE_STEP, packed into a single int by their FEATURE_BITS widths. The packed int
+    is the hash and the key of the state, so the number of states no longer grows with the map.
+    """
+
     def __init__(self, game_state):
         super().__init__(game_state)
+        pacman = game_state.pacmans[0]
+        location_index = pacman.get_location()
+        ghost_grids = [game_state.grid_index[ghost.y, ghost.x] for ghost in game_state.ghosts if not ghost.is_dead()]
+
+        food_cap, ghost_cap, powerup_cap = FEATURE_DISTANCE_CAPS
+        self.state_repr = (
+            *encode_direction(*game_state.get_closest_direction(location_index, game_state.food_mask), food_cap),
+            *encode_direction(*game_state.get_closest_direction(location_index, ghost_grids), ghost_cap),
+            *encode_direction(*game_state.get_closest_direction(location_index, game_state.powerup_mask), powerup_cap),
+            -(-pacman.get_invulnerable_time() // FEATURE_INVULNERABLE_STEP),
+            encode_actions(self.pacman_action),
+        )
+        self.state_key = pack_features(self.state_repr)
 
     def __eq__(self, other):
         if not isinstance(other, FeatureGameStateRepr):
             return False
-        pass
+        return self.state_key == other.state_key
 
     def __hash__(self):
-        pass
+        return self.state_key
+
+    def get_key(self):
+        return self.state_key
+
+    def __getstate__(self):
+        return self.state_key, encode_actions(self.ghost_action)
+
+    def __setstate__(self, state):
+        self.state_key, ghost_action = state
+        self.state_repr = unpack_features(self.state_key)
+        self.pacman_vulnerable = self.state_repr[-2] > 0
+        self.pacman_action = decode_actions(self.state_repr[-1])
+        self.ghost_action = decode_actions(ghost_action)
+
+
+class LinearFeatureGameStateRepr(GameStateRepr):
+    """
+    A linear feature game state representation describes each of the 4 Pacman actions by a fixed-length vector of
+    features (see LINEAR_FEATURES) of the grid the action moves to, for learning agents approximating q values as
+    a linear function of them.
+
+    The features are computed at once for the 4 actions from the maze distance rows of the 4 grids: the distance
+    to the closest food and powerup, the number of dangerous ghosts within 1 and 3 steps, the distance to the
+    closest ghost while the Pacman is invulnerable, whether food, a powerup or an edible ghost is reached, and the
+    share of food left and of invulnerable time. Distances are divided by the width plus the height of the map, so
+    the features do not grow with the map. Rows of unavailable actions are those of staying in place.
+    """
+
+    def __init__(self, game_state):
+        super().__init__(game_state)
+        pacman = game_state.pacmans[0]
+        grid_number = game_state.grid_index[pacman.y, pacman.x]
+        move_grids = game_state.get_move_grids()[grid_number]
+        distances = game_state.get_pair_distances()[move_grids]
+        scale = game_state.width + game_state.height
+        invulnerable = pacman.is_invulnerable()
+
+        ghost_grids = [game_state.grid_index[ghost.y, ghost.x] for ghost in game_state.ghosts if not ghost.is_dead()]
+        ghost_distances = distances[:, ghost_grids]
+        closest_ghost = ghost_distances.min(axis=1, initial=UNREACHABLE)
+
+        features = np.zeros((len(DIRECTIONS), len(LINEAR_FEATURES)), dtype=np.float64)
+        features[:, 0] = 1
+        features[:, 1] = get_scaled_distance(distances.min(axis=1, where=game_state.food_mask, initial=UNREACHABLE),
+                                             scale)
+        features[:, 2] = game_state.food_mask[move_grids]
+        if invulnerable:
+            features[:, 5] = get_scaled_distance(closest_ghost, scale)
+            features[:, 6] = closest_ghost <= 1
+        else:
+            features[:, 3] = (ghost_distances <= 1).sum(axis=1)
+            features[:, 4] = (ghost_distances <= 3).sum(axis=1)
+        features[:, 7] = game_state.powerup_mask[move_grids]
+        features[:, 8] = get_scaled_distance(
+            distances.min(axis=1, where=game_state.powerup_mask, initial=UNREACHABLE), scale)
+        features[:, 9] = game_state.get_cur_dots_counter() / max(game_state.get_original_dots_counter(), 1)
+        features[:, 10] = pacman.get_invulnerable_time() / POWERUP_TIME
+        self.features = features
+
+    def get_features(self):
+        """
+        return: float array of shape (4, len(LINEAR_FEATURES)), the features of each action in DIRECTIONS order
+        """
+        return self.features
+
+    def get_key(self):
+        return self.features.tobytes()
+
+
+# state representations by name, as given in the GameEnv config
+STATE_REPRS = {
+    'simple': SimpleGameStateRepr,
+    'zobrist': ZobristGameStateRepr,
+    'feature': FeatureGameStateRepr,
+    'linear': LinearFeatureGameStateRepr,
+}
+
+
+# -------------------- helper methods --------------------
+
+def encode_actions(actions):
+    """
+    Pack a list of directions into an int, bit k being set for the k-th of DIRECTIONS
+    """
+    return sum(1 << DIRECTIONS.index(action) for action in actions)
+
+
+def decode_actions(action_bits):
+    return [direction for k, direction in enumerate(DIRECTIONS) if action_bits >> k & 1]
+
+
+def get_scaled_distance(distances, scale):
+    """
+    return: distances divided by scale and capped at 1, 0 for unreachable
+    """
+    return np.where(distances == UNREACHABLE, 0, np.minimum(distances / scale, 1))
+
+
+def encode_direction(direction, distance, cap):
+    """
+    return: (the index of direction in DIRECTIONS, 4 for (0, 0) and FEATURE_NO_DIRECTION for None, the distance
+    capped at cap, which also stands for no distance)
+    """
+    if direction is None:
+        return FEATURE_NO_DIRECTION, cap
+    direction = DIRECTIONS.index(direction) if direction != (0, 0) else len(DIRECTIONS)
+    return direction, min(distance, cap)
+
+
+def pack_features(features):
+    """
+    Pack a feature tuple into an int, each feature taking the bits given by FEATURE_BITS
+    """
+    key, shift = 0, 0
+    for feature, bits in zip(features, FEATURE_BITS):
+        key |= feature << shift
+        shift += bits
+    return key
+
+
+def unpack_features(key):
+    features = []
+    for bits in FEATURE_BITS:
+        features.append(key & (1 << bits) - 1)
+        key >>= bits
+    return tuple(features)
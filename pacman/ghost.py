@@ -6,9 +6,10 @@ class Ghost(Agent):
     The Ghost class specifies various status of the ghost, including the location and a respawn timer
     """
 
-    def __init__(self, game_map, location_index, player_number=0):
-        super().__init__(game_map, location_index, player_number)
-        self.initial_x, self.initial_y = location_index
+    __slots__ = ('respawn_time', 'respawn_timer')
+
+    def __init__(self, game_map, location_index, move_tables, random_stream, player_number=0):
+        super().__init__(game_map, location_index, player_number, move_tables, random_stream)
         self.label = 'M'
         self.respawn_time = 30
         self.respawn_timer = 0
@@ -19,6 +20,17 @@ class Ghost(Agent):
 
         return self.x == other.x and self.y == other.y and self.respawn_timer == other.respawn_timer
 
+    def reset(self):
+        super().reset()
+        self.respawn_timer = 0
+
+    def snapshot(self):
+        return super().snapshot() + (self.respawn_timer,)
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        self.respawn_timer = snapshot[4]
+
     def update(self):
         """
         Update the location of the ghost according to its strategy
@@ -35,4 +47,4 @@ class Ghost(Agent):
         """
         self.dead = False
         self.x, self.y = self.initial_x, self.initial_y
-        self.game_map[self.y][self.x].add_object(self)
+        self.game_map[self.y][self.x].add_agent(self)
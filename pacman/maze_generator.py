@@ -0,0 +1,107 @@
+import argparse
+import os
+import numpy as np
+from pacman.util import get_path
+
+# the moves between neighbouring cells of the maze, in grids
+CELL_STEPS = ((0, -2), (0, 2), (-2, 0), (2, 0))
+
+
+def generate_level(width, height, seed=None, num_pacmans=1, ghost_density=0.005, food_density=0.6,
+                   powerup_density=0.005, loop_density=0.1, num_ghosts=None):
+    """
+    Generate a random maze level of any size, reproducible from its seed.
+
+    The maze is carved by a randomized depth first search between the cells at odd coordinates, so every open grid
+    is reachable, and a loop_density fraction of the remaining walls between neighbouring cells is removed, so the
+    maze has loops to escape the ghosts through. The open grids are shuffled and given in turn to num_pacmans
+    pacmans, the ghosts, the powerups, then food with probability food_density, at least one food. The number of
+    ghosts and powerups is their density times the number of open grids, at least one for a positive density, or
+    num_ghosts if given.
+    return: map_string of height rows of width characters, as read by read_level
+    """
+    if width < 3 or height < 3:
+        raise ValueError('a level needs at least 3 x 3 grids, got %d x %d' % (width, height))
+    rng = np.random.default_rng(seed)
+    wall = np.ones((height, width), dtype=bool)
+    carve_maze(wall, rng)
+
+    # walls between two cells, which can be removed without opening the border
+    y, x = np.mgrid[:height, :width]
+    between_cells = wall & (((x % 2 == 1) & (y % 2 == 0)) | ((x % 2 == 0) & (y % 2 == 1)))
+    between_cells &= (x > 0) & (y > 0) & (x < 2 * ((width - 1) // 2)) & (y < 2 * ((height - 1) // 2))
+    wall[between_cells & (rng.random((height, width)) < loop_density)] = False
+
+    open_grids = rng.permutation(np.flatnonzero(~wall))
+    if num_ghosts is None:
+        num_ghosts = get_count(ghost_density, len(open_grids))
+    num_powerups = get_count(powerup_density, len(open_grids))
+    num_placed = num_pacmans + num_ghosts + num_powerups
+    if num_placed >= len(open_grids):
+        raise ValueError('%d open grids leave no room for %d pacmans, %d ghosts, %d powerups and food' %
+                         (len(open_grids), num_pacmans, num_ghosts, num_powerups))
+
+    grids = np.where(wall, '#', ' ').reshape(-1)
+    grids[open_grids[:num_pacmans]] = 'P'
+    grids[open_grids[num_pacmans:num_pacmans + num_ghosts]] = 'M'
+    grids[open_grids[num_pacmans + num_ghosts:num_placed]] = '@'
+    food = open_grids[num_placed:][rng.random(len(open_grids) - num_placed) < food_density]
+    grids[food if len(food) > 0 else open_grids[num_placed:num_placed + 1]] = '*'
+    return ''.join(grids.tolist())
+
+
+def carve_maze(wall, rng):
+    """
+    Open the cells at odd coordinates of a wall mask and the walls between them along a random spanning tree
+    """
+    height, width = wall.shape
+    start = (1, 1)
+    wall[start[1], start[0]] = False
+    stack = [start]
+    while stack:
+        x, y = stack[-1]
+        steps = [(dx, dy) for dx, dy in CELL_STEPS
+                 if 0 < x + dx < width - 1 and 0 < y + dy < height - 1 and wall[y + dy, x + dx]]
+        if not steps:
+            stack.pop()
+            continue
+        dx, dy = steps[int(rng.integers(len(steps)))]
+        wall[y + dy // 2, x + dx // 2] = wall[y + dy, x + dx] = False
+        stack.append((x + dx, y + dy))
+
+
+def get_count(density, num_grids):
+    return max(int(round(density * num_grids)), 1 if density > 0 else 0)
+
+
+def write_level(path, width, map_string):
+    """
+    Write a map in the level file format: a line per row, the characters of a row separated by spaces
+    """
+    with open(path, 'w') as f:
+        for y in range(len(map_string) // width):
+            f.write(' '.join(map_string[y * width:(y + 1) * width]) + '\n')
+
+
+if __name__ == '__main__':
+    # run from the pacman directory, the level is written to maps/
+    parser = argparse.ArgumentParser(description='Generate a random maze level')
+    parser.add_argument('level', type=int, help='number of the level, written to maps/level<level>.txt')
+    parser.add_argument('--width', type=int, default=100)
+    parser.add_argument('--height', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pacmans', type=int, default=1, help='number of pacmans')
+    parser.add_argument('--ghosts', type=int, help='number of ghosts, overrides --ghost-density')
+    parser.add_argument('--ghost-density', type=float, default=0.005, help='ghosts per open grid')
+    parser.add_argument('--food-density', type=float, default=0.6, help='probability of food on a free grid')
+    parser.add_argument('--powerup-density', type=float, default=0.005, help='powerups per open grid')
+    parser.add_argument('--loop-density', type=float, default=0.1, help='fraction of maze walls removed')
+    parser.add_argument('--force', action='store_true', help='overwrite an existing level')
+    args = parser.parse_args()
+
+    path = get_path('level%d.txt' % args.level, 'maps')
+    if os.path.exists(path) and not args.force:
+        raise ValueError('level %d exists, use --force to overwrite it' % args.level)
+    map_string = generate_level(args.width, args.height, args.seed, args.pacmans, args.ghost_density,
+                                args.food_density, args.powerup_density, args.loop_density, args.ghosts)
+    write_level(path, args.width, map_string)
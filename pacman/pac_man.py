@@ -7,8 +7,10 @@ class Pacman(Agent):
     ghosts.
     """
 
-    def __init__(self, game_map, location_index, player_number=0):
-        super().__init__(game_map, location_index, player_number)
+    __slots__ = ('powerup_time', 'invulnerable_timer')
+
+    def __init__(self, game_map, location_index, move_tables, random_stream, player_number=0):
+        super().__init__(game_map, location_index, player_number, move_tables, random_stream)
         self.label = 'P'
         self.powerup_time = 40
         self.invulnerable_timer = 0
@@ -19,6 +21,17 @@ class Pacman(Agent):
 
         return self.x == other.x and self.y == other.y and self.invulnerable_timer == other.invulnerable_timer
 
+    def reset(self):
+        super().reset()
+        self.invulnerable_timer = 0
+
+    def snapshot(self):
+        return super().snapshot() + (self.invulnerable_timer,)
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        self.invulnerable_timer = snapshot[4]
+
     def update(self):
         """
         Update the location of the pacman according to its strategy
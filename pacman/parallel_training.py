@@ -0,0 +1,320 @@
+import multiprocessing
+import multiprocessing.connection
+import numpy as np
+from pacman.checkpoint import Checkpointer
+from pacman.game_env import GameEnv
+from pacman.q_table import SharedQTable
+
+
+class ParallelTrainer:
+    """
+    A parallel trainer runs GameEnv episodes in worker processes, each with its own random seed and its own copy of
+    the q table, and merges the q value changes of the workers into the master learning agent.
+
+    In every round a worker plays some episodes and sends back the change and the new value of each q table entry
+    it updated. The coordinator merges them into the master table, then sends the new values of all changed entries
+    to the workers, so their copies follow the master policy.
+
+    In deterministic mode rounds are synchronous: all workers start a round from the same values, and the mean
+    change of each entry over the workers which updated it is added to the master table. Worker seeds are derived
+    from the seed, the round and the worker number, and changes are merged in worker order, so a run is
+    reproducible for a given number of workers.
+
+    Otherwise a worker starts its next round as soon as its own changes are merged, and the master table may have
+    moved on while it played. An entry the master has not changed since the task of the worker was sent takes the
+    new value of the worker. An entry another worker changed meanwhile takes the mean of the master and worker
+    values, as in a synchronous round, since the change of the worker was made from an outdated value.
+
+    Given a checkpoint_interval in the cfg, the master table is checkpointed by the coordinator as episodes are
+    merged, the workers play without checkpoints.
+    """
+
+    def __init__(self, cfg, learning_agent, num_workers, episodes_per_round=10, deterministic=False, seed=None):
+        self.cfg = cfg
+        self.learning_agent = learning_agent
+        self.num_workers = num_workers
+        self.episodes_per_round = episodes_per_round
+        self.deterministic = deterministic
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.round_count = 0
+        self.merge_count = 0
+        self.checkpointer = get_checkpointer(cfg, learning_agent)
+
+        self.connections, self.workers = [], []
+        for _ in range(num_workers):
+            connection, worker_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=run_worker, daemon=True,
+                                             args=(worker_connection, get_worker_cfg(cfg), type(learning_agent),
+                                                   learning_agent.get_params()))
+            worker.start()
+            self.connections.append(connection)
+            self.workers.append(worker)
+
+        # entries changed in the master table since the last round of each worker, key: q table entry key
+        initial_entries = dict(learning_agent.get_entries())
+        self.unsynced = [dict(initial_entries) for _ in range(num_workers)]
+        # number of the last merge which changed an entry, key: q table entry key
+        self.changed_at = {}
+        # number of merges done when the current task of each worker was sent
+        self.task_merge_counts = [0] * num_workers
+
+    def train(self, num_episodes):
+        """
+        Play num_episodes episodes on the workers, merging their changes into the learning agent
+        return: list of (game status, score) of the episodes, in the order they are merged
+        """
+        if self.deterministic:
+            return self.train_synchronous(num_episodes)
+        else:
+            return self.train_asynchronous(num_episodes)
+
+    def train_synchronous(self, num_episodes):
+        results = []
+        remaining = num_episodes
+        while remaining > 0:
+            busy = []
+            for worker in range(self.num_workers):
+                episodes = min(self.episodes_per_round, remaining)
+                if episodes == 0:
+                    break
+                remaining -= episodes
+                self.send_task(worker, episodes)
+                busy.append(worker)
+
+            worker_changes, round_results = [], []
+            for worker in busy:
+                changes, worker_results = self.connections[worker].recv()
+                worker_changes.append(changes)
+                round_results.extend(worker_results)
+            self.merge(worker_changes)
+            self.end_episodes(len(round_results))
+            results.extend(round_results)
+            self.round_count += 1
+
+        return results
+
+    def train_asynchronous(self, num_episodes):
+        results = []
+        remaining = num_episodes
+        busy = {}
+        for worker in range(self.num_workers):
+            episodes = min(self.episodes_per_round, remaining)
+            if episodes == 0:
+                break
+            remaining -= episodes
+            self.send_task(worker, episodes)
+            busy[self.connections[worker]] = worker
+
+        while busy:
+            for connection in multiprocessing.connection.wait(list(busy)):
+                worker = busy.pop(connection)
+                changes, worker_results = connection.recv()
+                results.extend(worker_results)
+                self.merge_asynchronous(worker, changes)
+                self.end_episodes(len(worker_results))
+                self.round_count += 1
+
+                episodes = min(self.episodes_per_round, remaining)
+                if episodes > 0:
+                    remaining -= episodes
+                    self.send_task(worker, episodes)
+                    busy[connection] = worker
+
+        return results
+
+    def send_task(self, worker, num_episodes):
+        seed = np.random.SeedSequence([self.seed, self.round_count, worker]).generate_state(1)[0]
+        entries = list(self.unsynced[worker].items())
+        self.unsynced[worker] = {}
+        self.task_merge_counts[worker] = self.merge_count
+        self.connections[worker].send((entries, int(seed), num_episodes))
+
+    def merge(self, worker_changes):
+        """
+        Add the mean change of each entry over the given workers, which started from the same values, to the master
+        table
+        """
+        delta_sums, delta_counts = {}, {}
+        for changes in worker_changes:
+            for key, delta, _ in changes:
+                delta_sums[key] = delta_sums.get(key, 0) + delta
+                delta_counts[key] = delta_counts.get(key, 0) + 1
+
+        changed = {}
+        for key, delta_sum in delta_sums.items():
+            changed[key] = self.learning_agent.get_entry(key) + delta_sum / delta_counts[key]
+        self.apply(changed)
+
+    def merge_asynchronous(self, worker, changes):
+        """
+        Merge the changes of a worker into the master table, which may have changed since its task was sent
+        """
+        task_merge_count = self.task_merge_counts[worker]
+        changed = {}
+        for key, _, q_value in changes:
+            if self.changed_at.get(key, -1) >= task_merge_count:
+                q_value = (self.learning_agent.get_entry(key) + q_value) / 2
+            changed[key] = q_value
+        self.apply(changed)
+
+    def apply(self, changed):
+        """
+        Set the changed entries in the master table and queue their new values for every worker
+        """
+        for key, q_value in changed.items():
+            self.learning_agent.set_entry(key, q_value)
+            self.changed_at[key] = self.merge_count
+        self.merge_count += 1
+
+        for unsynced in self.unsynced:
+            unsynced.update(changed)
+
+    def end_episodes(self, num_episodes):
+        """
+        Count merged episodes towards the checkpoints of the master table
+        """
+        if self.checkpointer is not None:
+            for _ in range(num_episodes):
+                self.checkpointer.end_episode()
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+        for worker in self.workers:
+            worker.join()
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+            self.checkpointer = None
+
+
+class HogwildTrainer:
+    """
+    A hogwild trainer runs GameEnv episodes in worker processes which all update the q table of the learning agent
+    in place, a SharedQTable. There is no coordinator merging changes and no copy of the table: the workers see the
+    updates of each other as soon as they are written.
+
+    Worker seeds are derived from the seed, the round and the worker number, but the interleaving of the updates of
+    the workers is not, so a run is only reproducible with one worker.
+
+    Given a checkpoint_interval in the cfg, the table is checkpointed by the coordinator after each round, from the
+    entries the workers report as updated, the workers play without checkpoints.
+    """
+
+    def __init__(self, cfg, learning_agent, num_workers, seed=None):
+        if not isinstance(learning_agent.q_table, SharedQTable):
+            raise ValueError('hogwild training needs a learning agent with a shared q table, see shared_states')
+        self.cfg = cfg
+        self.learning_agent = learning_agent
+        self.num_workers = num_workers
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.round_count = 0
+        self.update_count = 0
+        self.checkpointer = get_checkpointer(cfg, learning_agent)
+
+    def train(self, num_episodes):
+        """
+        Play num_episodes episodes split evenly over the workers
+        return: list of (game status, score) of the episodes, in worker order
+        """
+        connections, workers = [], []
+        for worker in range(self.num_workers):
+            episodes = num_episodes // self.num_workers + (worker < num_episodes % self.num_workers)
+            seed = np.random.SeedSequence([self.seed, self.round_count, worker]).generate_state(1)[0]
+            connection, worker_connection = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=run_hogwild_worker, daemon=True,
+                                              args=(worker_connection, get_worker_cfg(self.cfg), self.learning_agent,
+                                                    int(seed), episodes, self.checkpointer is not None))
+            process.start()
+            worker_connection.close()
+            connections.append(connection)
+            workers.append(process)
+
+        results, updated_keys = [], set()
+        for connection, process in zip(connections, workers):
+            worker_results, update_count, worker_keys = connection.recv()
+            results.extend(worker_results)
+            self.update_count += update_count
+            updated_keys.update(worker_keys)
+            process.join()
+        self.round_count += 1
+
+        if self.checkpointer is not None:
+            # the workers wrote the shared table directly, the entries are recorded by setting their own values
+            for key in updated_keys:
+                self.learning_agent.set_entry(key, self.learning_agent.get_entry(key))
+            for _ in results:
+                self.checkpointer.end_episode()
+        return results
+
+    def close(self):
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+            self.checkpointer = None
+
+
+# -------------------- helper methods --------------------
+
+def run_worker(connection, cfg, agent_class, agent_params):
+    """
+    Worker process loop: apply the master entries, play the episodes of the task with the given seed, and send back
+    the change and new value of each updated q table entry and the results of the episodes
+    """
+    learning_agent = agent_class(**agent_params)
+    game_env = GameEnv(cfg)
+    game_env.set_learning_agent(learning_agent)
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+
+        entries, seed, num_episodes = task
+        for key, q_value in entries:
+            learning_agent.set_entry(key, q_value)
+
+        game_env.seed_episodes(seed)
+        learning_agent.start_recording()
+        results = []
+        for _ in range(num_episodes):
+            game_env.reset()
+            game_env.start_game()
+            results.append((game_env.game_state.get_game_status(), game_env.game_state.get_score()))
+
+        changes = [(key, delta, learning_agent.get_entry(key)) for key, delta in learning_agent.stop_recording()]
+        connection.send((changes, results))
+
+
+def run_hogwild_worker(connection, cfg, learning_agent, seed, num_episodes, record=False):
+    """
+    Hogwild worker process: play the episodes with the given seed, updating the shared q table of the learning
+    agent, and send back the results of the episodes, the number of q value updates and, if record is set, the
+    keys of the updated entries
+    """
+    game_env = GameEnv(cfg)
+    game_env.set_learning_agent(learning_agent)
+    game_env.seed_episodes(seed)
+    if record:
+        learning_agent.start_recording()
+    results, update_count = [], 0
+    for _ in range(num_episodes):
+        game_env.reset()
+        game_env.start_game()
+        results.append((game_env.game_state.get_game_status(), game_env.game_state.get_score()))
+        update_count += game_env.game_state.get_time()
+    updated_keys = [key for key, _ in learning_agent.pop_changed_entries()] if record else []
+    connection.send((results, update_count, updated_keys))
+
+
+def get_worker_cfg(cfg):
+    """
+    return: the cfg of the GameEnv of a worker, without checkpoints, which only the coordinator writes
+    """
+    return {key: value for key, value in cfg.items() if key != 'checkpoint_interval'}
+
+
+def get_checkpointer(cfg, learning_agent):
+    """
+    return: a Checkpointer of the learning agent for the checkpoint_interval of the cfg, None for no checkpoints
+    """
+    if cfg.get('checkpoint_interval') is None:
+        return None
+    return Checkpointer(learning_agent, cfg['level'], cfg['checkpoint_interval'])
@@ -0,0 +1,170 @@
+import math
+import random
+import time
+
+# value of a simulated game ending in a win or a loss, on top of the score change
+WIN_BONUS = 500
+LOSE_PENALTY = 1000
+
+# value lost per grid of maze distance between the pacman and the closest food at the end of a simulation
+FOOD_DISTANCE_WEIGHT = 1
+
+
+class SearchNode:
+    """
+    A search node is a sequence of pacman actions from the root of the search. Ghost moves are sampled anew in
+    every simulation, so the node keeps the mean value of all simulations through it.
+    """
+
+    def __init__(self, actions):
+        self.actions = actions
+        self.children = {}
+        self.visits = 0
+        self.value_sum = 0
+
+    def get_value(self):
+        return self.value_sum / self.visits if self.visits > 0 else 0
+
+    def get_untried_actions(self):
+        return [action for action in self.actions if action not in self.children]
+
+    def select_child(self, exploration):
+        """
+        return: (action, child) with the best upper confidence bound
+        """
+        log_visits = math.log(self.visits)
+        return max(self.children.items(), key=lambda item: item[1].get_value() +
+                   exploration * math.sqrt(log_visits / item[1].visits))
+
+
+class MCTSPlanner:
+    """
+    A Monte Carlo tree search planner chooses pacman actions by simulating the game forward from the current game
+    state, with the ghosts following their random strategy, the model the game uses for them.
+
+    Each iteration restores the game state from a snapshot, descends the tree of pacman action sequences by upper
+    confidence bounds, adds a node, and plays random pacman moves for rollout_depth ticks. Its value is the score
+    change, plus WIN_BONUS for a win, minus LOSE_PENALTY for a loss, or minus FOOD_DISTANCE_WEIGHT per grid to the
+    closest food for an ongoing game. Iterations run until time_budget seconds or node_budget simulated ticks are
+    used, whichever comes first. The subtree of the chosen action is kept as the root of the next search.
+
+    The search draws its pacman moves from its own random generator. Each iteration moves the random stream of the
+    game to a seed drawn from that generator, so the ghosts of every simulation follow their random strategy with
+    numbers of their own, not the ones the game will draw next. The game state including its random stream is
+    restored after every iteration, so planning does not change the game's random numbers.
+    """
+
+    def __init__(self, time_budget=0.05, node_budget=None, rollout_depth=10, exploration=20, seed=None):
+        if time_budget is None and node_budget is None:
+            raise ValueError('a planner needs a time budget or a node budget')
+        self.time_budget = time_budget
+        self.node_budget = node_budget
+        self.rollout_depth = rollout_depth
+        self.exploration = exploration
+        self.random = random.Random(seed)
+
+        self.root = None
+        self.root_time = None
+        self.stats = {}
+
+    def choose_action(self, game_state, pacman_num=0):
+        """
+        return: the action of the most visited child of the root after searching
+        """
+        pacman = game_state.pacmans[pacman_num]
+        actions = game_state.get_pacman_available_action(pacman_num)
+        root = self.get_root(game_state, actions)
+        reused_simulations = root.visits
+
+        snapshot = game_state.snapshot()
+        random_stream = game_state.random_stream
+        root_score = game_state.get_score()
+        iterations = nodes = 0
+        start = time.perf_counter()
+        while True:
+            random_stream.setstate(random_stream.get_seed_state(self.random.getrandbits(64)))
+            nodes += self.run_iteration(game_state, root, pacman, root_score)
+            game_state.restore(snapshot)
+            iterations += 1
+
+            elapsed = time.perf_counter() - start
+            if self.node_budget is not None and nodes >= self.node_budget:
+                break
+            if self.time_budget is not None and elapsed >= self.time_budget:
+                break
+
+        action, child = max(root.children.items(), key=lambda item: item[1].visits)
+        self.root, self.root_time = child, game_state.get_time() + 1
+        self.stats = {
+            'iterations': iterations,
+            'nodes': nodes,
+            'seconds': elapsed,
+            'nodes_per_second': nodes / elapsed if elapsed > 0 else 0,
+            'reused_simulations': reused_simulations,
+        }
+        return action
+
+    def get_stats(self):
+        """
+        return: dict of the last search: iterations, simulated ticks (nodes), seconds, nodes per second and the
+        number of simulations through the root kept from the previous search
+        """
+        return self.stats
+
+    # -------------------- search --------------------
+
+    def get_root(self, game_state, actions):
+        """
+        return: the subtree kept from the previous search if the game went on by the chosen action, a new root
+        otherwise
+        """
+        if self.root is not None and self.root_time == game_state.get_time() and self.root.actions == actions:
+            return self.root
+        return SearchNode(actions)
+
+    def run_iteration(self, game_state, root, pacman, root_score):
+        """
+        Run one simulation from the root, the game state being at the root
+        return: number of simulated ticks
+        """
+        node, path, ticks = root, [root], 0
+        while not game_state.is_game_over():
+            untried_actions = node.get_untried_actions()
+            if untried_actions:
+                action = self.random.choice(untried_actions)
+            else:
+                action, _ = node.select_child(self.exploration)
+
+            game_state.set_pacman_action(action)
+            game_state.update()
+            ticks += 1
+
+            if untried_actions:
+                node.children[action] = SearchNode(game_state.get_pacman_available_action())
+            node = node.children[action]
+            path.append(node)
+            if untried_actions:
+                break
+
+        # rollout with random pacman moves, not turning back unless blocked
+        for _ in range(self.rollout_depth):
+            if game_state.is_game_over():
+                break
+            moves = pacman.random_moves[pacman.y][pacman.x][pacman.move_direction]
+            game_state.set_pacman_action(self.random.choice(moves))
+            game_state.update()
+            ticks += 1
+
+        value = game_state.get_score() - root_score
+        if game_state.get_game_status() == 'win':
+            value += WIN_BONUS
+        elif game_state.get_game_status() == 'lose':
+            value -= LOSE_PENALTY
+        else:
+            food_distance = game_state.get_closest_masked_distance(pacman.get_location(), game_state.food_mask)
+            value -= FOOD_DISTANCE_WEIGHT * (food_distance or 0)
+
+        for node in path:
+            node.visits += 1
+            node.value_sum += value
+        return ticks
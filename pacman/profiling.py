@@ -0,0 +1,196 @@
+import csv
+import json
+import os
+import sys
+import time
+
+# phases timed by a profiler attached to a GameEnv. grid_update is also part of pacman_update and ghost_update, and
+# the ticks simulated by a planner are also counted in the update phases.
+PHASES = ('pacman_update', 'ghost_update', 'grid_update', 'get_state', 'choose_action', 'update_q_value', 'render')
+
+# csv columns of a profile log, one row per phase of every profiled episode
+PROFILE_FIELDS = ('episode', 'phase', 'calls', 'seconds')
+
+
+class Profiler:
+    """
+    A profiler counts the calls and sums the time of the phases of the game loop (see PHASES) in the episodes of a
+    GameEnv, per episode and in total.
+
+    Profiling is opt-in and costs nothing while an episode is not profiled: attach() replaces the methods of the
+    phases by timed ones on the game state, learning agent, planner and render of the episode, and detach() puts
+    the original methods back. For long runs, only one of every sample_interval episodes is profiled.
+
+    The phases of every profiled episode are appended to log_path, if given, at the end of the episode: as csv rows
+    of PROFILE_FIELDS for a .csv path, as a json line per episode otherwise.
+    """
+
+    def __init__(self, log_path=None, sample_interval=1):
+        if sample_interval < 1:
+            raise ValueError('sample interval must be at least 1, got %d' % sample_interval)
+        self.log_path = log_path
+        self.sample_interval = sample_interval
+        self.episode_count = 0
+        self.profiled_episodes = 0
+
+        # key: phase, value: [calls, seconds]
+        self.episode_phases = {}
+        self.total_phases = {}
+
+        # objects and method names replaced by timed methods while an episode is profiled
+        self.instrumented = []
+        self.game_state = None
+
+    def add(self, phase, seconds):
+        counters = self.episode_phases.get(phase)
+        if counters is None:
+            counters = self.episode_phases[phase] = [0, 0.0]
+        counters[0] += 1
+        counters[1] += seconds
+
+    def is_active(self):
+        return self.game_state is not None
+
+    # -------------------- episodes --------------------
+
+    def start_episode(self, game_env):
+        """
+        Attach to the game env if the episode is sampled
+        """
+        if self.episode_count % self.sample_interval == 0:
+            self.attach(game_env)
+        self.episode_count += 1
+
+    def end_episode(self):
+        """
+        Detach from the game env, add the phases of the episode to the totals and append them to the log
+        """
+        if not self.is_active():
+            return
+
+        self.detach()
+        for phase, (calls, seconds) in self.episode_phases.items():
+            counters = self.total_phases.setdefault(phase, [0, 0.0])
+            counters[0] += calls
+            counters[1] += seconds
+        if self.log_path is not None:
+            self.write_episode(self.episode_count - 1, self.episode_phases)
+        self.episode_phases = {}
+        self.profiled_episodes += 1
+
+    def attach(self, game_env):
+        game_state = game_env.game_state
+        self.instrument(game_state, 'update_pacmans', 'pacman_update')
+        self.instrument(game_state, 'update_ghosts', 'ghost_update')
+        self.instrument(game_state, 'get_state', 'get_state')
+        if game_env.planner is not None:
+            self.instrument(game_env.planner, 'choose_action', 'choose_action')
+        if game_env.has_learning_agent:
+            self.instrument(game_env.learning_agent, 'get_state_chosen_action', 'choose_action')
+            self.instrument(game_env.learning_agent, 'update_q_value', 'update_q_value')
+        if game_env.display:
+            self.instrument(game_env.render, 'push_state', 'render')
+        game_state.set_profiler(self)
+        self.game_state = game_state
+
+    def detach(self):
+        for obj, name in self.instrumented:
+            delattr(obj, name)
+        self.instrumented = []
+        self.game_state.set_profiler(None)
+        self.game_state = None
+
+    def instrument(self, obj, name, phase):
+        """
+        Replace a method of an object by a timed one, as an instance attribute deleted by detach()
+        """
+        method = getattr(obj, name)
+        add = self.add
+
+        def timed_method(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            add(phase, time.perf_counter() - start)
+            return result
+
+        setattr(obj, name, timed_method)
+        self.instrumented.append((obj, name))
+
+    # -------------------- results --------------------
+
+    def get_totals(self):
+        """
+        return: dict of the profiled episodes, key: phase, value: dict of calls, seconds and microseconds per call
+        """
+        return {phase: {'calls': calls, 'seconds': seconds, 'us_per_call': 1e6 * seconds / calls}
+                for phase, (calls, seconds) in self.total_phases.items()}
+
+    def write_episode(self, episode, phases):
+        is_csv = self.log_path.endswith('.csv')
+        is_new = not os.path.exists(self.log_path) or os.path.getsize(self.log_path) == 0
+        with open(self.log_path, 'a', newline='' if is_csv else None) as f:
+            if is_csv:
+                writer = csv.writer(f)
+                if is_new:
+                    writer.writerow(PROFILE_FIELDS)
+                writer.writerows((episode, phase, calls, seconds) for phase, (calls, seconds) in phases.items())
+            else:
+                json.dump({'episode': episode,
+                           'phases': {phase: {'calls': calls, 'seconds': seconds}
+                                      for phase, (calls, seconds) in phases.items()}}, f)
+                f.write('\n')
+
+
+class MetricsLog:
+    """
+    A metrics log collects the results of training episodes and writes a summary line every interval episodes, in
+    one write to file (stdout by default), instead of printing every episode.
+    """
+
+    def __init__(self, interval=100, file=None):
+        self.interval = interval
+        self.file = sys.stdout if file is None else file
+        self.interval_start_time = time.perf_counter()
+        self.episode_count = 0
+        self.total_wins = self.total_score = 0
+        self.interval_wins = self.interval_score = self.interval_episodes = 0
+        self.q_table_size = None
+
+    def add_episode(self, game_status, score, q_table_size=None):
+        self.episode_count += 1
+        self.interval_episodes += 1
+        self.interval_wins += game_status == 'win'
+        self.interval_score += score
+        self.q_table_size = q_table_size
+        if self.interval_episodes == self.interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the summary of the episodes since the last summary, if any
+        """
+        if self.interval_episodes == 0:
+            return
+
+        now = time.perf_counter()
+        self.total_wins += self.interval_wins
+        self.total_score += self.interval_score
+        line = 'train num: %d win rate: %.4f avg score: %.2f | last %d: win rate: %.4f avg score: %.2f | ' \
+               '%.1f episodes/s' % (self.episode_count, self.total_wins / self.episode_count,
+                                    self.total_score / self.episode_count, self.interval_episodes,
+                                    self.interval_wins / self.interval_episodes,
+                                    self.interval_score / self.interval_episodes,
+                                    self.interval_episodes / max(now - self.interval_start_time, 1e-9))
+        if self.q_table_size is not None:
+            line += ' | q table: %d' % self.q_table_size
+        self.file.write(line + '\n')
+        self.file.flush()
+
+        self.interval_start_time = now
+        self.interval_wins = self.interval_score = self.interval_episodes = 0
+
+    def get_win_rate(self):
+        return (self.total_wins + self.interval_wins) / self.episode_count if self.episode_count else 0
+
+    def get_avg_score(self):
+        return (self.total_score + self.interval_score) / self.episode_count if self.episode_count else 0
@@ -1,10 +1,23 @@
+import json
 import random
 import pickle
 import os
+import numpy as np
+from pacman.agent import DIRECTIONS
+from pacman.checkpoint import read_segments, get_segment_numbers, clear_segments
+from pacman.game_state_repr import LINEAR_FEATURES, encode_actions
+from pacman.experience import ExperienceBuffer
+from pacman.q_table import ArrayQTable, BoundedQTable, SharedQTable, ACTION_INDEX, ACTION_MASKS
 from pacman.util import get_path
 
 
 class QLearning:
+    # name of the state representation the agent learns from, see STATE_REPRS, None for the one of the GameEnv config
+    state_repr = None
+
+    # directory of the checkpoint segments in the model directory of a map, see Checkpointer
+    checkpoint_name = 'q_checkpoint'
+
     def __init__(self, alpha, gamma, epsilon):
         self.alpha = alpha  # learning rate
         self.gamma = gamma  # discount rate
@@ -12,9 +25,29 @@ class QLearning:
 
         self.q_table = {}
 
-    def update_q_value(self, state, action, next_state, reward):
+        # q values before their first update since recording started, key: q table entry key
+        self.recorded = None
+
+    def get_params(self):
+        """
+        return: dict of the constructor arguments, to create the same kind of agent in a worker process
+        """
+        return {'alpha': self.alpha, 'gamma': self.gamma, 'epsilon': self.epsilon}
+
+    def seed(self, seed):
+        """
+        Seed the random numbers the agent draws apart from the random module, which GameEnv.seed_episodes seeds
+        """
+        pass
+
+    def update_q_value(self, state, action, next_state, reward, done=False):
+        """
+        done: whether the game is over in next_state, whose q values are then not counted
+        """
         cur_q_value = self.get_q_value(state, action)
-        next_max_q_value = self.get_max_q_value(next_state)
+        next_max_q_value = 0 if done else self.get_max_q_value(next_state)
+        if self.recorded is not None:
+            self.recorded.setdefault((state, action), cur_q_value)
         self.q_table[(state, action)] = cur_q_value + self.alpha * \
                                         (reward + self.gamma * next_max_q_value - cur_q_value)
 
@@ -34,19 +67,345 @@ class QLearning:
             chosen_action = max(actions, key=lambda action: self.get_q_value(state, action))
             return chosen_action
 
+    # -------------------- q table entries --------------------
+
+    def get_entry(self, key):
+        return self.q_table.get(key, 0)
+
+    def set_entry(self, key, value):
+        if self.recorded is not None:
+            self.recorded.setdefault(key, self.get_entry(key))
+        self.q_table[key] = value
+
+    def get_entries(self):
+        """
+        return: iterator of (key, q value) of all entries of the q table
+        """
+        return iter(self.q_table.items())
+
+    def pop_changed_entries(self):
+        """
+        return: list of (key, q value) of the entries updated since recording started, recording starts again
+        """
+        entries = [(key, self.get_entry(key)) for key in self.recorded]
+        self.recorded = {}
+        return entries
+
+    def start_recording(self):
+        """
+        Start recording which q table entries are updated
+        """
+        self.recorded = {}
+
+    def stop_recording(self):
+        """
+        return: list of (key, change of the q value) of the entries updated since recording started
+        """
+        deltas = [(key, self.get_entry(key) - q_value) for key, q_value in self.recorded.items()]
+        self.recorded = None
+        return [(key, delta) for key, delta in deltas if delta != 0]
+
     def save_model(self, map_num):
         dir = 'model/q_learning_map%d' % map_num
         model_path = get_path('q_model.pkl', dir)
 
         if not os.path.exists(dir):
-            os.mkdir(dir)
+            os.makedirs(dir)
 
         with open(model_path, 'wb') as f:
             pickle.dump(self.q_table, f)
+        clear_segments(self.get_checkpoint_path(map_num))
 
     def load_model(self, map_num):
+        """
+        Load the saved model, then apply the checkpoint segments written since it was saved. With no saved model,
+        the segments are applied to an empty q table.
+        """
         dir = 'model/q_learning_map%d' % map_num
         model_path = get_path('q_model.pkl', dir)
 
-        with open(model_path, 'rb') as f:
-            self.q_table = pickle.load(f)
\ No newline at end of file
+        if os.path.exists(model_path) or not self.has_checkpoint(map_num):
+            with open(model_path, 'rb') as f:
+                self.q_table = pickle.load(f)
+        self.load_checkpoint(map_num)
+
+    # -------------------- checkpoints --------------------
+
+    def get_checkpoint_path(self, map_num):
+        return get_path(self.checkpoint_name, 'model/q_learning_map%d' % map_num)
+
+    def has_checkpoint(self, map_num):
+        return len(get_segment_numbers(self.get_checkpoint_path(map_num))) > 0
+
+    def load_checkpoint(self, map_num):
+        for key, value in read_segments(self.get_checkpoint_path(map_num)):
+            self.set_entry(key, value)
+
+
+class ArrayQLearning(QLearning):
+    """
+    A q learning agent storing its q values in an ArrayQTable: each state is interned once to a row holding the q
+    values of all its actions, and the max and argmax over available actions are operations on that row.
+
+    Given max_states or a memory budget in bytes, the q values are kept in a BoundedQTable instead, which evicts
+    cold states by the eviction policy ('lru' or 'lfu') to stay within the bound. Given shared_states, they are kept
+    in a SharedQTable of that many states instead, which the worker processes of a HogwildTrainer update in place.
+
+    Given replay_capacity, transitions are stored in an ExperienceBuffer of that capacity instead of being learned
+    one by one, and every train_interval transitions a minibatch of batch_size sampled transitions is learned with
+    array operations, see update_q_values.
+    """
+
+    def __init__(self, alpha, gamma, epsilon, capacity=1024, max_states=None, memory_budget=None, eviction='lru',
+                 replay_capacity=None, batch_size=32, train_interval=4, replay_seed=None, shared_states=None):
+        super().__init__(alpha, gamma, epsilon)
+        if shared_states is not None:
+            self.q_table = SharedQTable(shared_states)
+        elif max_states is None and memory_budget is None:
+            self.q_table = ArrayQTable(capacity)
+        else:
+            self.q_table = BoundedQTable(max_states, memory_budget, eviction)
+
+        self.experience = ExperienceBuffer(replay_capacity, replay_seed) if replay_capacity is not None else None
+        self.batch_size = batch_size
+        self.train_interval = train_interval
+        self.transition_count = 0
+
+    def get_params(self):
+        # without shared_states: workers of a ParallelTrainer learn on private tables, not a new shared one
+        params = super().get_params()
+        if isinstance(self.q_table, BoundedQTable):
+            params.update(max_states=self.q_table.max_states, eviction=self.q_table.policy)
+        if self.experience is not None:
+            params.update(replay_capacity=self.experience.capacity, batch_size=self.batch_size,
+                          train_interval=self.train_interval)
+        return params
+
+    def update_q_value(self, state, action, next_state, reward, done=False):
+        if self.experience is not None:
+            self.add_transition(state, action, next_state, reward, done)
+            return
+
+        next_max_q_value = 0 if done else self.get_max_q_value(next_state)
+        state_id = self.q_table.add_state(state.get_key())
+        q_values = self.q_table.q_values[state_id]
+        column = ACTION_INDEX[action]
+        if self.recorded is not None:
+            self.recorded.setdefault((state.get_key(), action), float(q_values[column]))
+        q_values[column] += self.alpha * (reward + self.gamma * next_max_q_value - q_values[column])
+
+    def seed(self, seed):
+        if self.experience is not None:
+            self.experience.rng = np.random.default_rng(seed)
+
+    # -------------------- experience replay --------------------
+
+    def add_transition(self, state, action, next_state, reward, done):
+        """
+        Store a transition in the experience buffer, and learn a minibatch every train_interval transitions
+        """
+        # each generation is read right after its add, adding the next state may evict rows of a bounded q table
+        generations = self.q_table.generations
+        state_id = self.q_table.add_state(state.get_key())
+        state_generation = 0 if generations is None else generations[state_id]
+        next_state_id = self.q_table.add_state(next_state.get_key())
+        next_state_generation = 0 if generations is None else generations[next_state_id]
+        self.experience.add(state_id, state_generation, ACTION_INDEX[action], reward, next_state_id,
+                            next_state_generation, encode_actions(next_state.get_action()), done)
+
+        self.transition_count += 1
+        if self.transition_count % self.train_interval == 0:
+            self.update_q_values(self.experience.sample(self.batch_size))
+
+    def update_q_values(self, transitions):
+        """
+        Learn a minibatch of Transitions at once. The targets are computed from the q values before the batch, and
+        a state action pair drawn more than once moves by the mean of its updates. Transitions whose rows were
+        evicted from a bounded q table since they were stored are skipped.
+        """
+        state_ids, actions, next_state_ids = transitions.state_ids, transitions.actions, transitions.next_state_ids
+        rewards, next_actions, dones = transitions.rewards, transitions.next_actions, transitions.dones
+        generations = self.q_table.generations
+        if generations is not None:
+            valid = ((generations[state_ids] == transitions.state_generations) &
+                     (generations[next_state_ids] == transitions.next_state_generations))
+            state_ids, actions, next_state_ids = state_ids[valid], actions[valid], next_state_ids[valid]
+            rewards, next_actions, dones = rewards[valid], next_actions[valid], dones[valid]
+
+        q_values = self.q_table.q_values
+        next_max_q_values = q_values[next_state_ids].max(axis=1, where=ACTION_MASKS[next_actions], initial=-np.inf)
+        next_max_q_values[dones | np.isinf(next_max_q_values)] = 0
+        cells = state_ids * q_values.shape[1] + actions
+        deltas = rewards + self.gamma * next_max_q_values - q_values.reshape(-1)[cells]
+
+        cells, inverse = np.unique(cells, return_inverse=True)
+        mean_deltas = np.bincount(inverse, weights=deltas) / np.bincount(inverse)
+        if self.recorded is not None:
+            for cell, q_value in zip(cells.tolist(), q_values.reshape(-1)[cells].tolist()):
+                state_id, column = divmod(cell, q_values.shape[1])
+                self.recorded.setdefault((self.q_table.state_keys[state_id], DIRECTIONS[column]), q_value)
+        q_values.reshape(-1)[cells] += self.alpha * mean_deltas
+
+    # -------------------- q values --------------------
+
+    def get_max_q_value(self, state):
+        q_values = self.q_table.get_q_values(state.get_key())
+        if q_values is None:
+            return 0
+        return float(q_values[ACTION_MASKS[encode_actions(state.get_action())]].max())
+
+    def get_q_value(self, state, action):
+        q_values = self.q_table.get_q_values(state.get_key())
+        return 0 if q_values is None else float(q_values[ACTION_INDEX[action]])
+
+    def get_state_chosen_action(self, state, actions):
+        if random.random() < self.epsilon:
+            return random.choice(actions)
+
+        q_values = self.q_table.get_q_values(state.get_key())
+        if q_values is None:
+            return actions[0]
+        columns = np.flatnonzero(ACTION_MASKS[encode_actions(actions)])
+        return DIRECTIONS[columns[q_values[columns].argmax()]]
+
+    def get_entry(self, key):
+        state_key, action = key
+        q_values = self.q_table.get_q_values(state_key)
+        return 0 if q_values is None else float(q_values[ACTION_INDEX[action]])
+
+    def set_entry(self, key, value):
+        if self.recorded is not None:
+            self.recorded.setdefault(key, self.get_entry(key))
+        state_key, action = key
+        state_id = self.q_table.add_state(state_key)
+        self.q_table.q_values[state_id, ACTION_INDEX[action]] = value
+
+    def get_entries(self):
+        for state_key, state_id in self.q_table.state_ids.items():
+            for action, q_value in zip(DIRECTIONS, self.q_table.q_values[state_id].tolist()):
+                yield (state_key, action), q_value
+
+    def stop_recording(self):
+        # entries evicted from a bounded q table since recording started have lost their changes
+        self.recorded = {key: q_value for key, q_value in self.recorded.items() if key[0] in self.q_table}
+        return super().stop_recording()
+
+    def pop_changed_entries(self):
+        self.recorded = {key: q_value for key, q_value in self.recorded.items() if key[0] in self.q_table}
+        return super().pop_changed_entries()
+
+    def get_stats(self):
+        """
+        return: the hit, miss and eviction statistics of a bounded q table, None for an unbounded one
+        """
+        return self.q_table.get_stats() if isinstance(self.q_table, BoundedQTable) else None
+
+    def save_model(self, map_num):
+        self.q_table.save(get_path('q_model', 'model/q_learning_map%d' % map_num))
+        clear_segments(self.get_checkpoint_path(map_num))
+
+    def load_model(self, map_num, mmap_mode='c'):
+        dir_path = get_path('q_model', 'model/q_learning_map%d' % map_num)
+        if os.path.exists(dir_path) or not self.has_checkpoint(map_num):
+            if isinstance(self.q_table, BoundedQTable):
+                self.q_table = BoundedQTable.load(dir_path, self.q_table.max_states, policy=self.q_table.policy)
+            elif isinstance(self.q_table, SharedQTable):
+                self.q_table.close()
+                self.q_table = SharedQTable.load(dir_path, self.q_table.max_states)
+            else:
+                self.q_table = ArrayQTable.load(dir_path, mmap_mode=mmap_mode)
+        self.load_checkpoint(map_num)
+
+
+class LinearQLearning(QLearning):
+    """
+    An approximate q learning agent: the q value of an action is the dot product of a weight vector with the
+    action's features from LinearFeatureGameStateRepr, so states never seen before get q values from similar
+    ones, and the model is len(LINEAR_FEATURES) weights whatever the size of the map.
+
+    The q values of the 4 actions of a state are one matrix vector product, and a temporal difference update moves
+    the weights along the features of the taken action. Rewards are divided by reward_scale to keep the weights of
+    the large score changes (eaten ghosts, lost games) small.
+    """
+
+    state_repr = 'linear'
+    checkpoint_name = 'linear_q_checkpoint'
+
+    def __init__(self, alpha, gamma, epsilon, reward_scale=100):
+        super().__init__(alpha, gamma, epsilon)
+        self.reward_scale = reward_scale
+        self.weights = np.zeros(len(LINEAR_FEATURES), dtype=np.float64)
+        # the whole model, in place of the q table of the tabular agents
+        self.q_table = self.weights
+
+    def get_params(self):
+        params = super().get_params()
+        params.update(reward_scale=self.reward_scale)
+        return params
+
+    def update_q_value(self, state, action, next_state, reward, done=False):
+        features = state.get_features()[ACTION_INDEX[action]]
+        next_max_q_value = 0 if done else self.get_max_q_value(next_state)
+        delta = reward / self.reward_scale + self.gamma * next_max_q_value - features @ self.weights
+        self.weights += self.alpha * delta * features
+
+    def get_q_values(self, state):
+        """
+        return: the q values of the 4 actions of the state, in DIRECTIONS order
+        """
+        return state.get_features() @ self.weights
+
+    def get_max_q_value(self, state):
+        q_values = self.get_q_values(state)
+        return float(q_values[ACTION_MASKS[encode_actions(state.get_action())]].max())
+
+    def get_q_value(self, state, action):
+        return float(state.get_features()[ACTION_INDEX[action]] @ self.weights)
+
+    def get_state_chosen_action(self, state, actions):
+        if random.random() < self.epsilon:
+            return random.choice(actions)
+
+        q_values = self.get_q_values(state)
+        columns = np.flatnonzero(ACTION_MASKS[encode_actions(actions)])
+        return DIRECTIONS[columns[q_values[columns].argmax()]]
+
+    # -------------------- weights --------------------
+
+    def get_entry(self, key):
+        return float(self.weights[LINEAR_FEATURES.index(key)])
+
+    def set_entry(self, key, value):
+        self.weights[LINEAR_FEATURES.index(key)] = value
+
+    def get_entries(self):
+        return zip(LINEAR_FEATURES, self.weights.tolist())
+
+    def start_recording(self):
+        self.recorded = self.weights.copy()
+
+    def stop_recording(self):
+        deltas = self.weights - self.recorded
+        self.recorded = None
+        return [(feature, delta) for feature, delta in zip(LINEAR_FEATURES, deltas.tolist()) if delta != 0]
+
+    def pop_changed_entries(self):
+        changed = self.weights != self.recorded
+        self.recorded = self.weights.copy()
+        return [(feature, weight) for feature, weight, is_changed in
+                zip(LINEAR_FEATURES, self.weights.tolist(), changed.tolist()) if is_changed]
+
+    def save_model(self, map_num):
+        dir_path = get_path('linear_q_model', 'model/q_learning_map%d' % map_num)
+        os.makedirs(dir_path, exist_ok=True)
+        with open(os.path.join(dir_path, 'weights.json'), 'w') as f:
+            json.dump(dict(self.get_entries()), f, indent=2)
+        clear_segments(self.get_checkpoint_path(map_num))
+
+    def load_model(self, map_num):
+        model_path = os.path.join(get_path('linear_q_model', 'model/q_learning_map%d' % map_num), 'weights.json')
+        if os.path.exists(model_path) or not self.has_checkpoint(map_num):
+            with open(model_path) as f:
+                weights = json.load(f)
+            self.weights[:] = [weights[feature] for feature in LINEAR_FEATURES]
+        self.load_checkpoint(map_num)
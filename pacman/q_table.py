@@ -0,0 +1,411 @@
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+import numpy as np
+from pacman.agent import DIRECTIONS
+
+# column of each action in the q value array
+ACTION_INDEX = {direction: k for k, direction in enumerate(DIRECTIONS)}
+
+# bool mask of the columns of each set of actions, indexed by the action bits of encode_actions
+ACTION_MASKS = np.array([[action_bits >> k & 1 for k in range(len(DIRECTIONS))] for action_bits in range(16)],
+                        dtype=bool)
+
+# eviction policies of a BoundedQTable
+EVICTION_POLICIES = ('lru', 'lfu')
+
+# approximate bytes per state of a BoundedQTable: the q value row, visit count and last use, the state key int, and
+# its entries in the state id dict and the state key list
+STATE_BYTES = 208
+
+# largest fraction of the slots of a SharedQTable holding states, keeping its probe sequences short
+SHARED_LOAD_FACTOR = 0.5
+
+
+class ArrayQTable:
+    """
+    An array q table interns each state key to an integer id, and keeps the q values of all actions of a state in
+    a row of a growable float32 array of shape [n_states, 4], columns following DIRECTIONS.
+
+    The table is saved as two .npy files, the q values and the state keys in row order, so the q values can be
+    memory-mapped on load.
+    """
+
+    def __init__(self, capacity=1024):
+        self.state_ids = {}
+        self.state_keys = []
+        self.q_values = np.zeros((capacity, len(DIRECTIONS)), dtype=np.float32)
+
+        # how many times each row was reused by another state, None as rows of this table are never reused
+        self.generations = None
+
+    def __len__(self):
+        return len(self.state_keys)
+
+    def __contains__(self, state_key):
+        return state_key in self.state_ids
+
+    def get_state_id(self, state_key):
+        """
+        return: the row of the state, None if the state has not been added
+        """
+        return self.state_ids.get(state_key)
+
+    def add_state(self, state_key):
+        """
+        return: the row of the state, adding a row of zero q values if the state is new
+        """
+        state_id = self.state_ids.get(state_key)
+        if state_id is None:
+            state_id = len(self.state_keys)
+            if state_id == len(self.q_values):
+                self.grow(2 * state_id)
+            self.state_ids[state_key] = state_id
+            self.state_keys.append(state_key)
+        return state_id
+
+    def grow(self, capacity):
+        q_values = np.zeros((max(capacity, 1), len(DIRECTIONS)), dtype=np.float32)
+        q_values[:len(self)] = self.q_values[:len(self)]
+        self.q_values = q_values
+
+    def get_q_values(self, state_key):
+        """
+        return: the q value row of the state, None if the state has not been added
+        """
+        state_id = self.state_ids.get(state_key)
+        return None if state_id is None else self.q_values[state_id]
+
+    def save(self, dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+        np.save(os.path.join(dir_path, 'q_values.npy'), self.q_values[:len(self)])
+
+        if all(isinstance(state_key, int) and 0 <= state_key < 2 ** 64 for state_key in self.state_keys):
+            state_keys = np.array(self.state_keys, dtype=np.uint64)
+        else:
+            state_keys = np.empty(len(self), dtype=object)
+            state_keys[:] = self.state_keys
+        np.save(os.path.join(dir_path, 'state_keys.npy'), state_keys)
+
+    @classmethod
+    def load(cls, dir_path, mmap_mode=None):
+        """
+        mmap_mode: passed to np.load for the q values, 'c' maps the file copy-on-write so the loaded table can
+        still be trained, growing the table copies it into memory
+        """
+        q_table = cls(capacity=0)
+        q_table.q_values = np.load(os.path.join(dir_path, 'q_values.npy'), mmap_mode=mmap_mode)
+        q_table.state_keys = np.load(os.path.join(dir_path, 'state_keys.npy'), allow_pickle=True).tolist()
+        q_table.state_ids = dict(zip(q_table.state_keys, range(len(q_table.state_keys))))
+        return q_table
+
+
+class BoundedQTable(ArrayQTable):
+    """
+    A bounded q table keeps at most max_states states in a q value array allocated once, so a long training run
+    stays in a fixed memory footprint. A memory budget in bytes is turned into max_states by STATE_BYTES.
+
+    Every lookup of a state counts as a hit or a miss, and a hit updates the visit count and the last use of its
+    row. When a new state finds the table full, the coldest evict_fraction of the rows are evicted at once: the
+    least recently used for the 'lru' policy, the least visited for 'lfu', whose visit counts are then halved so
+    that states which were hot long ago can be evicted as well. The row touched last is never evicted, as its caller
+    may still be using it, e.g. the state of a transition whose next state is being added. Evicted rows are reused
+    by new states, the generation of a row counting its evictions.
+    """
+
+    def __init__(self, max_states=None, memory_budget=None, policy='lru', evict_fraction=1 / 16):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError('Undefined eviction policy: %s' % policy)
+        if max_states is None:
+            if memory_budget is None:
+                raise ValueError('a bounded q table needs max states or a memory budget')
+            max_states = memory_budget // STATE_BYTES
+        if max_states < 1:
+            raise ValueError('a bounded q table needs room for at least one state, got %d' % max_states)
+
+        super().__init__(max_states)
+        self.max_states = max_states
+        self.policy = policy
+        self.evict_count = max(int(max_states * evict_fraction), 1)
+        self.visits = np.zeros(max_states, dtype=np.uint32)
+        self.last_used = np.zeros(max_states, dtype=np.int64)
+        self.generations = np.zeros(max_states, dtype=np.uint32)
+        self.clock = 0
+        self.last_row = None
+        self.free_rows = []
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.state_ids)
+
+    def get_state_id(self, state_key):
+        state_id = self.state_ids.get(state_key)
+        self.touch(state_id)
+        return state_id
+
+    def add_state(self, state_key):
+        state_id = self.state_ids.get(state_key)
+        if state_id is None:
+            state_id = self.allocate_row()
+            self.state_ids[state_key] = state_id
+            self.state_keys[state_id] = state_key
+            self.visits[state_id] = 0
+        self.touch(state_id)
+        return state_id
+
+    def get_q_values(self, state_key):
+        state_id = self.state_ids.get(state_key)
+        self.touch(state_id)
+        return None if state_id is None else self.q_values[state_id]
+
+    def touch(self, state_id):
+        if state_id is None:
+            self.misses += 1
+            return
+        self.hits += 1
+        self.clock += 1
+        self.last_row = state_id
+        self.visits[state_id] += 1
+        self.last_used[state_id] = self.clock
+
+    def allocate_row(self):
+        if self.free_rows:
+            return self.free_rows.pop()
+        if len(self.state_keys) < self.max_states:
+            self.state_keys.append(None)
+            return len(self.state_keys) - 1
+
+        self.evict()
+        return self.free_rows.pop()
+
+    def evict(self):
+        """
+        Evict the evict_count coldest states, their rows are zeroed and put on the free list
+        """
+        scores = self.last_used if self.policy == 'lru' else self.visits
+        pinned = self.last_row if self.max_states > self.evict_count else None
+        if pinned is not None:
+            pinned_score, scores[pinned] = scores[pinned], np.iinfo(scores.dtype).max
+        rows = np.argpartition(scores, self.evict_count - 1)[:self.evict_count]
+        if pinned is not None:
+            scores[pinned] = pinned_score
+        for row in rows.tolist():
+            del self.state_ids[self.state_keys[row]]
+            self.state_keys[row] = None
+        self.q_values[rows] = 0
+        self.generations[rows] += 1
+        self.free_rows.extend(rows.tolist())
+        self.evictions += len(rows)
+        if self.policy == 'lfu':
+            self.visits >>= 1
+
+    def grow(self, capacity):
+        raise ValueError('a bounded q table does not grow beyond %d states' % self.max_states)
+
+    def get_stats(self):
+        """
+        return: dict of the number of states, max states, hits, misses, hit rate and evicted states
+        """
+        lookups = self.hits + self.misses
+        return {
+            'states': len(self),
+            'max_states': self.max_states,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0,
+            'evictions': self.evictions,
+        }
+
+    def save(self, dir_path):
+        """
+        Save the states in row order without the free rows, as an ArrayQTable
+        """
+        rows = sorted(self.state_ids.values())
+        q_table = ArrayQTable(capacity=0)
+        q_table.q_values = self.q_values[rows]
+        q_table.state_keys = [self.state_keys[row] for row in rows]
+        q_table.save(dir_path)
+
+    @classmethod
+    def load(cls, dir_path, max_states=None, memory_budget=None, policy='lru'):
+        """
+        Load the states of a saved q table, which must fit in the bound
+        """
+        q_table = ArrayQTable.load(dir_path)
+        bounded = cls(max_states, memory_budget, policy)
+        if len(q_table) > bounded.max_states:
+            raise ValueError('saved q table has %d states, more than the %d of the bound' %
+                             (len(q_table), bounded.max_states))
+        bounded.q_values[:len(q_table)] = q_table.q_values
+        bounded.state_keys = list(q_table.state_keys)
+        bounded.state_ids = dict(q_table.state_ids)
+        return bounded
+
+
+class SharedQTable(ArrayQTable):
+    """
+    A shared q table keeps its states and q values in shared memory, for Hogwild-style training: worker processes
+    read and update the q values of the same table concurrently, with no locks, no copies and no coordinator.
+    Updates racing on the same q value may lose one of them, which Hogwild training tolerates.
+
+    States are 64 bit int keys, as given by the 'zobrist' and 'feature' state representations, placed by an
+    open-addressing hash index: the slot of a state is its key modulo the number of slots, or the next free slot
+    when taken by another key, and the slot is the row of its q values. States are never removed, so the slot of a
+    key never changes, and each process caches the slots it has found. Only adding a state takes a lock. Its key
+    is written before its used flag, so readers never see a half-added state.
+
+    The table is created with room for max_states states, and is passed to worker processes as an argument of
+    multiprocessing.Process. close() detaches a process from the shared memory, and frees it in the creating
+    process.
+    """
+
+    def __init__(self, max_states=65536):
+        if max_states < 1:
+            raise ValueError('a shared q table needs room for at least one state, got %d' % max_states)
+        self.max_states = max_states
+        self.num_slots = 1 << (int(max_states / SHARED_LOAD_FACTOR) - 1).bit_length()
+        self.lock = multiprocessing.Lock()
+        self.memory = shared_memory.SharedMemory(create=True, size=get_shared_size(self.num_slots))
+        self.is_owner = True
+        self.attach()
+
+    def attach(self):
+        """
+        Create the views of the shared memory: the state count, the key and used flag of each slot, and the q values
+        """
+        buffer, num_slots = self.memory.buf, self.num_slots
+        self.state_count = np.ndarray(1, dtype=np.int64, buffer=buffer)
+        self.key_array = np.ndarray(num_slots, dtype=np.uint64, buffer=buffer, offset=8)
+        self.q_values = np.ndarray((num_slots, len(DIRECTIONS)), dtype=np.float32, buffer=buffer,
+                                   offset=8 + 8 * num_slots)
+        self.used_array = np.ndarray(num_slots, dtype=np.uint8, buffer=buffer,
+                                     offset=8 + (8 + 4 * len(DIRECTIONS)) * num_slots)
+
+        # memoryviews of the keys and used flags, whose items are read as python ints, faster than numpy scalars
+        self.keys = memoryview(self.key_array).cast('B').cast('Q')
+        self.used = memoryview(self.used_array)
+        self.generations = None
+        self.known_slots = {}
+
+    def __getstate__(self):
+        return self.memory.name, self.max_states, self.num_slots, self.lock
+
+    def __setstate__(self, state):
+        name, self.max_states, self.num_slots, self.lock = state
+        self.memory = shared_memory.SharedMemory(name=name)
+        self.is_owner = False
+        self.attach()
+
+    def __len__(self):
+        return int(self.state_count[0])
+
+    def __contains__(self, state_key):
+        return self.get_state_id(state_key) is not None
+
+    @property
+    def state_ids(self):
+        """
+        return: dict of the states added by all processes, key: state key, value: slot
+        """
+        slots = np.flatnonzero(self.used_array)
+        return dict(zip(self.key_array[slots].tolist(), slots.tolist()))
+
+    @property
+    def state_keys(self):
+        """
+        return: list of the state key of each slot, None for a free slot
+        """
+        return [state_key if is_used else None
+                for state_key, is_used in zip(self.key_array.tolist(), self.used_array.tolist())]
+
+    def get_state_id(self, state_key):
+        state_id = self.known_slots.get(state_key)
+        if state_id is None:
+            state_id = self.find_slot(state_key)
+            if not self.used[state_id]:
+                return None
+            self.known_slots[state_key] = state_id
+        return state_id
+
+    def add_state(self, state_key):
+        state_id = self.known_slots.get(state_key)
+        if state_id is not None:
+            return state_id
+
+        state_id = self.find_slot(state_key)
+        if not self.used[state_id]:
+            with self.lock:
+                # another process may have added states since the search
+                state_id = self.find_slot(state_key)
+                if not self.used[state_id]:
+                    if self.state_count[0] >= self.max_states:
+                        raise ValueError('shared q table is full with %d states' % self.max_states)
+                    self.keys[state_id] = state_key
+                    self.used[state_id] = 1
+                    self.state_count[0] += 1
+        self.known_slots[state_key] = state_id
+        return state_id
+
+    def find_slot(self, state_key):
+        """
+        return: the slot of the state, or the free slot ending its probe sequence if the state has not been added
+        """
+        if not isinstance(state_key, int) or not 0 <= state_key < 2 ** 64:
+            raise ValueError('a shared q table needs 64 bit int state keys, got %r' % (state_key,))
+        keys, used, slot_mask = self.keys, self.used, self.num_slots - 1
+        slot = state_key & slot_mask
+        while used[slot] and keys[slot] != state_key:
+            slot = (slot + 1) & slot_mask
+        return slot
+
+    def get_q_values(self, state_key):
+        state_id = self.get_state_id(state_key)
+        return None if state_id is None else self.q_values[state_id]
+
+    def grow(self, capacity):
+        raise ValueError('a shared q table does not grow beyond %d states' % self.max_states)
+
+    def close(self):
+        """
+        Detach from the shared memory, freeing it in the creating process. The table is unusable afterwards.
+        """
+        self.keys.release()
+        self.used.release()
+        del self.state_count, self.key_array, self.q_values, self.used_array, self.keys, self.used
+        self.memory.close()
+        if self.is_owner:
+            self.memory.unlink()
+
+    def save(self, dir_path):
+        """
+        Save the states in slot order without the free slots, as an ArrayQTable
+        """
+        state_ids = self.state_ids
+        q_table = ArrayQTable(capacity=0)
+        q_table.q_values = self.q_values[list(state_ids.values())]
+        q_table.state_keys = list(state_ids)
+        q_table.save(dir_path)
+
+    @classmethod
+    def load(cls, dir_path, max_states=65536):
+        """
+        Load the states of a saved q table into a new shared q table, they must fit in max_states
+        """
+        q_table = ArrayQTable.load(dir_path)
+        if len(q_table) > max_states:
+            raise ValueError('saved q table has %d states, more than the %d of the shared q table' %
+                             (len(q_table), max_states))
+        shared = cls(max_states)
+        for state_key, q_values in zip(q_table.state_keys, q_table.q_values):
+            shared.q_values[shared.add_state(state_key)] = q_values
+        return shared
+
+
+# -------------------- helper methods --------------------
+
+def get_shared_size(num_slots):
+    """
+    return: bytes of the shared memory of a SharedQTable: the state count, then a uint64 key, float32 q values and a
+    uint8 used flag per slot
+    """
+    return 8 + (8 + 4 * len(DIRECTIONS) + 1) * num_slots
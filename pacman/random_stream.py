@@ -0,0 +1,80 @@
+import numpy as np
+
+# number of random numbers drawn from a generator at once by RandomStream, and by BatchGameState for each game
+RNG_BLOCK_SIZE = 256
+
+
+class RandomStream:
+    """
+    A random stream gives the random numbers of the agents of a game state, from a seeded NumPy generator of its
+    own, so games are reproducible from their seed and games in the same process do not share a hidden stream.
+
+    Uniform numbers in [0, 1) are drawn RNG_BLOCK_SIZE at a time as float32, the way BatchGameState draws them, and
+    handed out one by one from a list, which is cheaper per move than a call into the random module.
+    """
+
+    def __init__(self, seed=None):
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """
+        Restart the stream from a seed: an int, a SeedSequence, or None for fresh entropy
+        """
+        self.seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.generator = np.random.default_rng(self.seed_sequence)
+        self.draw_block()
+
+    def draw_block(self):
+        self.block_state = self.generator.bit_generator.state
+        self.block = self.generator.random(RNG_BLOCK_SIZE, dtype=np.float32).tolist()
+        self.cursor = 0
+
+    def random(self):
+        """
+        return: the next uniform number in [0, 1)
+        """
+        if self.cursor == RNG_BLOCK_SIZE:
+            self.draw_block()
+        uniform = self.block[self.cursor]
+        self.cursor += 1
+        return uniform
+
+    def choice(self, seq):
+        """
+        return: a random element of a non-empty sequence. A sequence of one element is returned without drawing.
+        """
+        if len(seq) == 1:
+            return seq[0]
+        if self.cursor == RNG_BLOCK_SIZE:
+            self.draw_block()
+        uniform = self.block[self.cursor]
+        self.cursor += 1
+        return seq[int(uniform * len(seq))]
+
+    def spawn_seed(self):
+        """
+        return: a new 64 bit seed derived from the seed of the stream, without drawing from the stream
+        """
+        return int(self.seed_sequence.spawn(1)[0].generate_state(1, dtype=np.uint64)[0])
+
+    def get_seed_state(self, seed):
+        """
+        return: a state for setstate at the start of the numbers of another seed, the stream keeping its own seed
+        for spawn_seed
+        """
+        return type(self.generator.bit_generator)(seed).state, 0
+
+    def getstate(self):
+        """
+        return: the position in the stream, as the generator state at the start of the current block and the
+        cursor in the block
+        """
+        return self.block_state, self.cursor
+
+    def setstate(self, state):
+        block_state, cursor = state
+        if block_state is not self.block_state:
+            self.generator.bit_generator.state = block_state
+            self.draw_block()
+            self.block_state = block_state
+        self.cursor = cursor
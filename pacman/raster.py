@@ -0,0 +1,260 @@
+import numpy as np
+from pacman.agent import DIRECTIONS
+from pacman.render import pacman_color, ghost_color
+
+# rgb values of the Tk color names used by Render
+COLORS = {
+    'black': (0, 0, 0),
+    'white': (255, 255, 255),
+    'light grey': (211, 211, 211),
+    'light yellow': (255, 255, 224),
+    'red': (255, 0, 0),
+    'yellow': (255, 255, 0),
+    'dark cyan': (0, 139, 139),
+    'pink': (255, 192, 203),
+    'cyan': (0, 255, 255),
+    'orange': (255, 165, 0),
+}
+
+# start angle of the pacman arc for each of DIRECTIONS and for staying, as in Render.change_pacman_image
+PACMAN_START = (112.5, 292.5, 202.5, 22.5, 22.5)
+
+
+class Rasterizer:
+    """
+    A rasterizer draws games of a map into uint8 rgb arrays without a window, with the colors and shapes of Render:
+    walls, food, powerups, pacman arcs and ghosts, grid_size pixels per grid. Only the map is drawn, not the text
+    below it.
+
+    The background of walls and all food is drawn once. A frame is a copy of the background with eaten food
+    cleared and prerendered agent sprites pasted over it, each step vectorized over all frames of a batch.
+    """
+
+    def __init__(self, width, height, map_string, grid_size=30):
+        self.width = width
+        self.height = height
+        self.grid_size = grid_size
+
+        cells = np.array(list(map_string))
+        self.open_cells = np.flatnonzero(cells != '#')
+        self.initial_items = (cells == '*') | (cells == '@')
+
+        self.empty_tile = np.zeros((grid_size, grid_size, 3), dtype=np.uint8)
+        wall_tile = draw_sprite(grid_size, [(rectangle(0, 0, 1, 1), 'light grey'), (outline(0, 0, 1, 1), 'black')])[0]
+        food_tile, powerup_tile = [draw_sprite(grid_size, circle(0.5, 0.5, radius, fill_color))[0]
+                                   for radius, fill_color in [(1 / 8, 'light yellow'), (1 / 3, 'red')]]
+
+        self.background = np.zeros((height * grid_size, width * grid_size, 3), dtype=np.uint8)
+        background_tiles = get_tiles(self.background[None], height, width, grid_size)[0]
+        for tile, char in [(wall_tile, '#'), (food_tile, '*'), (powerup_tile, '@')]:
+            cell = np.flatnonzero(cells == char)
+            background_tiles[cell // width, cell % width] = tile
+
+        # sprites indexed by [color, direction], ghosts by [color, frightened, direction], with a pixel mask each
+        self.pacman_sprites, self.pacman_masks = stack_sprites(
+            [[draw_pacman(grid_size, pacman_color[k], start) for start in PACMAN_START]
+             for k in range(len(pacman_color))])
+        self.ghost_sprites, self.ghost_masks = stack_sprites(
+            [[[draw_ghost(grid_size, 'white' if frightened else ghost_color[k], direction)
+               for direction in DIRECTIONS + ((0, 0),)] for frightened in (False, True)]
+             for k in range(len(ghost_color))])
+
+    def render(self, game_state):
+        """
+        return: uint8 array of shape (height * grid_size, width * grid_size, 3), the frame of a GameState
+        """
+        return self.render_batch([game_state])[0]
+
+    def render_batch(self, game_states):
+        """
+        return: uint8 array of shape (len(game_states), height * grid_size, width * grid_size, 3)
+        """
+        n = len(game_states)
+        items = np.zeros((n, self.width * self.height), dtype=bool)
+        items[:, self.open_cells] = [game_state.food_mask | game_state.powerup_mask for game_state in game_states]
+
+        def get_agents(agents):
+            positions = np.array([[agent.y * self.width + agent.x for agent in agents(game_state)]
+                                  for game_state in game_states], dtype=np.intp).reshape(n, -1).T
+            directions = np.array([[get_direction_index(agent.move_direction) for agent in agents(game_state)]
+                                   for game_state in game_states], dtype=np.intp).reshape(n, -1).T
+            dead = np.array([[agent.is_dead() for agent in agents(game_state)]
+                             for game_state in game_states], dtype=bool).reshape(n, -1).T
+            return positions, directions, dead
+
+        frightened = np.array([game_state.is_pacman_invulnerable() for game_state in game_states], dtype=bool)
+        return self.draw(items, *get_agents(lambda game_state: game_state.pacmans),
+                         *get_agents(lambda game_state: game_state.ghosts), frightened)
+
+    def render_batch_game_state(self, batch_game_state, games=None):
+        """
+        return: uint8 array of shape (len(games), height * grid_size, width * grid_size, 3), the frames of some
+        games of a BatchGameState, all of them by default
+        """
+        batch = batch_game_state
+        games = np.arange(batch.num_games) if games is None else np.asarray(games, dtype=np.intp).reshape(-1)
+        return self.draw(batch.food[games] | batch.powerup[games],
+                         batch.pacman_pos[:, games], batch.pacman_dir[:, games], batch.pacman_dead[:, games],
+                         batch.ghost_pos[:, games], batch.ghost_dir[:, games], batch.ghost_dead[:, games],
+                         (batch.pacman_timer[:, games] > 0).any(axis=0))
+
+    def draw(self, items, pacman_pos, pacman_dir, pacman_dead, ghost_pos, ghost_dir, ghost_dead, frightened):
+        """
+        Draw a batch of frames
+        items: bool array of shape (n, width * height), the grids holding food or a powerup
+        pacman_pos, pacman_dir, pacman_dead: arrays of shape (num_pacmans, n), the grid of each pacman as
+        y * width + x, its direction as an index into DIRECTIONS (4 or -1 to stay), whether it is dead
+        ghost_pos, ghost_dir, ghost_dead: the same for the ghosts
+        frightened: bool array of shape (n,), whether the ghosts are drawn frightened
+        return: uint8 array of shape (n, height * grid_size, width * grid_size, 3)
+        """
+        n = len(items)
+        frames = np.empty((n,) + self.background.shape, dtype=np.uint8)
+        frames[:] = self.background
+        tiles = get_tiles(frames, self.height, self.width, self.grid_size)
+
+        # clear the eaten food
+        games, cells = np.nonzero(self.initial_items & ~items)
+        tiles[games, cells // self.width, cells % self.width] = self.empty_tile
+
+        # paste the pacmans, then the ghosts over them
+        for k in range(len(pacman_pos)):
+            color = k % len(pacman_color)
+            self.paste(tiles, pacman_pos[k], pacman_dead[k], self.pacman_sprites[color][pacman_dir[k]],
+                       self.pacman_masks[color][pacman_dir[k]])
+        for k in range(len(ghost_pos)):
+            color = k % len(ghost_color)
+            sprite_index = frightened.astype(np.intp), ghost_dir[k]
+            self.paste(tiles, ghost_pos[k], ghost_dead[k], self.ghost_sprites[color][sprite_index],
+                       self.ghost_masks[color][sprite_index])
+        return frames
+
+    def paste(self, tiles, positions, dead, sprites, masks):
+        games = np.flatnonzero(~dead)
+        y, x = positions[games] // self.width, positions[games] % self.width
+        tiles[games, y, x] = np.where(masks[games, ..., None], sprites[games], tiles[games, y, x])
+
+
+# -------------------- helper methods --------------------
+
+def get_tiles(frames, height, width, grid_size):
+    """
+    return: a view of frames of shape (n, height, width, grid_size, grid_size, 3), indexed by frame and grid
+    """
+    n = len(frames)
+    return frames.reshape(n, height, grid_size, width, grid_size, 3).swapaxes(2, 3)
+
+
+def get_direction_index(direction):
+    return DIRECTIONS.index(direction) if direction in DIRECTIONS else len(DIRECTIONS)
+
+
+def stack_sprites(sprites):
+    """
+    return: (uint8 array of the rgb values, bool array of the masks) of a nested list of (rgb, mask) sprites
+    """
+    if isinstance(sprites, tuple):
+        return sprites
+    stacked = [stack_sprites(sprite) for sprite in sprites]
+    return np.stack([rgb for rgb, _ in stacked]), np.stack([mask for _, mask in stacked])
+
+
+def draw_sprite(grid_size, shapes):
+    """
+    Paint shapes in order on a transparent grid sized sprite
+    shapes: list of (shape, color name), or a single one, where a shape maps pixel centres to a bool mask
+    return: (uint8 rgb array of shape (grid_size, grid_size, 3), bool mask of the painted pixels)
+    """
+    if not isinstance(shapes, list):
+        shapes = [shapes]
+    centres = (np.arange(grid_size) + 0.5) / grid_size
+    x, y = np.meshgrid(centres, centres)
+    rgb = np.zeros((grid_size, grid_size, 3), dtype=np.uint8)
+    mask = np.zeros((grid_size, grid_size), dtype=bool)
+    for shape, color in shapes:
+        painted = shape(x, y, 1 / grid_size)
+        rgb[painted] = COLORS[color]
+        mask |= painted
+    return rgb, mask
+
+
+def draw_pacman(grid_size, color, start):
+    return draw_sprite(grid_size, [(arc(0.5, 0.5, 0.5, start, 315), color),
+                                   (arc_outline(0.5, 0.5, 0.5, start, 315), 'black')])
+
+
+def draw_ghost(grid_size, color, direction):
+    """
+    Draw a ghost as Render.initialize_ghost does, with its pupils looking at its move direction
+    """
+    radius = 0.5
+    eye_x, eye_y = radius / 2.5, radius / 5
+    pupil_dx, pupil_dy = direction[0] * 2 / 30, direction[1] * 2 / 30
+    shapes = [(arc(0.5, 0.5, radius, 0, 180), color),
+              (arc_outline(0.5, 0.5, radius, 0, 180), 'black'),
+              (rectangle(0, 0.5, 1, 1), color),
+              (triangle((0.25, 0.75), (0, 1), (0.5, 1)), 'black'),
+              (triangle((0.75, 0.75), (0.5, 1), (1, 1)), 'black')]
+    for side in (-1, 1):
+        shapes.extend(circle(0.5 + side * eye_x, 0.5 - eye_y, radius / 3, 'white'))
+    for side in (-1, 1):
+        shapes.append((disk(0.5 + side * eye_x + pupil_dx, 0.5 - eye_y + pupil_dy, radius / 8), 'black'))
+    return draw_sprite(grid_size, shapes)
+
+
+# shapes, functions of the pixel centres x, y and the pixel size, in grid units
+
+def rectangle(x1, y1, x2, y2):
+    return lambda x, y, pixel: (x >= x1) & (x < x2) & (y >= y1) & (y < y2)
+
+
+def outline(x1, y1, x2, y2):
+    return lambda x, y, pixel: (rectangle(x1, y1, x2, y2)(x, y, pixel) &
+                                ~rectangle(x1 + pixel, y1 + pixel, x2 - pixel, y2 - pixel)(x, y, pixel))
+
+
+def disk(centre_x, centre_y, radius):
+    return lambda x, y, pixel: (x - centre_x) ** 2 + (y - centre_y) ** 2 <= radius ** 2
+
+
+def circle(centre_x, centre_y, radius, color):
+    """
+    return: the shapes of a circle filled with color, with a black outline
+    """
+    def ring(x, y, pixel):
+        return disk(centre_x, centre_y, radius)(x, y, pixel) & ~disk(centre_x, centre_y, radius - pixel)(x, y, pixel)
+    return [(disk(centre_x, centre_y, radius), color), (ring, 'black')]
+
+
+def arc(centre_x, centre_y, radius, start, extent):
+    """
+    A pie slice as drawn by Tk: angles in degrees, counter-clockwise from the positive x axis
+    """
+    def shape(x, y, pixel):
+        angle = np.degrees(np.arctan2(centre_y - y, x - centre_x))
+        return disk(centre_x, centre_y, radius)(x, y, pixel) & ((angle - start) % 360 <= extent)
+    return shape
+
+
+def arc_outline(centre_x, centre_y, radius, start, extent):
+    """
+    The pixels of a pie slice within a pixel of its curved edge or of its two straight edges
+    """
+    def shape(x, y, pixel):
+        dx, dy = x - centre_x, centre_y - y
+        near_edge = dx ** 2 + dy ** 2 > (radius - pixel) ** 2
+        for angle in np.radians([start, start + extent]):
+            along = dx * np.cos(angle) + dy * np.sin(angle)
+            across = np.abs(dx * np.sin(angle) - dy * np.cos(angle))
+            near_edge |= (along >= 0) & (across < pixel)
+        return arc(centre_x, centre_y, radius, start, extent)(x, y, pixel) & near_edge
+    return shape
+
+
+def triangle(p1, p2, p3):
+    def shape(x, y, pixel):
+        def side(a, b):
+            return (x - b[0]) * (a[1] - b[1]) - (a[0] - b[0]) * (y - b[1])
+        d1, d2, d3 = side(p1, p2), side(p2, p3), side(p3, p1)
+        return ~(((d1 < 0) | (d2 < 0) | (d3 < 0)) & ((d1 > 0) | (d2 > 0) | (d3 > 0)))
+    return shape
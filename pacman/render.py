@@ -1,4 +1,7 @@
+import threading
+import time
 import tkinter
+from collections import deque, namedtuple
 
 pacman_color = {
     0: 'yellow',
@@ -13,23 +16,49 @@ ghost_color = {
 }
 
 
+# what the render draws of a game state, taken after every tick of the simulation
+Snapshot = namedtuple('Snapshot', ['clock', 'time', 'score', 'invulnerable_time', 'pacmans', 'ghosts',
+                                   'food_bitboard'])
+
+
 class Render:
-    def __init__(self, window_size, frame_interval=0.1):
+    """
+    A render draws the game in a Tk window, independently of the simulation.
+
+    The simulation calls push_state after every tick, possibly from another thread, which takes a snapshot of the
+    game state. The window draws frames every frame_interval seconds with after(), moving the agents between the
+    latest two snapshots as the tick_interval passes. Snapshots older than the latest two are dropped, so a
+    simulation running faster than the display is never held back by it.
+    """
+
+    def __init__(self, window_size, frame_interval=1 / 60, tick_interval=0.1):
         self.grid_size = 30
         self.w, self.h = map(self.to_window_index, (max(window_size[0], 20), window_size[1]))
         self.starting_x, self.starting_y = 0 if window_size[0] > 20 else (20 - window_size[0]) / 2, 0
         self.frame_interval = frame_interval
+        self.tick_interval = tick_interval
+        self.snapshots = deque(maxlen=2)
+        self.simulation = None
+        self.simulation_error = None
+        self.closed = False
         self.setup()
 
     def setup(self):
         self._window = tkinter.Tk()
         self._window.title('Pac-Man')
+        self._window.protocol('WM_DELETE_WINDOW', self.close)
         self._canvas = tkinter.Canvas(self._window, width=self.w, height=self.h + 50)
         self._canvas.pack()
+        self.font = 'Purisa 20'
+        self.draw_background()
+
+        # bind keyboard input
+        self._window.bind("<KeyPress>", keyrelease)
+
+    def draw_background(self):
         self._canvas.create_rectangle(0, 0, self.w, self.h + 50, fill='black')
 
         # create game related text
-        self.font = 'Purisa 20'
         self.frame_time_text = self._canvas.create_text(self.w / 4, self.h + 25, fill='white', font=self.font,
                                                         text='time: %d' % 0)
         self.score_text = self._canvas.create_text(self.w / 2, self.h + 25, fill='white', font=self.font,
@@ -37,38 +66,108 @@ class Render:
         self.powerup_time_text = self._canvas.create_text(3 * self.w / 4, self.h + 25, fill='white', font=self.font,
                                                           text='powerup: %d' % 0)
 
-        # bind keyboard input
-        self._window.bind("<KeyPress>", keyrelease)
-
     def set_game_state(self, game_state):
         self.game_state = game_state
         self.food_images = self.initialize_static_object()
         self.pacman_images = self.initialize_pacman()
         self.ghost_images = self.initialize_ghost()
-        self.animated_images = []
+        self.snapshots.clear()
+        self.push_state()
+        self.drawn_snapshot, self.drawn_progress = self.snapshots[-1], 1
+        self.drawn_food_bitboard = self.drawn_snapshot.food_bitboard
         self._canvas.update()
 
-    def update(self):
-        # update display of pacman and ghost
-        self.move_pacman()
-        self.move_ghost()
-        self.create_animation()
+    def reset(self):
+        """
+        Redraw the whole game after the game state is reset
+        """
+        self._canvas.delete('all')
+        self.draw_background()
+        self.set_game_state(self.game_state)
+
+    def push_state(self):
+        """
+        Take a snapshot of the game state, called by the simulation after every tick
+        """
+        game_state = self.game_state
+        self.snapshots.append(Snapshot(
+            clock=time.perf_counter(),
+            time=game_state.get_time(),
+            score=game_state.get_score(),
+            invulnerable_time=game_state.get_pacman_invulnerable_time(),
+            pacmans=tuple(pacman.get_location() for pacman in game_state.pacmans),
+            ghosts=tuple((ghost.get_location(), ghost.is_dead()) for ghost in game_state.ghosts),
+            food_bitboard=game_state.food_bitboard | game_state.powerup_bitboard))
+
+    def run(self, simulate):
+        """
+        Run simulate in another thread while the window draws frames, until the simulation is over and its last
+        snapshot is drawn, or the window is closed
+        """
+        def run_simulation():
+            try:
+                simulate()
+            except BaseException as error:
+                self.simulation_error = error
+
+        self.simulation = threading.Thread(target=run_simulation, daemon=True)
+        self.simulation.start()
+        self._window.after(0, self.draw_frame)
+        self._window.mainloop()
+
+        self.simulation.join()
+        self.simulation = None
+        if self.simulation_error is not None:
+            error, self.simulation_error = self.simulation_error, None
+            raise error
 
-        # update display of game related text
-        self.update_text(self.frame_time_text, 'time: %s' % self.game_state.get_time())
-        self.update_text(self.powerup_time_text, 'powerup: %s' % self.game_state.get_pacman_invulnerable_time())
-        self.update_text(self.score_text, 'score: %d' % self.game_state.get_score())
+    def close(self):
+        self.closed = True
+        self._window.quit()
 
-        # self._canvas.update()
+    def is_closed(self):
+        return self.closed
+
+    # -------------------- frames --------------------
+
+    def draw_frame(self):
+        """
+        Draw the agents between the latest two snapshots, according to the time passed since the latest one
+        """
+        if self.closed:
+            return
+
+        snapshots = tuple(self.snapshots)
+        previous, latest = snapshots[0], snapshots[-1]
+        progress = 1 if self.tick_interval <= 0 else min((time.perf_counter() - latest.clock) / self.tick_interval, 1)
+
+        if latest is not self.drawn_snapshot or self.drawn_progress < 1:
+            self.move_pacman(previous, latest, progress)
+            self.move_ghost(previous, latest, progress)
+            self.remove_food(latest.food_bitboard)
+
+            # update display of game related text
+            self.update_text(self.frame_time_text, 'time: %s' % latest.time)
+            self.update_text(self.powerup_time_text, 'powerup: %s' % latest.invulnerable_time)
+            self.update_text(self.score_text, 'score: %d' % latest.score)
+            self.drawn_snapshot, self.drawn_progress = latest, progress
+
+        simulation_done = self.simulation is None or not self.simulation.is_alive()
+        if simulation_done and latest is self.snapshots[-1] and progress == 1:
+            self._window.quit()
+        else:
+            self._window.after(int(1000 * self.frame_interval), self.draw_frame)
 
     def initialize_static_object(self):
         """
         Create images of static object of the map, such as walls and food
-        return: food dict, key: food location, value: a image of the food
+        return: food dict, key: the number of the food grid in the food and powerup bitboards, value: a image of the
+        food
         """
         food = {}
         for y, row in enumerate(self.game_state.static_object_list):
             for x, col_elem in enumerate(row):
+                grid_index = self.game_state.grid_index[y, x]
                 x, y = x + self.starting_x, y + self.starting_y
                 if col_elem == '#':
                     x1, y1, x2, y2 = map(self.to_window_index, (x, y, (x + 1), (y + 1)))
@@ -77,29 +176,30 @@ class Render:
                     centre_x, centre_y = map(self.to_window_index, ((x + 0.5), (y + 0.5)))
                     radius = self.to_window_index(1 / 8) if col_elem == '*' else self.to_window_index(1 / 3)
                     fill_color = 'light yellow' if col_elem == '*' else 'red'
-                    food[(x, y)] = self.draw_circle(centre_x, centre_y, radius, fill_color)
+                    food[int(grid_index)] = self.draw_circle(centre_x, centre_y, radius, fill_color)
         return food
 
     def initialize_pacman(self):
         """
         Create images of the ghost by drawing a canvas arc shape
-        return: pacman_images dict, key: pacman number, value: a image of the ghost
+        return: pacman_images dict, key: pacman number, value: (drawn location, move direction, a image of the pacman)
         """
         pacman_images = {}
         for k, pacman in enumerate(self.game_state.pacmans):
             x, y = pacman.x, pacman.y
             x, y = x + self.starting_x, y + self.starting_y
             centre_x, centre_y, radius = map(self.to_window_index, ((x + 0.5), (y + 0.5), 0.5))
-            fill_color = pacman_color[k]
+            fill_color = pacman_color[k % len(pacman_color)]
 
             image = self.draw_arc(centre_x, centre_y, radius, 22.5, 315, fill_color)
-            pacman_images[k] = ((x, y), [image])
+            pacman_images[k] = ((pacman.x, pacman.y), (1, 0), [image])
         return pacman_images
 
     def initialize_ghost(self):
         """
         Create images of the ghost by drawing and combining various canvas shapes
-        return: ghost_images dict, key: ghost number, value: a list of image parts of the ghost
+        return: ghost_images dict, key: ghost number, value: (drawn location, move direction, whether it is drawn
+        frightened, a list of image parts of the ghost)
         """
         ghost_images = {}
         for k, ghost in enumerate(self.game_state.ghosts):
@@ -112,7 +212,7 @@ class Render:
                                            triangle1_vertices))
             triangle2_vertices = tuple(map(lambda i: (self.to_window_index(i[0]), self.to_window_index(i[1])),
                                            triangle2_vertices))
-            fill_color = ghost_color[k]
+            fill_color = ghost_color[k % len(ghost_color)]
 
             image = []
             image.append(self.draw_arc(centre_x, centre_y, radius, 0, 180, fill_color))
@@ -124,55 +224,54 @@ class Render:
             image.append(self.draw_circle(centre_x + radius / 2.5, centre_y - radius / 5, radius / 3, 'white'))
             image.append(self.draw_circle(centre_x - radius / 2.5, centre_y - radius / 5, radius / 8, 'black'))
             image.append(self.draw_circle(centre_x + radius / 2.5, centre_y - radius / 5, radius / 8, 'black'))
-            ghost_images[k] = ((x, y), (0, 0), image)
+            ghost_images[k] = ((ghost.x, ghost.y), (0, 0), False, image)
         return ghost_images
 
-    def move_pacman(self):
-        for k, pacman in enumerate(self.game_state.pacmans):
-            (old_x, old_y), image = self.pacman_images[k]
-            x, y = pacman.x, pacman.y
-            x, y = x + self.starting_x, y + self.starting_y
-            x_diff, y_diff = x - old_x, y - old_y
-            window_x_diff, window_y_diff = map(self.to_window_index, (x_diff, y_diff))
+    def move_pacman(self, previous, latest, progress):
+        for k, location in enumerate(latest.pacmans):
+            drawn_location, direction, image = self.pacman_images[k]
+            new_location = interpolate(previous.pacmans[k], location, progress)
+            self.move_image(image, drawn_location, new_location)
 
             # rotate pacman image if pacman's move direction changes
-            if (x_diff, y_diff) != (0, 0):
-                self.change_pacman_image(image, (x_diff, y_diff))
-
-            # move pacman image
-            self.animated_images.append((image, window_x_diff, window_y_diff))
-
-            # update pacman image location
-            self.pacman_images[k] = (x, y), image
+            new_direction = get_direction(previous.pacmans[k], location) or direction
+            if new_direction != direction:
+                self.change_pacman_image(image[0], new_direction)
 
-            # remove food if necessary
-            if (x, y) in self.food_images:
-                self.delete_image(self.food_images[(x, y)])
-                del self.food_images[(x, y)]
+            self.pacman_images[k] = new_location, new_direction, image
 
-    def move_ghost(self):
-        for k, ghost in enumerate(self.game_state.ghosts):
-            (old_x, old_y), (old_x_diff, old_y_diff), image = self.ghost_images[k]
-            x, y = ghost.x, ghost.y
-            x, y = x + self.starting_x, y + self.starting_y
-            x_diff, y_diff = x - old_x, y - old_y
-            window_x_diff, window_y_diff = map(self.to_window_index, (x_diff, y_diff))
+    def move_ghost(self, previous, latest, progress):
+        is_frightened = latest.invulnerable_time > 0
+        for k, (location, dead) in enumerate(latest.ghosts):
+            drawn_location, direction, frightened, image = self.ghost_images[k]
+            previous_location, previous_dead = previous.ghosts[k]
+            new_location = location if previous_dead else interpolate(previous_location, location, progress)
+            self.move_image(image, drawn_location, new_location)
 
             # modify the ghost image if the ghost's status changes
-            is_frightened = self.game_state.is_pacman_invulnerable()
-            self.change_ghost_image(image, (x_diff, y_diff), (old_x_diff, old_y_diff), is_frightened, ghost_color[k])
-
-            # move ghost image
+            new_direction = get_direction(previous_location, location) or (0, 0)
+            self.change_ghost_image(image, new_direction, direction, is_frightened, frightened,
+                                    ghost_color[k % len(ghost_color)])
             for i in image:
-                if ghost.is_dead():
-                    self._canvas.itemconfigure(i, state='hidden')
-                else:
-                    self._canvas.itemconfigure(i, state='normal')
-
-                self.animated_images.append((i, window_x_diff, window_y_diff))
-
-            # update ghost image location
-            self.ghost_images[k] = (x, y), (x_diff, y_diff), image
+                self._canvas.itemconfigure(i, state='hidden' if dead else 'normal')
+
+            self.ghost_images[k] = new_location, new_direction, is_frightened, image
+
+    def remove_food(self, food_bitboard):
+        eaten = self.drawn_food_bitboard & ~food_bitboard
+        if eaten:
+            while eaten:
+                grid_bit = eaten & -eaten
+                eaten ^= grid_bit
+                self.delete_image(self.food_images.pop(grid_bit.bit_length() - 1))
+            self.drawn_food_bitboard = food_bitboard
+
+    def move_image(self, image, drawn_location, new_location):
+        window_x_diff, window_y_diff = map(self.to_window_index, (new_location[0] - drawn_location[0],
+                                                                  new_location[1] - drawn_location[1]))
+        if window_x_diff or window_y_diff:
+            for i in image:
+                self._canvas.move(i, window_x_diff, window_y_diff)
 
     def change_pacman_image(self, image, direction):
         if direction != (0, 0):
@@ -184,26 +283,16 @@ class Render:
             }[direction]
             self._canvas.itemconfigure(image, start=start)
 
-    def change_ghost_image(self, image, direction, old_direction, is_frightened, original_color):
+    def change_ghost_image(self, image, direction, old_direction, is_frightened, was_frightened, original_color):
         if direction != old_direction:
             dx, dy = direction[0] - old_direction[0], direction[1] - old_direction[1]
 
             for i in image[-2:]:
                 self._canvas.move(i, dx * 2, dy * 2)
 
-        for i in image[:2]:
-            if is_frightened:
-                self._canvas.itemconfigure(i, fill='white')
-            else:
-                self._canvas.itemconfigure(i, fill=original_color)
-
-    def create_animation(self):
-        step = 5
-        for _ in range(step):
-            for image, window_x_diff, window_y_diff in self.animated_images:
-                self._canvas.move(image, window_x_diff / step, window_y_diff / step)
-            self.sleep(1 / step)
-        self.animated_images = []
+        if is_frightened != was_frightened:
+            for i in image[:2]:
+                self._canvas.itemconfigure(i, fill='white' if is_frightened else original_color)
 
     def update_text(self, text, text_content):
         self._canvas.itemconfigure(text, text=text_content)
@@ -228,10 +317,25 @@ class Render:
     def delete_image(self, image):
         self._canvas.delete(image)
 
-    def sleep(self, frames):
-        seconds = frames * self.frame_interval
-        self._window.after(int(1000 * seconds), self._window.quit)
-        self._window.mainloop()
+
+# -------------------- helper methods --------------------
+
+def interpolate(location1, location2, progress):
+    """
+    return: the location progress of the way from location1 to location2, location2 if they are not neighbours
+    """
+    (x1, y1), (x2, y2) = location1, location2
+    if abs(x2 - x1) + abs(y2 - y1) > 1:
+        return location2
+    return x1 + (x2 - x1) * progress, y1 + (y2 - y1) * progress
+
+
+def get_direction(location1, location2):
+    """
+    return: the move direction from location1 to its neighbour location2, None if they are not neighbours
+    """
+    direction = location2[0] - location1[0], location2[1] - location1[1]
+    return direction if abs(direction[0]) + abs(direction[1]) == 1 else None
 
 
 # -------------------- capture player keyboard commands --------------------
@@ -0,0 +1,250 @@
+import os
+import struct
+import time
+from collections import namedtuple
+import numpy as np
+from pacman.agent import DIRECTIONS
+from pacman.batch_game_state import STATUS
+from pacman.game_state import GameState
+from pacman.util import compile_level
+
+# start of a replay log file: magic and format version
+LOG_HEADER = struct.Struct('<4sH')
+LOG_MAGIC, LOG_VERSION = b'PMRL', 1
+
+# start of an episode record: level, seed, number of ticks, number of agents, final score and game status, followed
+# by the actions, 4 bits per agent per tick
+EPISODE_HEADER = struct.Struct('<HQIBiB')
+
+# action codes of the log: the index in DIRECTIONS, 4 for staying
+ACTIONS = DIRECTIONS + ((0, 0),)
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+
+# seconds per tick of a displayed replay at display_speed 1, as GameEnv.TICK_INTERVAL
+TICK_INTERVAL = 0.1
+
+Episode = namedtuple('Episode', ['level', 'seed', 'actions', 'score', 'status'])
+
+
+class ReplayWriter:
+    """
+    A replay writer appends episodes to a replay log. An episode is stored as its level, the seed of its random
+    numbers, the move direction taken by every agent (pacmans, then ghosts) at every tick, and its final score and
+    status, so the log stays small while every episode can be simulated again exactly.
+
+    The byte offset of every episode is appended to an index file next to the log, <path>.idx, for seeking. A
+    partly written last episode, left by a crash, is cut off when the log is opened again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        offsets, end = load_index(path)
+        self.file = open(path, 'ab')
+        if end == 0:
+            self.file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION))
+        else:
+            self.file.truncate(end)
+            self.file.seek(end)
+        self.index_file = open(get_index_path(path), 'ab')
+        self.num_episodes = len(offsets)
+
+    def __len__(self):
+        return self.num_episodes
+
+    def write_episode(self, level, seed, actions, score, status):
+        """
+        actions: list of the action codes of the agents at each tick, see ACTION_CODES
+        """
+        actions = np.asarray(actions, dtype=np.uint8).reshape(len(actions), -1)
+        offset = self.file.tell()
+        self.file.write(EPISODE_HEADER.pack(level, seed, actions.shape[0], actions.shape[1], score,
+                                            STATUS.index(status)))
+        self.file.write(pack_actions(actions))
+        self.index_file.write(struct.pack('<Q', offset))
+        self.num_episodes += 1
+
+    def flush(self):
+        self.file.flush()
+        self.index_file.flush()
+
+    def close(self):
+        self.file.close()
+        self.index_file.close()
+
+
+class ReplayPlayer:
+    """
+    A replay player reads episodes of a replay log by their index and simulates them again, with every agent
+    taking its recorded action, either headless at full speed or displayed by Render. A replayed episode must end
+    with the recorded score and status, otherwise ValueError is raised.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets, self.end = load_index(path)
+        self.file = open(path, 'rb')
+
+        # game states and renders of the replayed levels, key: level
+        self.game_states = {}
+        self.renders = {}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get_episode(self, index):
+        self.file.seek(self.offsets[index])
+        level, seed, num_ticks, num_agents, score, status = EPISODE_HEADER.unpack(
+            self.file.read(EPISODE_HEADER.size))
+        actions = unpack_actions(self.file.read(get_actions_size(num_ticks, num_agents)), num_ticks, num_agents)
+        return Episode(level, seed, actions, score, STATUS[status])
+
+    def replay(self, index, display=False, display_speed=1):
+        """
+        Simulate an episode again
+        display_speed: ticks are shown display_speed times faster than the TICK_INTERVAL pace, 0 for no waiting
+        return: the game state at the end of the episode
+        """
+        episode = self.get_episode(index)
+        game_state = self.get_game_state(episode.level)
+        agents = game_state.pacmans + game_state.ghosts
+        if len(agents) != episode.actions.shape[1]:
+            raise ValueError('episode %d has actions of %d agents, level %d has %d agents' %
+                             (index, episode.actions.shape[1], episode.level, len(agents)))
+
+        tick_interval = TICK_INTERVAL / display_speed if display and display_speed > 0 else 0
+
+        def play():
+            next_tick_time = time.perf_counter()
+            for tick_actions in episode.actions.tolist():
+                for agent, action in zip(agents, tick_actions):
+                    agent.set_action(ACTIONS[action])
+                game_state.update()
+
+                if display:
+                    render.push_state()
+                    next_tick_time += tick_interval
+                    time.sleep(max(next_tick_time - time.perf_counter(), 0))
+                    if render.is_closed():
+                        return
+
+        if display:
+            render = self.get_render(episode.level, game_state, tick_interval)
+            render.run(play)
+            if render.is_closed():
+                return game_state
+        else:
+            play()
+
+        if game_state.get_score() != episode.score or game_state.get_game_status() != episode.status:
+            raise ValueError('replay of episode %d ended with score %d, %s, recorded score %d, %s' %
+                             (index, game_state.get_score(), game_state.get_game_status(), episode.score,
+                              episode.status))
+        return game_state
+
+    def get_game_state(self, level):
+        if level in self.game_states:
+            game_state = self.game_states[level]
+            game_state.reset()
+            return game_state
+
+        width, height, map_string = compile_level(level)
+        game_state = GameState(width, height, map_string, 3, 3, level=level)
+
+        # replayed agents take the recorded actions, the way agents of a learning agent take its chosen actions
+        for agent in game_state.pacmans + game_state.ghosts:
+            agent.player_number = 3
+        self.game_states[level] = game_state
+        return game_state
+
+    def get_render(self, level, game_state, tick_interval):
+        """
+        tick_interval: seconds per tick, the pace the render interpolates the agents at
+        """
+        from pacman.render import Render
+
+        if level not in self.renders:
+            self.renders[level] = Render(window_size=(game_state.width, game_state.height),
+                                         tick_interval=tick_interval)
+            self.renders[level].set_game_state(game_state)
+        else:
+            self.renders[level].reset()
+            self.renders[level].tick_interval = tick_interval
+        return self.renders[level]
+
+    def close(self):
+        self.file.close()
+
+
+# -------------------- helper methods --------------------
+
+def get_index_path(path):
+    return path + '.idx'
+
+
+def get_actions_size(num_ticks, num_agents):
+    return (num_ticks * num_agents + 1) // 2
+
+
+def pack_actions(actions):
+    """
+    Pack an array of action codes into bytes, 2 codes per byte, low bits first
+    """
+    codes = actions.reshape(-1)
+    if codes.size % 2:
+        codes = np.append(codes, 0).astype(np.uint8)
+    return (codes[0::2] | codes[1::2] << 4).tobytes()
+
+
+def unpack_actions(data, num_ticks, num_agents):
+    """
+    return: uint8 array of the action codes of shape (num_ticks, num_agents)
+    """
+    packed = np.frombuffer(data, dtype=np.uint8)
+    codes = np.empty(packed.size * 2, dtype=np.uint8)
+    codes[0::2], codes[1::2] = packed & 15, packed >> 4
+    return codes[:num_ticks * num_agents].reshape(num_ticks, num_agents)
+
+
+def load_index(path):
+    """
+    Load the episode offsets of a replay log from its index file, scanning the log for the episodes missing from
+    the index, which are added to the index file
+    return: (uint64 array of the offsets of the complete episodes, the end of the last one, 0 for no log)
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint64), 0
+
+    index_path = get_index_path(path)
+    offsets = np.fromfile(index_path, dtype='<u8') if os.path.exists(index_path) else np.zeros(0, dtype=np.uint64)
+    size = os.path.getsize(path)
+
+    with open(path, 'rb') as f:
+        magic, version = LOG_HEADER.unpack(f.read(LOG_HEADER.size))
+        if magic != LOG_MAGIC or version != LOG_VERSION:
+            raise ValueError('not a replay log of version %d: %s' % (LOG_VERSION, path))
+
+        def read_end(offset):
+            f.seek(offset)
+            header = f.read(EPISODE_HEADER.size)
+            if len(header) < EPISODE_HEADER.size:
+                return None
+            num_ticks, num_agents = EPISODE_HEADER.unpack(header)[2:4]
+            end = offset + EPISODE_HEADER.size + get_actions_size(num_ticks, num_agents)
+            return end if end <= size else None
+
+        # drop indexed episodes which are not complete, then scan the rest of the log
+        while len(offsets) > 0 and read_end(int(offsets[-1])) is None:
+            offsets = offsets[:-1]
+        end = read_end(int(offsets[-1])) if len(offsets) > 0 else LOG_HEADER.size
+        new_offsets = []
+        while True:
+            next_end = read_end(end)
+            if next_end is None:
+                break
+            new_offsets.append(end)
+            end = next_end
+
+    offsets = np.concatenate([offsets, np.array(new_offsets, dtype=np.uint64)]).astype(np.uint64)
+    if new_offsets or not os.path.exists(index_path) or os.path.getsize(index_path) != offsets.nbytes:
+        offsets.astype('<u8').tofile(index_path)
+    return offsets, end
@@ -0,0 +1,210 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import time
+import tracemalloc
+import numpy as np
+from pacman.game_state import GameState
+from pacman.game_state_repr import STATE_REPRS
+from pacman.maze_generator import generate_level
+
+# game state updates between checks of the measured time
+UPDATE_CHUNK = 100
+
+# bytes per unit of ru_maxrss, kilobytes on Linux, bytes on macOS
+RSS_UNIT = 1 if platform.system() == 'Darwin' else 1024
+
+# start method of the memory workers: a process started by exec keeps the peak RSS of its parent on Linux, workers
+# forked by the fork server, started at the first board, keep the peak RSS of the server instead
+MEMORY_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+try:
+    import resource
+except ImportError:
+    # no peak RSS on Windows
+    resource = None
+
+
+class StressTest:
+    """
+    A stress test reports how the simulator scales with the board size and the number of ghosts, on levels made by
+    generate_level: the seconds to build a game state by GameState.load_map, the first time for a map and again
+    with its move tables cached, GameState.update steps per second with random agents, the cost of
+    GameState.get_state for each state representation, and the seconds to set up a Render for the board.
+
+    The memory of a game state is measured in fresh worker processes, so the tables cached per map are counted
+    and one board does not hide the peak of another: the megabytes a game state keeps and the peak megabytes
+    allocated while it is built, traced by tracemalloc, and the peak RSS of a process building it untraced, where
+    the resource module is available. The peak RSS includes the interpreter and the imported modules.
+
+    The feature state representations are left out by default, their pair distance tables grow with the square of
+    the open grids. The render is skipped when no Tk display is available.
+    """
+
+    def __init__(self, sizes=(10, 50, 100, 200, 500), ghost_counts=(1, 4, 16, 64, 256), ghost_board_size=100,
+                 min_time=1.0, state_reprs=('simple', 'zobrist'), render=True, seed=0):
+        self.sizes = sizes
+        self.ghost_counts = ghost_counts
+        self.ghost_board_size = ghost_board_size
+        self.min_time = min_time
+        self.state_reprs = state_reprs
+        self.render = render
+        self.seed = seed
+        self.results = []
+
+    def run(self):
+        for size in self.sizes:
+            self.stress_board(size, None)
+        for num_ghosts in self.ghost_counts:
+            self.stress_board(self.ghost_board_size, num_ghosts)
+        return self.results
+
+    def add_result(self, name, size, num_ghosts, value, unit):
+        self.results.append({'name': name, 'size': size, 'ghosts': num_ghosts, 'value': value, 'unit': unit})
+        print('%4d x %-4d %4d ghosts %-28s %14.2f %s' % (size, size, num_ghosts, name, value, unit))
+
+    def stress_board(self, size, num_ghosts):
+        """
+        Run the measurements on a generated size x size level, with num_ghosts ghosts or the default ghost density
+        """
+        map_string = generate_level(size, size, self.seed, num_ghosts=num_ghosts)
+        num_ghosts = map_string.count('M')
+
+        start = time.perf_counter()
+        game_state = GameState(size, size, map_string, 0, 0, seed=self.seed)
+        self.add_result('load_map', size, num_ghosts, time.perf_counter() - start, 's')
+        start = time.perf_counter()
+        GameState(size, size, map_string, 0, 0, seed=self.seed)
+        self.add_result('load_map.cached', size, num_ghosts, time.perf_counter() - start, 's')
+        self.stress_memory(size, num_ghosts, map_string)
+
+        # random games on a large board may not end for a long time, so updates run in chunks across games
+        def run():
+            for _ in range(UPDATE_CHUNK):
+                if game_state.is_game_over():
+                    game_state.reset()
+                game_state.update()
+            return UPDATE_CHUNK
+
+        self.add_result('update', size, num_ghosts, self.measure(run), 'steps/s')
+
+        for name in self.state_reprs:
+            game_state.state_repr_class = STATE_REPRS[name]
+            self.add_result('get_state.%s' % name, size, num_ghosts, 1e6 * self.measure_get_state(game_state),
+                            'us')
+
+        if self.render:
+            self.stress_render(game_state, size, num_ghosts)
+
+    def stress_memory(self, size, num_ghosts, map_string):
+        with multiprocessing.get_context(MEMORY_START_METHOD).Pool(1, maxtasksperchild=1) as pool:
+            current, peak = pool.apply(trace_game_state, (size, map_string, self.seed))
+            self.add_result('game_state.memory', size, num_ghosts, current / 2 ** 20, 'MB')
+            self.add_result('load_map.peak_memory', size, num_ghosts, peak / 2 ** 20, 'MB')
+            if resource is not None:
+                peak_rss = pool.apply(get_game_state_rss, (size, map_string, self.seed))
+                self.add_result('load_map.peak_rss', size, num_ghosts, peak_rss / 2 ** 20, 'MB')
+
+    def measure_get_state(self, game_state):
+        """
+        Time only the get_state calls, not the updates between them, over the states of random games
+        return: seconds per call
+        """
+        calls, elapsed = 0, 0
+        while elapsed < self.min_time:
+            game_state.reset()
+            while not game_state.is_game_over() and elapsed < self.min_time:
+                game_state.update()
+                start = time.perf_counter()
+                game_state.get_state()
+                elapsed += time.perf_counter() - start
+                calls += 1
+        return elapsed / calls
+
+    def stress_render(self, game_state, size, num_ghosts):
+        try:
+            import tkinter
+            from pacman.render import Render
+        except ImportError as error:
+            self.skip_render(error)
+            return
+
+        start = time.perf_counter()
+        try:
+            render = Render(window_size=(size, size))
+        except tkinter.TclError as error:
+            self.skip_render(error)
+            return
+        render.set_game_state(game_state)
+        self.add_result('render_setup', size, num_ghosts, time.perf_counter() - start, 's')
+        render._window.destroy()
+
+    def skip_render(self, error):
+        print('render skipped: %s' % error)
+        self.render = False
+
+    # -------------------- helper methods --------------------
+
+    def measure(self, run):
+        """
+        Call run until min_time seconds have passed, run returns the number of operations it did
+        return: operations per second
+        """
+        operations = 0
+        start = time.perf_counter()
+        while True:
+            operations += run()
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.min_time:
+                return operations / elapsed
+
+
+# -------------------- worker processes --------------------
+
+def trace_game_state(size, map_string, seed):
+    """
+    return: bytes allocated by a game state built in this process and still held, peak bytes while building it
+    """
+    tracemalloc.start()
+    game_state = GameState(size, size, map_string, 0, 0, seed=seed)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del game_state
+    return current, peak
+
+
+def get_game_state_rss(size, map_string, seed):
+    """
+    return: peak RSS in bytes of this process after building a game state
+    """
+    GameState(size, size, map_string, 0, 0, seed=seed)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stress the Pac-Man simulator with large generated levels')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 100, 200, 500],
+                        help='widths and heights of the square boards')
+    parser.add_argument('--ghosts', type=int, nargs='+', default=[1, 4, 16, 64, 256],
+                        help='numbers of ghosts, on a board of --ghost-board-size')
+    parser.add_argument('--ghost-board-size', type=int, default=100)
+    parser.add_argument('--min-time', type=float, default=1.0, help='seconds each measurement runs at least')
+    parser.add_argument('--state-reprs', nargs='+', default=['simple', 'zobrist'], choices=sorted(STATE_REPRS))
+    parser.add_argument('--no-render', action='store_true', help='skip the render setup')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='stress.json', help='path of the json results')
+    args = parser.parse_args()
+
+    stress_test = StressTest(args.sizes, args.ghosts, args.ghost_board_size, args.min_time, args.state_reprs,
+                             not args.no_render, args.seed)
+    results = stress_test.run()
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -1,12 +1,139 @@
 import os
+from collections import namedtuple
+import numpy as np
+
+# distance between grids which are not connected, also the largest distance a table can hold
+UNREACHABLE = np.iinfo(np.uint16).max
+
+# loaded pair distance tables, key: level, value: (grid_index, distances)
+_pair_distances = {}
+
+# a level read once, see compile_level
+CompiledLevel = namedtuple('CompiledLevel', ['width', 'height', 'map_string'])
+
+# compiled levels, key: level, value: CompiledLevel
+_compiled_levels = {}
 
 
 def get_path(file_name, dir_name):
     full_path = os.path.abspath(os.path.join(dir_name, file_name))
     return full_path
 
-def calculate_pair_distances():
-    pass
+
+def read_level(level):
+    path = get_path('level%d.txt' % level, 'maps')
+    with open(path) as f:
+        map_rows = f.readlines()
+
+    map_rows = [x.strip()[::2] for x in map_rows]
+    width, height = len(max(map_rows, key=len)), len(map_rows)
+    map_string = ''.join(map_rows)
+    return width, height, map_string
+
+
+def compile_level(level):
+    """
+    Read a level once per process, a GameEnv reset or a replay of the same level reuses it
+    return: CompiledLevel
+    """
+    if level not in _compiled_levels:
+        _compiled_levels[level] = CompiledLevel(*read_level(level))
+    return _compiled_levels[level]
+
+
+def get_grid_index(width, height, map_string):
+    """
+    Number the non-wall grids of a map in row-major order
+    return: int array of shape (height, width), the index of each grid among the non-wall grids, -1 for walls
+    """
+    is_open = np.array(list(map_string)).reshape(height, width) != '#'
+    grid_index = np.full((height, width), -1, dtype=np.int32)
+    grid_index[is_open] = np.arange(is_open.sum())
+    return grid_index
+
+
+def to_bitboard(flags):
+    """
+    Pack a sequence of booleans into a Python int, bit k being set when flags[k] is true
+    """
+    packed = np.packbits(np.asarray(flags, dtype=bool), bitorder='little')
+    return int.from_bytes(packed.tobytes(), 'little')
+
+
+def calculate_pair_distances(width, height, map_string):
+    """
+    Calculate the shortest path distance between every pair of non-wall grids, by running a breadth first search
+    from all grids at once
+    return: uint16 array of shape (n, n) indexed by get_grid_index, UNREACHABLE for grids which are not connected
+    """
+    grid_index = get_grid_index(width, height, map_string)
+    y, x = np.nonzero(grid_index >= 0)
+    n = x.size
+
+    neighbours = np.empty((n, 4), dtype=np.intp)
+    for d, (dx, dy) in enumerate([(0, -1), (0, 1), (-1, 0), (1, 0)]):
+        next_x, next_y = x + dx, y + dy
+        inside = (next_x >= 0) & (next_x < width) & (next_y >= 0) & (next_y < height)
+        neighbour = np.full(n, -1)
+        neighbour[inside] = grid_index[next_y[inside], next_x[inside]]
+        neighbours[:, d] = np.where(neighbour >= 0, neighbour, np.arange(n))
+
+    distances = np.full((n, n), UNREACHABLE, dtype=np.uint16)
+    np.fill_diagonal(distances, 0)
+    reached = np.eye(n, dtype=bool)
+    frontier = reached
+    distance = 0
+    while frontier.any():
+        distance += 1
+        if distance == UNREACHABLE:
+            raise ValueError('map is too large for a pair distance table')
+        frontier = (frontier[:, neighbours[:, 0]] | frontier[:, neighbours[:, 1]] |
+                    frontier[:, neighbours[:, 2]] | frontier[:, neighbours[:, 3]]) & ~reached
+        reached |= frontier
+        distances[frontier] = distance
+
+    return distances
+
+
+def load_pair_distances(level):
+    """
+    Load the pair distance table of a level. The table is cached as a .npy file next to the map and memory-mapped,
+    it is recalculated when missing or older than the map.
+    return: (grid_index, distances), see get_grid_index and calculate_pair_distances
+    """
+    if level in _pair_distances:
+        return _pair_distances[level]
+
+    width, height, map_string = read_level(level)
+    grid_index = get_grid_index(width, height, map_string)
+    n = int((grid_index >= 0).sum())
+    map_path = get_path('level%d.txt' % level, 'maps')
+    cache_path = get_path('level%d_distances.npy' % level, 'maps')
+
+    distances = None
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(map_path):
+        distances = np.load(cache_path, mmap_mode='r')
+        if distances.shape != (n, n) or distances.dtype != np.uint16:
+            distances = None
+
+    if distances is None:
+        temp_path = cache_path + '.tmp.npy'
+        np.save(temp_path, calculate_pair_distances(width, height, map_string))
+        os.replace(temp_path, cache_path)
+        distances = np.load(cache_path, mmap_mode='r')
+
+    # a plain array view of the mapped file avoids memmap overhead on every lookup
+    distances = np.asarray(distances)
+    _pair_distances[level] = grid_index, distances
+    return grid_index, distances
+
 
 def get_pair_distances(level, index1, index2):
-    pass
\ No newline at end of file
+    """
+    return: the shortest path distance between two non-wall grids of a level, given as (x, y) location indexes
+    """
+    grid_index, distances = load_pair_distances(level)
+    (x1, y1), (x2, y2) = index1, index2
+    if grid_index[y1, x1] < 0 or grid_index[y2, x2] < 0:
+        raise ValueError('no distance to a wall grid: %s, %s' % (index1, index2))
+    return int(distances[grid_index[y1, x1], grid_index[y2, x2]])
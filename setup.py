@@ -13,9 +13,10 @@ setup(
     url='',
     license='',
     packages=find_packages(),
+    python_requires='>=3.8',
     package_data={},
     install_requires=[
-        'numpy'
+        'numpy>=1.17'
     ]
 )
 